@@ -0,0 +1,132 @@
+"""
+ローカルの分類器を前段に置いた場合の、LLMとの一致率と削減できる時間を計測する
+
+定型的な短い会話(挨拶・感謝・謝罪・確認・同意)と、LLMでないと分類できない長い会話を混ぜた
+ラベル付きデータを作り、前半を学習(過去の分類結果)、後半を評価に使う。
+LLMはScriptedChatModelで、保存済みのラベルをlatency秒かけて返す。
+
+    python -m src.bench.category_classifier --examples 1000 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.category_classifier import TieredClassifier, evaluate, train
+from src.graph.conversation_classification import Conversation, ConversationClassification, build_chain
+
+TRIVIAL = {
+    '挨拶': [
+        'おはよう',
+        'おはようございます',
+        'こんにちは！',
+        'こんばんは',
+        'はじめまして',
+        'またね',
+        'お疲れさまです',
+    ],
+    '感謝': ['ありがとう', 'ありがとうございます！', '本当に助かりました', 'いつもありがとう', '感謝してます'],
+    '謝罪': ['ごめんなさい', '遅れてすみません', '申し訳ありません', 'ごめん、忘れてた'],
+    '確認': ['明日の10時で大丈夫ですか？', '場所は駅前ですよね？', 'それで合ってますか？', '確認ですが、今日ですよね'],
+    '同意': ['そうだね', 'いいね！', '賛成です', 'その通りだと思う', 'わかりました'],
+}
+COMPLEX = {
+    '相談': '{topic}のことでずっと悩んでいて、{detail}。どうしたらいいと思う？',
+    '不満': '{topic}の対応が本当にひどくて、{detail}。もう我慢できない。',
+    '物語': '昨日{topic}に行ったんだけど、{detail}。すごく印象に残ってる。',
+    '説明': '{topic}の仕組みを説明すると、{detail}ということになります。',
+    '討論': '{topic}については反対意見もあるけど、{detail}という点で私は賛成できない。',
+}
+TOPICS = ['仕事', '引っ越し', '旅行', '新しいプロジェクト', '家族', '学校', 'サポート窓口', '健康診断']
+DETAILS = [
+    '何度問い合わせても返事がなかった',
+    '思っていたよりずっと時間がかかった',
+    'みんなの意見がばらばらでまとまらなかった',
+    '最初の計画から大きく変わってしまった',
+    '予算が足りなくなりそうだった',
+]
+
+
+def make_examples(count: int, trivial_ratio: float = 0.6, seed: int = 0) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    examples = []
+    for _ in range(count):
+        if rng.random() < trivial_ratio:
+            category = rng.choice(list(TRIVIAL))
+            examples.append((rng.choice(TRIVIAL[category]), category))
+        else:
+            category = rng.choice(list(COMPLEX))
+            text = COMPLEX[category].format(topic=rng.choice(TOPICS), detail=rng.choice(DETAILS))
+            examples.append((text, category))
+    return examples
+
+
+def _labeling_llm(labels: dict[str, str], latency: float) -> ScriptedChatModel:
+    def respond(messages):
+        text = str(messages[-1].content)
+        conversation = Conversation(
+            category=labels[text],
+            purpose='',
+            discourse_analysis='',
+            text=text,
+            keywords=[],
+            emotion_fluctuation=50,
+        )
+        return ConversationClassification(conversations=[conversation])
+
+    return ScriptedChatModel(responses=[respond], latency=latency)
+
+
+async def _measure(chain, examples: list[tuple[str, str]], concurrency: int = 8) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def classify(text: str):
+        async with semaphore:
+            await chain.ainvoke({'messages': [('human', text)]})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(classify(text) for text, _ in examples))
+    return time.perf_counter() - start
+
+
+def run(examples: int = 1000, latency: float = 0.05, threshold: float = 0.8, seed: int = 0) -> dict:
+    data = make_examples(examples, seed=seed)
+    split = len(data) // 2
+    history, test = data[:split], data[split:]
+    model = train(history)
+
+    report = {
+        'examples': len(test),
+        'offline': [evaluate(model, test, t) for t in (0.5, 0.6, 0.7, 0.8, 0.9)],
+        'seed_only': evaluate(train(), test, threshold),
+    }
+
+    llm = _labeling_llm(dict(data), latency)
+    classifier = TieredClassifier(model, threshold=threshold)
+    llm_only = asyncio.run(_measure(build_chain(llm), test))
+    tiered = asyncio.run(_measure(classifier.as_runnable(build_chain(llm)), test))
+    report.update(
+        {
+            'llm_latency': latency,
+            'llm_only_seconds': llm_only,
+            'tiered_seconds': tiered,
+            'tiered': classifier.stats.summary(),
+        }
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--examples', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--threshold', type=float, default=0.8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.examples, args.latency, args.threshold), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+長いthreadの途中に巻き戻すときの、checkpointの探し方による時間とメモリの違いを比較する
+
+- full_history: 従来どおりget_state_historyを全てリストにして添字で選ぶ
+- indexed: CheckpointHistoryの索引でstepから探し、1つだけ読み込む
+
+1回のinvokeでsteps回ループするグラフで、steps個のcheckpointを持つthreadを作る。
+
+    python -m src.bench.checkpoint_history --steps 10000 --lookups 20
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from langgraph.graph import END, START, StateGraph
+from typing_extensions import TypedDict
+
+from src.graph.checkpoint_history import CheckpointHistory, IndexedMemorySaver
+
+
+class Counter(TypedDict):
+    count: int
+    limit: int
+
+
+def _build_thread(steps: int):
+    builder = StateGraph(Counter)
+    builder.add_node('increment', lambda state: {'count': state['count'] + 1})
+    builder.add_edge(START, 'increment')
+    builder.add_conditional_edges('increment', lambda state: END if state['count'] >= state['limit'] else 'increment')
+    graph = builder.compile(checkpointer=IndexedMemorySaver())
+    config = {'configurable': {'thread_id': 'long'}, 'recursion_limit': steps + 10}
+    graph.invoke({'count': 0, 'limit': steps}, config)
+    return graph, config
+
+
+def _measure(lookup, targets: list[int]) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    for step in targets:
+        assert lookup(step)['count'] == step
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms_per_lookup': elapsed / len(targets) * 1000, 'peak_mb': peak / 2**20}
+
+
+def run(steps: int = 10000, lookups: int = 20, seed: int = 0) -> dict:
+    graph, config = _build_thread(steps)
+    history = CheckpointHistory(graph)
+    targets = random.Random(seed).sample(range(1, steps + 1), lookups)
+
+    def full_history(step: int) -> dict:
+        all_states = list(graph.get_state_history(config))
+        # 新しい順に並んでいるので、stepのcheckpointは後ろからstep + 2番目
+        return all_states[-(step + 2)].values
+
+    def indexed(step: int) -> dict:
+        return history.state(history.at_step(config, step)).values
+
+    return {
+        'steps': steps,
+        'lookups': lookups,
+        'full_history': _measure(full_history, targets[: max(lookups // 10, 1)]),
+        'indexed': _measure(indexed, targets),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.steps, args.lookups), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+長時間動くworkerを想定して多数のthreadで会話を続けたときの、checkpointのメモリ使用量を比較する
+
+- memory: 従来どおりMemorySaverで全てのcheckpointを保持する
+- retention: RetainingMemorySaverでkeep_last件だけを残す(バックグラウンドでcompactionする)
+
+    python -m src.bench.checkpoint_retention --threads 200 --turns 20
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.checkpoint_retention import RetainingMemorySaver, RetentionPolicy
+from src.graph.memory import build_graph
+
+
+def _checkpoint_count(saver: MemorySaver) -> int:
+    return sum(len(saved) for namespaces in saver.storage.values() for saved in namespaces.values())
+
+
+def run(saver_name: str, threads: int, turns: int, keep_last: int = 4) -> dict:
+    tracemalloc.start()
+    if saver_name == 'retention':
+        saver = RetainingMemorySaver(RetentionPolicy(keep_last=keep_last))
+        saver.start(interval=0.05)
+    else:
+        saver = MemorySaver()
+    model = ScriptedChatModel(responses=[lambda messages: f'回答{len(messages)}'])
+    graph = build_graph(model=model, checkpointer=saver)
+
+    start = time.perf_counter()
+    for turn in range(turns):
+        for i in range(threads):
+            config = {'configurable': {'thread_id': str(i)}}
+            graph.invoke({'messages': [{'role': 'user', 'content': f'質問{turn}'}]}, config)
+    elapsed = time.perf_counter() - start
+
+    if isinstance(saver, RetainingMemorySaver):
+        saver.stop()
+        saver.compact()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'saver': saver_name,
+        'threads': threads,
+        'turns': turns,
+        'checkpoints': _checkpoint_count(saver),
+        'invokes_per_second': threads * turns / elapsed,
+        'current_mb': current / 2**20,
+        'peak_mb': peak / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--keep-last', type=int, default=4)
+    args = parser.parse_args()
+    results = [run(name, args.threads, args.turns, args.keep_last) for name in ('memory', 'retention')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+ConversationStoreに大量の分類結果を追記し、集計にかかる時間とメモリを計測する
+
+- ingest: rows件をchunk件ずつ追記する速さ
+- queries: カテゴリの件数・キーワードの出現回数・週ごとの集計(全件と条件付き)にかかる時間
+- memory: Conversationのまま持つ場合の1件あたりのメモリと、ストアの集計中のピークメモリ
+
+    python -m src.bench.conversation_store --rows 10000000
+"""
+
+import argparse
+import csv
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.graph.conversation_classification import CATEGORY_TABLE, Conversation
+from src.graph.conversation_store import ColumnBatch, ConversationStore, to_micros
+
+CATEGORIES = [row['パターン名'] for row in csv.DictReader(io.StringIO(CATEGORY_TABLE))]
+START = datetime(2024, 1, 1).astimezone()
+
+
+def _batch(rng: np.random.Generator, n: int, vocabulary: list[str], users: int, days: int) -> ColumnBatch:
+    counts = rng.integers(0, 5, n)
+    words = rng.integers(0, len(vocabulary), int(counts.sum()))
+    offsets = np.cumsum(counts)
+    keywords = [[vocabulary[w] for w in ws] for ws in np.split(words, offsets[:-1])]
+    return ColumnBatch(
+        created_at=to_micros(START) + rng.integers(0, days * 86_400_000_000, n),
+        emotion_fluctuation=rng.integers(0, 101, n).astype(np.uint8),
+        category=[CATEGORIES[i] for i in rng.integers(0, len(CATEGORIES), n)],
+        keywords=keywords,
+        user=[f'user-{i}' for i in rng.integers(0, users, n)],
+    )
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _pydantic_bytes_per_row(n: int) -> float:
+    tracemalloc.start()
+    conversations = [
+        Conversation(
+            category=CATEGORIES[i % len(CATEGORIES)],
+            purpose=f'目的{i}',
+            discourse_analysis='',
+            text='',
+            keywords=[f'キーワード{i % 5000}', f'キーワード{(i * 7) % 5000}'],
+            created_at=START + timedelta(seconds=i),
+            emotion_fluctuation=i % 101,
+        )
+        for i in range(n)
+    ]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del conversations
+    return current / n
+
+
+def run(rows: int = 10_000_000, chunk: int = 1_000_000, users: int = 10_000, days: int = 365, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    vocabulary = [f'キーワード{i}' for i in range(5000)]
+    with tempfile.TemporaryDirectory() as path:
+        store = ConversationStore(path)
+        ingest = 0.0
+        for offset in range(0, rows, chunk):
+            batch = _batch(rng, min(chunk, rows - offset), vocabulary, users, days)
+            ingest += _timed(lambda batch=batch: store.append_batch(batch))
+
+        # 開き直して、ファイルから読む場合を計測する
+        store = ConversationStore(path)
+        month = {'start': START + timedelta(days=30), 'end': START + timedelta(days=60)}
+        queries = {
+            'category_histogram': lambda: store.category_histogram(),
+            'category_histogram_month': lambda: store.category_histogram(**month),
+            'keyword_frequency': lambda: store.keyword_frequency(top=20),
+            'keyword_frequency_category': lambda: store.keyword_frequency(top=20, category='相談'),
+            'weekly_aggregates': lambda: store.period_aggregates('week'),
+            'daily_aggregates_user': lambda: store.period_aggregates('day', user='user-1'),
+        }
+        tracemalloc.start()
+        seconds = {name: _timed(query) for name, query in queries.items()}
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'ingest_rows_per_second': rows / ingest,
+        'query_seconds': seconds,
+        'query_peak_mb': peak / 2**20,
+        'pydantic_bytes_per_row': _pydantic_bytes_per_row(100_000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--chunk', type=int, default=1_000_000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.chunk), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+MessagesStateのthreadをNターン続けたときの、checkpointの保存量と読み込み時間を比較する
+
+- memory: 従来どおりMemorySaverでcheckpointごとにmessagesの全体を保存する
+- delta: DeltaMemorySaverで追加されたメッセージだけを保存する
+
+    python -m src.bench.delta_checkpoint --turns 50 200
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.delta_checkpoint import DeltaMemorySaver
+from src.graph.memory import build_graph
+
+
+def _stored_bytes(saver: MemorySaver) -> int:
+    return sum(
+        len(c[1]) + len(m[1]) for ns in saver.storage.values() for saved in ns.values() for c, m, _ in saved.values()
+    )
+
+
+def _timed(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(saver_name: str, turns: int, snapshot_interval: int = 16, repeat: int = 20) -> dict:
+    saver = DeltaMemorySaver(snapshot_interval=snapshot_interval) if saver_name == 'delta' else MemorySaver()
+    # 実際の会話に近い長さのメッセージにする
+    model = ScriptedChatModel(responses=[lambda messages: f'回答{len(messages)} ' + 'これは回答の本文です。' * 20])
+    graph = build_graph(model=model, checkpointer=saver)
+    config = {'configurable': {'thread_id': '1'}}
+
+    start = time.perf_counter()
+    for i in range(turns):
+        graph.invoke({'messages': [{'role': 'user', 'content': f'質問{i} ' + 'これは質問の本文です。' * 10}]}, config)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'saver': saver_name,
+        'turns': turns,
+        'bytes_written': _stored_bytes(saver),
+        'invoke_mean_ms': elapsed / turns * 1000,
+        'get_state_p50_ms': _timed(lambda: graph.get_state(config), repeat),
+        'history_p50_ms': _timed(lambda: list(graph.get_state_history(config)), max(repeat // 10, 1)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--snapshot-interval', type=int, default=16)
+    args = parser.parse_args()
+    results = [run(name, turns, args.snapshot_interval) for turns in args.turns for name in ('memory', 'delta')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+ユーザーごとのemotion_fluctuationの推移の計算方法による速さの比較
+
+- recompute: 会話が届くたびに、そのユーザーの全履歴から直近windowの平均・分散と指数加重平均を計算し直す
+- incremental: TrendEngine.updateで1件ずつ更新する
+- backfill: TrendEngine.backfillで履歴全体を配列のまま取り込む
+
+    python -m src.bench.emotion_trend --users 1000 --events 200000 --backfill-events 10000000
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+
+from src.graph.emotion_trend import TrendConfig, TrendEngine
+
+_DAY = 86_400_000_000
+
+
+def _events(rng: np.random.Generator, users: int, events: int, days: int) -> tuple[np.ndarray, ...]:
+    codes = rng.integers(0, users, events)
+    created_at = 1_700_000_000_000_000 + np.sort(rng.integers(0, days * _DAY, events))
+    emotion = rng.integers(0, 101, events).astype(np.float64)
+    return codes, emotion, created_at
+
+
+def _recompute(times: np.ndarray, values: np.ndarray, config: TrendConfig) -> tuple[float, float, float]:
+    window = values[times > times[-1] - config.window // timedelta(microseconds=1)]
+    dt = np.diff(times, prepend=times[0]).astype(np.float64)
+    ewma = values[0]
+    for x, d in zip(values[1:], dt[1:], strict=True):
+        ewma += (1 - 0.5 ** (d / config.half_lives[0])) * (x - ewma)
+    return float(window.mean()), float(window.var()), float(ewma)
+
+
+def run(users: int = 1000, events: int = 200_000, backfill_events: int = 10_000_000, days: int = 365) -> dict:
+    rng = np.random.default_rng(0)
+    config = TrendConfig()
+    names = [f'user-{i}' for i in range(users)]
+    codes, emotion, created_at = _events(rng, users, events, days)
+
+    # 全履歴から計算し直す方法は遅いので、最後の1000件だけ計測する
+    history: dict[int, tuple[list[int], list[float]]] = {}
+    for code, x, at in zip(codes[:-1000], emotion[:-1000], created_at[:-1000], strict=True):
+        times, values = history.setdefault(int(code), ([], []))
+        times.append(int(at))
+        values.append(float(x))
+    start = time.perf_counter()
+    for code, x, at in zip(codes[-1000:], emotion[-1000:], created_at[-1000:], strict=True):
+        times, values = history.setdefault(int(code), ([], []))
+        times.append(int(at))
+        values.append(float(x))
+        _recompute(np.array(times), np.array(values), config)
+    recompute = (time.perf_counter() - start) / 1000
+
+    engine = TrendEngine(config)
+    start = time.perf_counter()
+    for code, x, at in zip(codes, emotion, created_at, strict=True):
+        engine.update(names[code], float(x), int(at))
+    incremental = (time.perf_counter() - start) / events
+
+    codes, emotion, created_at = _events(rng, users, backfill_events, days)
+    backfilled = TrendEngine(config)
+    start = time.perf_counter()
+    backfilled.backfill(codes, names, emotion, created_at)
+    backfill_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as path:
+        state = Path(path) / 'trend.npz'
+        start = time.perf_counter()
+        backfilled.save(state)
+        save_seconds = time.perf_counter() - start
+        state_bytes = state.stat().st_size
+        start = time.perf_counter()
+        TrendEngine.load(state, config)
+        load_seconds = time.perf_counter() - start
+
+    return {
+        'users': users,
+        'mean_history_length': events / users,
+        'recompute_us_per_update': recompute * 1e6,
+        'incremental_us_per_update': incremental * 1e6,
+        'backfill_events': backfill_events,
+        'backfill_seconds': backfill_seconds,
+        'state_bytes_per_user': state_bytes / users,
+        'save_seconds': save_seconds,
+        'load_seconds': load_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=200_000)
+    parser.add_argument('--backfill-events', type=int, default=10_000_000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.users, args.events, args.backfill_events), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+ネットワークを使わずにグラフを動かすための決定的なチャットモデル
+
+ベンチマークとテストで、ChatOpenAIの代わりに渡して使う。
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import AsyncIterator, Callable, Iterator, Sequence
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel
+
+# 応答の台本。文字列・AIMessage・pydanticモデル(構造化出力)・入力メッセージを受け取る関数のいずれか
+Script = str | AIMessage | BaseModel | Callable[[list[BaseMessage]], Any]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    台本どおりに応答するチャットモデル
+
+    responsesを先頭から順に返し、最後まで使い切ったら先頭に戻る。
+    pydanticモデルを返すと、with_structured_outputで使えるようにツール呼び出しに変換する
+    (method='json_schema'の場合は本文のJSONにする)。
+    ストリーミングでは本文とツール呼び出しの引数をchunk_size文字ずつ、token_latency秒おきに返す。
+    """
+
+    responses: list[Any]
+    # 1回の呼び出しにかかる時間(秒)。モデルの応答待ちを模擬する
+    latency: float = 0.0
+    # ストリーミング時の1チャンクの文字数と、チャンク間の待ち時間(秒)
+    chunk_size: int = 4
+    token_latency: float = 0.0
+    model_name: str = 'scripted'
+    call_count: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted'
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {'model_name': self.model_name}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> Runnable:
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema: Any, *, include_raw: bool = False, **kwargs: Any) -> Runnable:
+        # ChatOpenAIと同じ引数(method, strict)を受け付ける。json_schemaは本文のJSONとして、それ以外はツール呼び出しとして扱う
+        method = kwargs.pop('method', None)
+        kwargs.pop('strict', None)
+        if method == 'json_schema' and not include_raw:
+            if isinstance(schema, type) and issubclass(schema, BaseModel):
+                return self.bind(response_format=schema) | PydanticOutputParser(pydantic_object=schema)
+            return self.bind(response_format=schema) | JsonOutputParser()
+        return super().with_structured_output(schema, include_raw=include_raw, **kwargs)
+
+    def _next_message(
+        self, messages: list[BaseMessage], tools: list[dict] | None, response_format: Any = None
+    ) -> AIMessage:
+        script = self.responses[self.call_count % len(self.responses)]
+        self.call_count += 1
+        if callable(script) and not isinstance(script, BaseModel):
+            script = script(messages)
+        if isinstance(script, AIMessage):
+            return script
+        if isinstance(script, BaseModel) and response_format is not None:
+            return AIMessage(content=script.model_dump_json())
+        if isinstance(script, BaseModel):
+            name = type(script).__name__
+            if tools and len(tools) == 1:
+                name = tools[0]['function']['name']
+            tool_call = {'name': name, 'args': script.model_dump(mode='json'), 'id': f'call_{uuid.uuid4().hex[:12]}'}
+            return AIMessage(content='', tool_calls=[tool_call])
+        return AIMessage(content=str(script))
+
+    def _result(self, message: AIMessage, messages: list[BaseMessage]) -> ChatResult:
+        prompt_tokens = sum(len(str(m.content)) for m in messages)
+        completion_tokens = len(str(message.content)) + sum(len(str(c['args'])) for c in message.tool_calls)
+        message = message.model_copy(
+            update={
+                'usage_metadata': {
+                    'input_tokens': prompt_tokens,
+                    'output_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+                'response_metadata': {'model_name': self.model_name},
+            }
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._next_message(messages, kwargs.get('tools'), kwargs.get('response_format'))
+        if self.token_latency:
+            time.sleep(self._generation_seconds(message))
+        return self._result(message, messages)
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = self._next_message(messages, kwargs.get('tools'), kwargs.get('response_format'))
+        if self.token_latency:
+            await asyncio.sleep(self._generation_seconds(message))
+        return self._result(message, messages)
+
+    def _generation_seconds(self, message: AIMessage) -> float:
+        # ストリーミングしない場合も、全チャンクを生成し終えるまでと同じだけ待つ
+        return self.token_latency * (len(self._pieces(message)) - 1)
+
+    def _split(self, text: str) -> list[str]:
+        return [text[i : i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    def _pieces(self, message: AIMessage) -> list[dict[str, Any]]:
+        """
+        ストリーミングで返すチャンクの中身。本文とツール呼び出しの引数(JSON)をchunk_size文字ずつに分ける
+        """
+        pieces: list[dict[str, Any]] = [{'content': text} for text in self._split(str(message.content))]
+        for index, call in enumerate(message.tool_calls):
+            args = self._split(json.dumps(call['args'], ensure_ascii=False)) or ['']
+            for i, text in enumerate(args):
+                # 名前とidは最初のチャンクにだけ付ける(OpenAIと同じ)
+                name, call_id = (call['name'], call['id']) if i == 0 else (None, None)
+                pieces.append(
+                    {'content': '', 'tool_call_chunks': [{'name': name, 'args': text, 'id': call_id, 'index': index}]}
+                )
+        return pieces or [{'content': ''}]
+
+    def _chunks(self, messages: list[BaseMessage], **kwargs: Any) -> list[ChatGenerationChunk]:
+        message = (
+            self._result(self._next_message(messages, kwargs.get('tools'), kwargs.get('response_format')), messages)
+            .generations[0]
+            .message
+        )
+        pieces = self._pieces(message)
+        # 使用量は最後のチャンクに付ける
+        pieces[-1] = {
+            **pieces[-1],
+            'usage_metadata': message.usage_metadata,
+            'response_metadata': message.response_metadata,
+        }
+        return [ChatGenerationChunk(message=AIMessageChunk(**piece)) for piece in pieces]
+
+    def _chunk_due(self, start: float, index: int) -> float:
+        # 待ち時間の誤差が積み重ならないよう、生成開始からの予定時刻に合わせて返す
+        return start + index * self.token_latency
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        start = time.perf_counter()
+        for i, chunk in enumerate(self._chunks(messages, **kwargs)):
+            if self.token_latency:
+                time.sleep(max(self._chunk_due(start, i) - time.perf_counter(), 0))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        start = time.perf_counter()
+        for i, chunk in enumerate(self._chunks(messages, **kwargs)):
+            if self.token_latency:
+                await asyncio.sleep(max(self._chunk_due(start, i) - time.perf_counter(), 0))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
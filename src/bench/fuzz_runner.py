@@ -0,0 +1,88 @@
+"""
+langfuzzのcall_modelを1件ずつ同期で呼ぶ場合と、fuzz_runnerで並列に呼ぶ場合のスループットを比較する
+
+ローカルのOpenAI互換スタブサーバーに対して実行するので、ネットワークもAPIキーも不要。
+single_clientは全コネクションを1つのクライアントに持たせた場合で、ClientPoolで分けた場合と比較する。
+fail_everyで429を混ぜ、再試行込みのスループットも計測する。
+
+    python -m src.bench.fuzz_runner --questions 1000 --latency 0.05 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import time
+
+from openai import OpenAI
+
+from src.bench.openai_stub import OpenAIStubServer
+from src.langfuzz.call_model import call_model
+from src.langfuzz.fuzz_runner import ClientPool, run_fuzz
+
+
+def _sequential(questions: list[str], latency: float) -> float:
+    server = OpenAIStubServer(latency=latency)
+    with server.in_thread(), contextlib.redirect_stdout(io.StringIO()):
+        client = OpenAI(base_url=server.base_url, api_key='stub', max_retries=0)
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for question in questions:
+            call_model(question, client=client, rng=rng)
+        elapsed = time.perf_counter() - start
+        client.close()
+    return len(questions) / elapsed
+
+
+async def _concurrent(
+    questions: list[str],
+    latency: float,
+    concurrency: int,
+    fail_every: int | None = None,
+    connections_per_client: int = 8,
+) -> dict:
+    async with OpenAIStubServer(latency=latency, fail_every=fail_every) as server:
+        async with ClientPool(concurrency, connections_per_client, base_url=server.base_url, api_key='stub') as pool:
+            _, stats = await run_fuzz(questions, client=pool, concurrency=concurrency, base_delay=latency)
+    return {**stats.summary(), 'connections': server.connections, 'max_in_flight': server.max_in_flight}
+
+
+def run(
+    questions: int = 1000,
+    latency: float = 0.05,
+    concurrency: int = 64,
+    fail_every: int | None = 20,
+    sequential_questions: int = 50,
+) -> dict:
+    items = [f'猿について質問 {i}' for i in range(questions)]
+    sequential_qps = _sequential(items[:sequential_questions], latency)
+    # 1つのクライアントに全コネクションを持たせた場合と比較する
+    single_client = asyncio.run(_concurrent(items, latency, concurrency, connections_per_client=concurrency))
+    concurrent = asyncio.run(_concurrent(items, latency, concurrency))
+    with_failures = asyncio.run(_concurrent(items, latency, concurrency, fail_every))
+    return {
+        'questions': questions,
+        'latency': latency,
+        'concurrency': concurrency,
+        'sequential_questions_per_second': sequential_qps,
+        'single_client': single_client,
+        'concurrent': concurrent,
+        'speedup': concurrent['questions_per_second'] / sequential_qps,
+        f'with_429_every_{fail_every}': with_failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--fail-every', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.questions, args.latency, args.concurrency, args.fail_every), indent=2))
+
+
+if __name__ == '__main__':
+    main()
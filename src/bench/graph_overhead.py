@@ -0,0 +1,340 @@
+"""
+LangGraphのオーケストレーションにかかる時間を、LLMとツールの時間から切り分けて計測する
+
+各グラフをScriptedChatModelとネットワークを使わないツールで動かし、次の3回に分けて計測する。
+
+- latency: 計測のためのコールバックを付けずに実行し、1回の実行時間のp50/p99を求める
+- breakdown: コールバックでノード・superstepごとの時間と、LLM・ツールの時間を記録する
+  (オーケストレーションの時間 = 実行時間 - LLMとツールの時間)
+- alloc: tracemallocで1回の実行あたりのピークメモリと、実行後に残るメモリを求める
+
+結果はJSONファイルに書き出す。--baselineに以前の結果を渡すと、p50がmax-regressionの割合以上遅くなったシナリオを表示して終了コード1を返す。
+
+    python -m src.bench.graph_overhead --iterations 200 --output bench-results/graph_overhead.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from importlib.metadata import version
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.store.memory import InMemoryStore
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph import basic, plan_and_execute, state_manage, store, tool_calling
+from src.graph.instrumentation import top_level_node
+
+
+@dataclass
+class Scenario:
+    name: str
+    graph: Any
+    inputs: Callable[[], dict]
+    config: dict
+    # ノードがasyncのグラフはainvokeで実行する
+    is_async: bool = False
+
+
+@tool
+def fake_search(query: str) -> str:
+    """検索結果を返す(ネットワークを使わない)"""
+    return f'{query} の検索結果: 2024年のオリンピックはパリで開催された'
+
+
+def _call_tool_once(name: str, args: dict, answer: str) -> Callable[[list[BaseMessage]], AIMessage | str]:
+    """1回目はツールを呼び出し、ツールの結果を受け取ったら回答するreact agent用の台本"""
+
+    def respond(messages: list[BaseMessage]) -> AIMessage | str:
+        if isinstance(messages[-1], ToolMessage):
+            return answer
+        return AIMessage(content='', tool_calls=[{'name': name, 'args': args, 'id': 'call_bench'}])
+
+    return respond
+
+
+def build_scenarios() -> list[Scenario]:
+    plan = plan_and_execute.Plan(steps=['開催地を調べる', '結果をまとめる'])
+    app = plan_and_execute.build_app(
+        planner=plan_and_execute.build_planner(ScriptedChatModel(responses=[plan])),
+        replanner=plan_and_execute.build_replanner(
+            ScriptedChatModel(
+                responses=[
+                    plan_and_execute.Act(action=plan_and_execute.Plan(steps=['結果をまとめる'])),
+                    plan_and_execute.Act(action=plan_and_execute.Response(response='パリです')),
+                ]
+            )
+        ),
+        agent_executor=plan_and_execute.build_agent_executor(
+            ScriptedChatModel(responses=[_call_tool_once('fake_search', {'query': 'オリンピック'}, 'パリ')]),
+            tools=[fake_search],
+        ),
+    )
+
+    memory_store = InMemoryStore()
+    memory_store.put(('memories', '1'), 'name', {'data': 'User name is Bob'})
+
+    return [
+        Scenario('basic', basic.build_graph(), lambda: {'input_value': '1'}, {}),
+        Scenario('state_manage', state_manage.build_graph(), lambda: {'question': 'hello'}, {}),
+        Scenario(
+            'plan_and_execute',
+            app,
+            lambda: {'input': '2024年のオリンピックの開催地はどこですか？'},
+            {'recursion_limit': 50},
+            is_async=True,
+        ),
+        Scenario(
+            'store',
+            store.build_graph(model=ScriptedChatModel(responses=['Bobです']), store=memory_store),
+            lambda: {'messages': [{'type': 'user', 'content': 'What is my name?'}]},
+            {'configurable': {'user_id': '1'}},
+        ),
+        Scenario(
+            'react_agent',
+            tool_calling.build_agent(
+                ScriptedChatModel(responses=[_call_tool_once('add', {'a': 3, 'b': 4}, '7です')]),
+                tools=[tool_calling.add],
+            ),
+            lambda: {'messages': ['3 + 4の計算結果は？']},
+            {},
+        ),
+        Scenario(
+            'react_agent_return_direct',
+            tool_calling.build_agent(
+                ScriptedChatModel(responses=[_call_tool_once('Add', {'a': 3, 'b': 4}, '7です')]),
+                tools=[tool_calling.AddTool()],
+            ),
+            lambda: {'messages': ['3 + 4の計算結果は？']},
+            {},
+        ),
+    ]
+
+
+class NodeTimer(BaseCallbackHandler):
+    """トップレベルのノードの実行時間と、その中でLLM・ツールにかかった時間を記録する"""
+
+    run_inline = True
+
+    def __init__(self):
+        self.nodes: dict[UUID, dict] = {}
+        self.external_starts: dict[UUID, tuple[str | None, float]] = {}
+        self.external: dict[str | None, float] = defaultdict(float)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        ns = metadata.get('langgraph_checkpoint_ns', '')
+        if ns and '|' not in ns and kwargs.get('name') == metadata.get('langgraph_node'):
+            self.nodes[run_id] = {
+                'node': metadata['langgraph_node'],
+                'step': metadata['langgraph_step'],
+                'start': time.perf_counter(),
+                'end': None,
+            }
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self.nodes:
+            self.nodes[run_id]['end'] = time.perf_counter()
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_chain_end(None, run_id=run_id)
+
+    def _start_external(self, run_id: UUID, metadata: dict | None) -> None:
+        self.external_starts[run_id] = (top_level_node(metadata), time.perf_counter())
+
+    def _end_external(self, run_id: UUID) -> None:
+        if run_id in self.external_starts:
+            node, start = self.external_starts.pop(run_id)
+            self.external[node] += time.perf_counter() - start
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        self._start_external(run_id, metadata)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_external(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_external(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        self._start_external(run_id, metadata)
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_external(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_external(run_id)
+
+
+def _percentile(samples: list[float], q: int) -> float:
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[q - 1]
+
+
+def _invoker(scenario: Scenario, loop: asyncio.AbstractEventLoop) -> Callable[[dict], Any]:
+    if not scenario.is_async:
+        return lambda config: scenario.graph.invoke(scenario.inputs(), config)
+    return lambda config: loop.run_until_complete(scenario.graph.ainvoke(scenario.inputs(), config))
+
+
+def _measure_latency(invoke: Callable[[dict], Any], scenario: Scenario, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        invoke(scenario.config)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _measure_breakdown(invoke: Callable[[dict], Any], scenario: Scenario, iterations: int) -> dict:
+    node_ms: dict[str, list[float]] = defaultdict(list)
+    node_overhead_ms: dict[str, list[float]] = defaultdict(list)
+    calls: dict[str, int] = defaultdict(int)
+    supersteps, superstep_overhead_ms, external_ms, orchestration_ms = [], [], [], []
+    for _ in range(iterations):
+        timer = NodeTimer()
+        config = {**scenario.config, 'callbacks': [timer]}
+        start = time.perf_counter()
+        invoke(config)
+        wall = time.perf_counter() - start
+
+        spans: dict[int, list[float]] = {}
+        durations: dict[str, list[float]] = defaultdict(list)
+        for span in timer.nodes.values():
+            durations[span['node']].append(span['end'] - span['start'])
+            step = spans.setdefault(span['step'], [span['start'], span['end']])
+            step[0], step[1] = min(step[0], span['start']), max(step[1], span['end'])
+        for node, seconds in durations.items():
+            node_ms[node].extend(d * 1000 for d in seconds)
+            calls[node] += len(seconds)
+            # 同じノードが複数回呼ばれた場合は、1回あたりの平均でオーバーヘッドを求める
+            node_overhead_ms[node].append((sum(seconds) - timer.external.get(node, 0.0)) / len(seconds) * 1000)
+
+        external = sum(timer.external.values())
+        # superstepの間(ノードが1つも動いていない時間)をスケジューリングのオーバーヘッドとみなす
+        idle = wall - sum(end - start for start, end in spans.values())
+        supersteps.append(len(spans))
+        superstep_overhead_ms.append(idle / max(len(spans), 1) * 1000)
+        external_ms.append(external * 1000)
+        orchestration_ms.append((wall - external) * 1000)
+
+    return {
+        'supersteps': statistics.median(supersteps),
+        'superstep_overhead_p50_ms': statistics.median(superstep_overhead_ms),
+        'external_p50_ms': statistics.median(external_ms),
+        'orchestration_p50_ms': statistics.median(orchestration_ms),
+        'nodes': {
+            node: {
+                'calls_per_invoke': calls[node] / iterations,
+                'p50_ms': statistics.median(node_ms[node]),
+                'overhead_p50_ms': statistics.median(node_overhead_ms[node]),
+            }
+            for node in sorted(node_ms)
+        },
+    }
+
+
+def _measure_alloc(invoke: Callable[[dict], Any], scenario: Scenario, iterations: int) -> dict:
+    peaks = []
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            invoke(scenario.config)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'peak_p50_kb': statistics.median(peaks) / 1024,
+        'retained_bytes_per_invoke': (after - before) / iterations,
+    }
+
+
+def run(scenario: Scenario, iterations: int = 100, warmup: int = 5) -> dict:
+    loop = asyncio.new_event_loop()
+    invoke = _invoker(scenario, loop)
+    # ノードのprintは計測の対象外にする
+    with contextlib.closing(loop), contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            invoke(scenario.config)
+        latency = _measure_latency(invoke, scenario, iterations)
+        breakdown = _measure_breakdown(invoke, scenario, max(iterations // 4, 1))
+        alloc = _measure_alloc(invoke, scenario, max(iterations // 10, 1))
+    return {
+        'scenario': scenario.name,
+        'iterations': iterations,
+        'p50_ms': _percentile(latency, 50),
+        'p99_ms': _percentile(latency, 99),
+        'mean_ms': statistics.fmean(latency),
+        **breakdown,
+        **alloc,
+    }
+
+
+def run_all(iterations: int = 100, scenarios: list[str] | None = None) -> dict:
+    results = [run(s, iterations) for s in build_scenarios() if scenarios is None or s.name in scenarios]
+    return {
+        'benchmark': 'graph_overhead',
+        'timestamp': datetime.now(UTC).isoformat(),
+        'python': platform.python_version(),
+        'langgraph': version('langgraph'),
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """baselineよりp50がmax_regressionの割合以上遅くなったシナリオを返す"""
+    previous = {r['scenario']: r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        base = previous.get(result['scenario'])
+        if base is not None and result['p50_ms'] > base['p50_ms'] * (1 + max_regression):
+            regressions.append(f'{result["scenario"]}: p50 {base["p50_ms"]:.3f}ms -> {result["p50_ms"]:.3f}ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--scenarios', nargs='+')
+    parser.add_argument('--output', default='bench-results/graph_overhead.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run_all(args.iterations, args.scenarios)
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.max_regression)
+        for line in regressions:
+            print(line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
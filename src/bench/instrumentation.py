@@ -0,0 +1,71 @@
+"""
+instrumentを付けたときのオーバーヘッドを、graph_overheadのシナリオ(ScriptedChatModel)で計測する
+
+- plain: 計測なし
+- nodes: instrument(graph, metrics) ノードを包んで計測する
+- callbacks: instrument(graph, metrics, callbacks=True) さらにグラフ全体にコールバックを付けてLLMとツールも計測する
+
+計測のばらつきを打ち消すため、それぞれをblockごとに順番を入れ替えながら交互に実行し、p50を比較する。
+
+    python -m src.bench.instrumentation --iterations 400
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import time
+
+from src.bench.graph_overhead import Scenario, build_scenarios
+from src.graph.instrumentation import GraphMetrics, instrument
+
+
+def run(scenario: Scenario, iterations: int = 200, block: int = 10, warmup: int = 10) -> dict:
+    graphs = {
+        'plain': scenario.graph,
+        'nodes': instrument(scenario.graph, GraphMetrics(), scenario.name),
+        'callbacks': instrument(scenario.graph, GraphMetrics(), scenario.name, callbacks=True),
+    }
+    samples: dict[str, list[float]] = {name: [] for name in graphs}
+    loop = asyncio.new_event_loop()
+
+    def invoke(graph):
+        if scenario.is_async:
+            loop.run_until_complete(graph.ainvoke(scenario.inputs(), scenario.config))
+        else:
+            graph.invoke(scenario.inputs(), scenario.config)
+
+    with contextlib.closing(loop), contextlib.redirect_stdout(io.StringIO()):
+        for graph in graphs.values():
+            for _ in range(warmup):
+                invoke(graph)
+        names = list(graphs)
+        for b in range(max(iterations // block, 1)):
+            # 実行する順番による差が出ないよう、blockごとに順番をずらす
+            for name in names[b % len(names) :] + names[: b % len(names)]:
+                graph = graphs[name]
+                for _ in range(block):
+                    start = time.perf_counter()
+                    invoke(graph)
+                    samples[name].append((time.perf_counter() - start) * 1000)
+
+    p50 = {name: statistics.median(values) for name, values in samples.items()}
+    result = {'scenario': scenario.name, **{f'{name}_p50_ms': value for name, value in p50.items()}}
+    for name in ('nodes', 'callbacks'):
+        result[f'{name}_overhead_percent'] = (p50[name] - p50['plain']) / p50['plain'] * 100
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--scenarios', nargs='+')
+    args = parser.parse_args()
+    scenarios = [s for s in build_scenarios() if args.scenarios is None or s.name in args.scenarios]
+    print(json.dumps([run(s, args.iterations) for s in scenarios], indent=2))
+
+
+if __name__ == '__main__':
+    main()
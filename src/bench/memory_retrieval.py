@@ -0,0 +1,80 @@
+"""
+ユーザーごとの記憶が増えたときの、記憶の取得にかかる時間とプロンプトの大きさを比較する
+
+- search: 従来どおりstore.searchでnamespaceの記憶を全て取り出して連結する
+- top_k: IndexedMemoryStoreで最後のメッセージに近い上位k件だけを取り出す
+
+    python -m src.bench.memory_retrieval --sizes 10000 100000
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+
+from langgraph.store.memory import InMemoryStore
+
+from src.graph.memory_index import IndexedMemoryStore
+
+NAMESPACE = ('memories', 'bench')
+WORDS = ['name', 'food', 'city', 'work', 'hobby', 'music', 'travel', 'family', 'pet', 'sport']
+PHRASES = ['好きな食べ物', '住んでいる街', '仕事の内容', '趣味の話', '家族の予定', '旅行の思い出']
+
+
+def _memory(rng: random.Random, i: int) -> str:
+    return f'{rng.choice(PHRASES)} {rng.choice(WORDS)} {rng.choice(WORDS)} #{i}'
+
+
+def _timed(func, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run(size: int, k: int = 5, repeat: int = 20, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    store = IndexedMemoryStore(InMemoryStore())
+
+    start = time.perf_counter()
+    for i in range(size):
+        store.put(NAMESPACE, str(i), {'data': _memory(rng, i)})
+    put_seconds = time.perf_counter() - start
+
+    query = '好きな食べ物は何だっけ？ food'
+    prompt_sizes = {}
+
+    def search_all():
+        memories = store.search(NAMESPACE, limit=size)
+        prompt_sizes['search'] = len('\n'.join(m.value['data'] for m in memories))
+
+    def search_top_k():
+        memories = store.search_top_k(NAMESPACE, query, k=k)
+        prompt_sizes['top_k'] = len('\n'.join(m.value['data'] for m in memories))
+
+    search_ms = _timed(search_all, max(repeat // 10, 1))
+    top_k_ms = _timed(search_top_k, repeat)
+    return {
+        'memories': size,
+        'k': k,
+        'put_per_second': size / put_seconds,
+        'search_p50_ms': statistics.median(search_ms),
+        'top_k_p50_ms': statistics.median(top_k_ms),
+        'search_prompt_chars': prompt_sizes['search'],
+        'top_k_prompt_chars': prompt_sizes['top_k'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps([run(size, args.k) for size in args.sizes], indent=2))
+
+
+if __name__ == '__main__':
+    main()
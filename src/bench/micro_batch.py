@@ -0,0 +1,113 @@
+"""
+同時に届いたmemory_chainの呼び出しを、MicroBatcherでまとめる場合とまとめない場合の比較
+
+モデルはバッチ推論のエンドポイントを模擬する。1回のリクエストにlatency秒かかり、同時にslots件までしか処理しない。
+batchで渡された呼び出しは1回のリクエストで処理する。
+
+    python -m src.bench.micro_batch --callers 500 --max-batch-size 32 --window 0.005
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from pydantic import PrivateAttr
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import Memory, build_memory_chain
+from src.graph.micro_batch import MicroBatcher
+
+_in_batch: ContextVar[bool] = ContextVar('_in_batch', default=False)
+
+
+class BatchEndpointModel(ScriptedChatModel):
+    # 1回のリクエストにかかる時間(秒)と、同時に処理できるリクエストの数
+    request_latency: float = 0.0
+    slots: int = 8
+    requests: int = 0
+    _semaphore: asyncio.Semaphore | None = PrivateAttr(default=None)
+
+    async def _request(self) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.slots)
+        async with self._semaphore:
+            self.requests += 1
+            await asyncio.sleep(self.request_latency)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        if not _in_batch.get():
+            await self._request()
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    async def abatch(self, inputs, config=None, *, return_exceptions: bool = False, **kwargs: Any):
+        await self._request()
+        token = _in_batch.set(True)
+        try:
+            return await super().abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+        finally:
+            _in_batch.reset(token)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _measure(batcher: MicroBatcher | None, callers: int, latency: float, slots: int) -> dict:
+    memory = Memory(memory_needs=True, keywords=['天気'], reason='前回の話題')
+    llm = BatchEndpointModel(responses=[memory], request_latency=latency, slots=slots)
+    chain = build_memory_chain(llm, batcher=batcher)
+    latencies: list[float] = []
+
+    async def call(i: int) -> None:
+        start = time.perf_counter()
+        assert await chain.ainvoke({'messages': f'会話{i}'}) == memory
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(callers)))
+    result = {
+        'seconds': time.perf_counter() - start,
+        'requests': llm.requests,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+    }
+    if batcher is not None:
+        summary = batcher.summary()
+        result['batch'] = {
+            'batches': summary['batches'],
+            'mean_batch_size': summary['mean_batch_size'],
+            'full_batches': summary['full_batches'],
+            'added_latency_ms_mean': summary['added_latency']['mean'] * 1000,
+        }
+    return result
+
+
+def run(
+    callers: int = 500, latency: float = 0.05, slots: int = 8, max_batch_size: int = 32, window: float = 0.005
+) -> dict:
+    return {
+        'callers': callers,
+        'latency': latency,
+        'slots': slots,
+        'unbatched': asyncio.run(_measure(None, callers, latency, slots)),
+        'batched': asyncio.run(_measure(MicroBatcher(max_batch_size, window), callers, latency, slots)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--callers', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--window', type=float, default=0.005)
+    args = parser.parse_args()
+    print(json.dumps(run(args.callers, args.latency, args.slots, args.max_batch_size, args.window), indent=2))
+
+
+if __name__ == '__main__':
+    main()
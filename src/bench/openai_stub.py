@@ -0,0 +1,124 @@
+"""
+OpenAI互換の /v1/chat/completions だけを返すローカルのスタブサーバー
+
+ネットワークやAPIキーなしでOpenAIクライアントを使うコードを計測・テストするために使う。
+標準ライブラリのasyncioだけで書いた最小限のHTTP/1.1サーバーで、keep-aliveに対応する。
+
+- latency: 1リクエストあたりの応答待ち(秒)
+- fail_every: n件に1件を429で返し、クライアントの再試行を確かめる
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+
+class OpenAIStubServer:
+    def __init__(self, latency: float = 0.0, fail_every: int | None = None, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.rate_limited = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._server: asyncio.Server | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/v1'
+
+    async def start(self) -> 'OpenAIStubServer':
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self) -> 'OpenAIStubServer':
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @contextmanager
+    def in_thread(self) -> Iterator['OpenAIStubServer']:
+        """
+        別スレッドのイベントループで起動する。同期のOpenAIクライアントから使う場合に
+        """
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self.start(), loop).result()
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(self.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, path, _ = lines[0].split(' ', 2)
+                headers = {k.strip().lower(): v.strip() for k, v in (line.split(':', 1) for line in lines[1:] if line)}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._respond(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f'HTTP/1.1 {status}\r\ncontent-type: application/json\r\ncontent-length: {len(data)}\r\n\r\n'.encode()
+                    + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, method: str, path: str, body: bytes) -> tuple[str, dict]:
+        if method != 'POST' or not path.endswith('/chat/completions'):
+            return '404 Not Found', {'error': {'message': f'{method} {path} is not supported', 'type': 'not_found'}}
+        self.requests += 1
+        if self.fail_every and self.requests % self.fail_every == 0:
+            self.rate_limited += 1
+            return '429 Too Many Requests', {'error': {'message': 'rate limited', 'type': 'rate_limit_exceeded'}}
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        request = json.loads(body)
+        question = request['messages'][-1]['content']
+        return '200 OK', {
+            'id': f'chatcmpl-stub-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request['model'],
+            'choices': [
+                {
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': f'stub: {question}'},
+                    'finish_reason': 'stop',
+                }
+            ],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        }
@@ -0,0 +1,98 @@
+"""
+plan_and_executeの最終回答を、ainvokeで待つ場合とstream_responseで逐次受け取る場合で比較する
+
+ScriptedChatModelでLLMの応答待ち(latency)とトークンの生成間隔(token_latency)を模擬し、
+ユーザーが最初の文字を目にするまでの時間(TTFT)と最後の文字までの時間(TTLT)を計測する。
+
+    python -m src.bench.plan_and_execute_streaming --answer-chars 800
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.plan_and_execute import (
+    Act,
+    Plan,
+    Response,
+    StreamMetrics,
+    build_agent_executor,
+    build_app,
+    build_planner,
+    build_replanner,
+    stream_response,
+)
+
+
+def _build(answer: str, latency: float, token_latency: float, chunk_size: int):
+    return build_app(
+        planner=build_planner(ScriptedChatModel(responses=[Plan(steps=['調べる'])], latency=latency)),
+        replanner=build_replanner(
+            ScriptedChatModel(
+                responses=[Act(action=Response(response=answer))],
+                latency=latency,
+                token_latency=token_latency,
+                chunk_size=chunk_size,
+            )
+        ),
+        agent_executor=build_agent_executor(ScriptedChatModel(responses=['パリ'], latency=latency), tools=[]),
+    )
+
+
+async def _blocking(app, inputs: dict) -> float:
+    start = time.perf_counter()
+    await app.ainvoke(inputs)
+    return time.perf_counter() - start
+
+
+async def _streaming(app, inputs: dict) -> StreamMetrics:
+    metrics = StreamMetrics()
+    async for _ in stream_response(app, inputs, metrics=metrics):
+        pass
+    return metrics
+
+
+def run(
+    iterations: int = 5,
+    answer_chars: int = 400,
+    latency: float = 0.05,
+    token_latency: float = 0.005,
+    chunk_size: int = 4,
+) -> dict:
+    answer = ('パリで開催されました。' * answer_chars)[:answer_chars]
+    app = _build(answer, latency, token_latency, chunk_size)
+    inputs = {'input': '2024年のオリンピックの開催地はどこですか？'}
+    blocking = []
+    streaming = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            # ainvokeでは、replannerがJSONを全て生成し終えるまで回答を受け取れない
+            blocking.append(asyncio.run(_blocking(app, inputs)))
+            streaming.append(asyncio.run(_streaming(app, inputs)))
+    return {
+        'answer_chars': answer_chars,
+        'blocking_answer_seconds': statistics.median(blocking),
+        'ttft_seconds': statistics.median(m.ttft_seconds for m in streaming),
+        'ttlt_seconds': statistics.median(m.ttlt_seconds for m in streaming),
+        'stream_total_seconds': statistics.median(m.total_seconds for m in streaming),
+        'stream_chunks': streaming[-1].chunks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--answer-chars', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    args = parser.parse_args()
+    print(json.dumps(run(args.iterations, args.answer_chars, args.latency, args.token_latency), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+plan_and_executeの投機実行モード(configurable.speculative)で、1回の実行がどれだけ短くなるかを計測する
+
+replannerは完了したステップを除くだけの計画を返すが、revise_rateの割合で次のステップを別のものに差し替える
+(投機実行が外れる)。agentとreplannerはそれぞれagent_latency秒・replan_latency秒かかる。
+
+    python -m src.bench.plan_speculation --runs 20 --steps 5 --agent-latency 0.2 --replan-latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.graph.plan_and_execute import Act, Plan, Response, build_app, speculation_summary
+
+
+def _app(steps: int, agent_latency: float, replan_latency: float, revise_rate: float, seed: int):
+    rng = random.Random(seed)
+
+    async def agent(inputs):
+        await asyncio.sleep(agent_latency)
+        return {'messages': [AIMessage(content='結果')]}
+
+    async def replanner(inputs):
+        await asyncio.sleep(replan_latency)
+        done = {task for task, _ in inputs['past_steps']}
+        remaining = [step for step in inputs['plan'] if step not in done]
+        if not remaining:
+            return Act(action=Response(response=f'{len(done)} steps'))
+        if rng.random() < revise_rate:
+            remaining[0] = f'{remaining[0]} (修正)'
+        return Act(action=Plan(steps=remaining))
+
+    return build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=[f'ステップ{i + 1}' for i in range(steps)])),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+
+
+async def _measure(runs: int, speculative: bool, **kwargs) -> dict:
+    seconds = []
+    records = []
+    for seed in range(runs):
+        app = _app(seed=seed, **kwargs)
+        start = time.perf_counter()
+        result = await app.ainvoke(
+            {'input': 'q'}, config={'recursion_limit': 100, 'configurable': {'speculative': speculative}}
+        )
+        seconds.append(time.perf_counter() - start)
+        records.extend(result.get('speculation', []))
+    return {'avg_seconds': sum(seconds) / runs, **speculation_summary(records)}
+
+
+def run(
+    runs: int = 20,
+    steps: int = 5,
+    agent_latency: float = 0.2,
+    replan_latency: float = 0.1,
+    revise_rate: float = 0.2,
+) -> dict:
+    kwargs = {
+        'steps': steps,
+        'agent_latency': agent_latency,
+        'replan_latency': replan_latency,
+        'revise_rate': revise_rate,
+    }
+    serial = asyncio.run(_measure(runs, False, **kwargs))
+    speculative = asyncio.run(_measure(runs, True, **kwargs))
+    return {
+        **kwargs,
+        'runs': runs,
+        'serial_avg_seconds': serial['avg_seconds'],
+        'speculative': speculative,
+        'saved_seconds_per_run': speculative['saved_seconds'] / runs,
+        'speedup': serial['avg_seconds'] / speculative['avg_seconds'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--agent-latency', type=float, default=0.2)
+    parser.add_argument('--replan-latency', type=float, default=0.1)
+    parser.add_argument('--revise-rate', type=float, default=0.2)
+    args = parser.parse_args()
+    report = run(args.runs, args.steps, args.agent_latency, args.replan_latency, args.revise_rate)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
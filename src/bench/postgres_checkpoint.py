@@ -0,0 +1,149 @@
+"""
+Postgresのcheckpointerのスループット(checkpoints/sec)を、並行して動くthread数ごとに計測する
+
+- async: AsyncPostgresSaver(書き込みごとに1回のラウンドトリップ)
+- batched: BatchingAsyncPostgresSaver(並行する書き込みをまとめてflushする)
+
+--dsnを省略すると、PATH(もしくは--pg-bin)にあるinitdb/pg_ctlで一時的なPostgresを起動する。
+Postgresはrootでは起動できないため、rootで実行する場合は起動済みのサーバーを--dsnで指定する。
+
+    python -m src.bench.postgres_checkpoint --threads 1 10 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.graph import END, START, StateGraph
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from typing_extensions import TypedDict
+
+from src.graph.batched_postgres_saver import BatchingAsyncPostgresSaver
+
+
+class CounterState(TypedDict):
+    count: int
+
+
+def _increment(state: CounterState):
+    return {'count': state['count'] + 1}
+
+
+def build_counter_graph(checkpointer, nodes: int = 3):
+    """LLMを使わず、checkpointの書き込みだけが発生するグラフ"""
+    builder = StateGraph(CounterState)
+    names = [f'node{i}' for i in range(nodes)]
+    for name in names:
+        builder.add_node(name, _increment)
+    builder.add_edge(START, names[0])
+    for prev, name in zip(names, names[1:], strict=False):
+        builder.add_edge(prev, name)
+    builder.add_edge(names[-1], END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+@contextmanager
+def local_postgres(pg_bin: str | None = None) -> Iterator[str]:
+    """一時ディレクトリにPostgresを起動し、接続文字列を返す。終了時に停止して削除する"""
+    initdb = shutil.which('initdb', path=pg_bin)
+    pg_ctl = shutil.which('pg_ctl', path=pg_bin)
+    if initdb is None or pg_ctl is None:
+        raise RuntimeError('initdb/pg_ctl が見つかりません。--pg-bin か --dsn を指定してください')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        data = Path(tmp) / 'data'
+        subprocess.run([initdb, '-D', str(data), '-U', 'postgres', '--auth=trust'], check=True, capture_output=True)
+        options = f'-p {port} -k {tmp} -c listen_addresses=127.0.0.1 -c fsync=off'
+        subprocess.run(
+            [pg_ctl, '-D', str(data), '-o', options, '-l', str(Path(tmp) / 'log'), '-w', 'start'],
+            check=True,
+            capture_output=True,
+        )
+        try:
+            yield f'postgresql://postgres@127.0.0.1:{port}/postgres'
+        finally:
+            subprocess.run([pg_ctl, '-D', str(data), '-m', 'fast', 'stop'], check=False, capture_output=True)
+
+
+async def _count_checkpoints(pool: AsyncConnectionPool, prefix: str) -> int:
+    async with pool.connection() as conn:
+        cur = await conn.execute('SELECT count(*) AS n FROM checkpoints WHERE thread_id LIKE %s', (f'{prefix}%',))
+        return (await cur.fetchone())['n']
+
+
+async def run(dsn: str, saver: str, threads: int, runs_per_thread: int = 5, flush_interval: float = 0.005) -> dict:
+    async with AsyncConnectionPool(
+        conninfo=dsn,
+        max_size=20,
+        kwargs={'autocommit': True, 'prepare_threshold': 0, 'row_factory': dict_row},
+    ) as pool:
+        if saver == 'batched':
+            checkpointer = BatchingAsyncPostgresSaver(pool, flush_interval=flush_interval)
+        else:
+            checkpointer = AsyncPostgresSaver(pool)
+        await checkpointer.setup()
+        graph = build_counter_graph(checkpointer)
+        prefix = f'{saver}-{threads}-{time.time_ns()}-'
+
+        async def one_thread(i: int):
+            config = {'configurable': {'thread_id': f'{prefix}{i}'}}
+            for _ in range(runs_per_thread):
+                await graph.ainvoke({'count': 0}, config)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_thread(i) for i in range(threads)))
+        elapsed = time.perf_counter() - start
+
+        checkpoints = await _count_checkpoints(pool, prefix)
+        result = {
+            'saver': saver,
+            'threads': threads,
+            'checkpoints': checkpoints,
+            'seconds': elapsed,
+            'checkpoints_per_second': checkpoints / elapsed,
+        }
+        if isinstance(checkpointer, BatchingAsyncPostgresSaver):
+            result['checkpoints_per_flush'] = checkpointer.stats.checkpoints_per_flush
+        return result
+
+
+async def run_all(dsn: str, threads: list[int], runs_per_thread: int, flush_interval: float) -> list[dict]:
+    results = []
+    for n in threads:
+        for saver in ('async', 'batched'):
+            results.append(await run(dsn, saver, n, runs_per_thread, flush_interval))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('POSTGRES_BENCH_DSN'))
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--runs-per-thread', type=int, default=5)
+    parser.add_argument('--flush-interval', type=float, default=0.005)
+    args = parser.parse_args()
+
+    if args.dsn:
+        results = asyncio.run(run_all(args.dsn, args.threads, args.runs_per_thread, args.flush_interval))
+    else:
+        with local_postgres(args.pg_bin) as dsn:
+            results = asyncio.run(run_all(dsn, args.threads, args.runs_per_thread, args.flush_interval))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+conversation_classificationのチェーンにレスポンスキャッシュを付けた場合の効果を計測する
+
+同じ会話が繰り返し届くトラフィックを模擬し、ヒット率とヒット時・ミス時のレイテンシを比較する。
+
+    python -m src.bench.response_cache
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import Memory, build_memory_chain
+from src.graph.response_cache import build_response_cache
+
+
+def run(requests: int = 500, unique: int = 50, latency: float = 0.02, max_size: int = 1024, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    llm = ScriptedChatModel(responses=[Memory(memory_needs=False, keywords=[], reason='')], latency=latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = build_response_cache(str(Path(tmp) / 'cache.sqlite'), max_size=max_size)
+        chain = build_memory_chain(llm, cache=cache)
+        start = time.perf_counter()
+        for _ in range(requests):
+            chain.invoke({'messages': f'会話 {rng.randrange(unique)}'})
+        elapsed = time.perf_counter() - start
+    return {
+        'requests': requests,
+        'unique': unique,
+        'llm_calls': llm.call_count,
+        'seconds': elapsed,
+        **cache.stats.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--unique', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--max-size', type=int, default=1024)
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, args.unique, args.latency, args.max_size), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+plan_and_executeの検索をSearchCacheで包んだ場合に、検索の回数と時間がどれだけ減るかを計測する
+
+plans個のプランを同時に実行し、各プランはsteps個のステップで順に検索する。
+クエリは少数の話題から選び、表記(大文字・小文字、空白、末尾の？)を揺らす。
+検索ツールはlatency秒かけて応答するローカルの偽物。
+
+    python -m src.bench.search_cache --plans 50 --steps 4 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel
+
+from src.graph.search_cache import SearchCache
+
+TOPICS = [
+    '2024年のオリンピックの開催地',
+    'Paris Olympics 2024 medal count',
+    '全豪オープン 2024 男子 優勝者',
+    'Australia Open winner hometown',
+    'LangGraph plan and execute',
+    'Tavily search API pricing',
+]
+
+
+class SearchInput(BaseModel):
+    query: str
+
+
+class FakeSearch(BaseTool):
+    name: str = 'tavily_search_results_json'
+    description: str = '検索エンジン'
+    args_schema: type[BaseModel] = SearchInput
+    latency: float = 0.2
+    calls: int = 0
+
+    def _run(self, query: str, **kwargs) -> list[dict]:
+        raise NotImplementedError
+
+    async def _arun(self, query: str, **kwargs) -> list[dict]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [{'url': f'https://example.com/{i}', 'content': f'{query}の結果{i}'} for i in range(3)]
+
+
+def _vary(query: str, rng: random.Random) -> str:
+    return rng.choice([query, query.lower(), query.upper(), f' {query}？', query.replace(' ', '  ')])
+
+
+def make_plans(plans: int, steps: int, seed: int = 0) -> list[list[str]]:
+    rng = random.Random(seed)
+    return [[_vary(rng.choice(TOPICS), rng) for _ in range(steps)] for _ in range(plans)]
+
+
+async def _execute(search: BaseTool, plans: list[list[str]]) -> float:
+    async def plan(queries: list[str]):
+        for query in queries:
+            await search.ainvoke({'query': query})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(plan(queries) for queries in plans))
+    return time.perf_counter() - start
+
+
+def run(plans: int = 50, steps: int = 4, latency: float = 0.2, seed: int = 0) -> dict:
+    workload = make_plans(plans, steps, seed)
+    uncached = FakeSearch(latency=latency)
+    uncached_seconds = asyncio.run(_execute(uncached, workload))
+
+    cached = FakeSearch(latency=latency)
+    cache = SearchCache()
+    cached_seconds = asyncio.run(_execute(cache.wrap(cached), workload))
+    return {
+        'plans': plans,
+        'steps': steps,
+        'search_latency': latency,
+        'uncached': {'searches': uncached.calls, 'seconds': uncached_seconds},
+        'cached': {'searches': cached.calls, 'seconds': cached_seconds, **cache.summary()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plans', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(run(args.plans, args.steps, args.latency), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+GraphServerの負荷試験。同時に動くthreadの数ごとに、スループットと遅延の分位数を計測する
+
+memoryのチャットグラフを台本どおりに応答するモデル(1回latency秒)で動かし、
+concurrency個のthreadがそれぞれHTTPのkeep-aliveの接続でturns回続けて会話する。
+遅延はクライアントで計測した、要求を送ってから応答を読み終えるまでの時間。
+
+    python -m src.bench.serving --concurrency 1 100 1000 --turns 5 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.memory import build_graph
+from src.graph.server import GraphServer
+
+
+async def http_request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str, payload: dict | None = None
+) -> tuple[int, bytes]:
+    """keep-aliveの接続で1回要求する。chunked転送の応答は連結して返す"""
+    body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+    writer.write(
+        f'{method} {path} HTTP/1.1\r\nhost: localhost\r\ncontent-type: application/json\r\n'
+        f'content-length: {len(body)}\r\n\r\n'.encode()
+        + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {k.strip().lower(): v.strip() for k, v in (line.split(':', 1) for line in lines[1:] if line)}
+    if headers.get('transfer-encoding') != 'chunked':
+        return status, await reader.readexactly(int(headers['content-length']))
+    data = b''
+    while size := int((await reader.readuntil(b'\r\n')).strip(), 16):
+        data += (await reader.readexactly(size + 2))[:-2]
+    await reader.readexactly(2)
+    return status, data
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def _load(port: int, concurrency: int, turns: int) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async def conversation(thread: int) -> None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=2**20)
+        try:
+            for turn in range(turns):
+                start = time.perf_counter()
+                status, _ = await http_request(
+                    reader,
+                    writer,
+                    'POST',
+                    f'/graphs/memory/threads/{thread}/runs',
+                    {'input': {'messages': [{'role': 'user', 'content': f'質問{turn}'}]}},
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'statuses': statuses,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+
+
+async def _run(concurrency: list[int], turns: int, latency: float, max_workers: int, max_pending: int) -> dict:
+    results = []
+    for n in concurrency:
+        graph = build_graph(ScriptedChatModel(responses=['回答'], latency=latency))
+        async with GraphServer({'memory': graph}, max_workers=max_workers, max_pending=max_pending) as server:
+            http = await server.serve_http()
+            result = await _load(http.sockets[0].getsockname()[1], n, turns)
+            result['server'] = {k: v for k, v in server.summary().items() if k in ('rejected', 'errors', 'max_pending')}
+            results.append(result)
+    return {'turns': turns, 'latency': latency, 'max_workers': max_workers, 'max_pending': max_pending, 'runs': results}
+
+
+def run(
+    concurrency: list[int] | None = None,
+    turns: int = 5,
+    latency: float = 0.05,
+    max_workers: int = 64,
+    max_pending: int = 2048,
+) -> dict:
+    return asyncio.run(_run(concurrency or [1, 100, 1000], turns, latency, max_workers, max_pending))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--max-workers', type=int, default=64)
+    parser.add_argument('--max-pending', type=int, default=2048)
+    args = parser.parse_args()
+    print(json.dumps(run(args.concurrency, args.turns, args.latency, args.max_workers, args.max_pending), indent=2))
+
+
+if __name__ == '__main__':
+    main()
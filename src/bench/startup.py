@@ -0,0 +1,87 @@
+"""
+src.graph配下のモジュールのimportにかかる時間とメモリ確保量を計測する
+
+計測は毎回新しいPythonプロセスで行う(既にimport済みのモジュールの影響を受けないようにするため)。
+import中のネットワーク接続は失敗させ、OPENAI_API_KEYも外した状態で実行する。
+
+    python -m src.bench.startup
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+GRAPH_MODULES = [
+    'src.graph.basic',
+    'src.graph.conversation_classification',
+    'src.graph.memory',
+    'src.graph.plan_and_execute',
+    'src.graph.postgresql_memory',
+    'src.graph.registry',
+    'src.graph.state_manage',
+    'src.graph.store',
+    'src.graph.structured_output',
+    'src.graph.tool_calling',
+]
+
+# 子プロセスで実行するスクリプト。ネットワーク接続を禁止してからimportする
+_SCRIPT = """
+import importlib, json, socket, sys, time, tracemalloc
+
+def _deny(*args, **kwargs):
+    raise OSError('network access during import')
+
+socket.socket.connect = _deny
+socket.create_connection = _deny
+
+trace = sys.argv[1] == '1'
+modules = sys.argv[2:]
+if trace:
+    tracemalloc.start()
+start = time.perf_counter()
+for name in modules:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1] if trace else 0
+print(json.dumps({'seconds': elapsed, 'peak_bytes': peak}))
+"""
+
+
+def _run(modules: list[str], trace: bool) -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ('OPENAI_API_KEY', 'TAVILY_API_KEY')}
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    result = subprocess.run(
+        [sys.executable, '-c', _SCRIPT, '1' if trace else '0', *modules],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_import(modules: list[str] | None = None) -> dict:
+    """
+    modulesをimportした時間(秒)とメモリ確保量のピーク(byte)を返す
+
+    tracemallocは実行時間に影響するため、時間とメモリは別プロセスで計測する
+    """
+    if modules is None:
+        modules = GRAPH_MODULES
+    return {
+        'seconds': _run(modules, trace=False)['seconds'],
+        'peak_bytes': _run(modules, trace=True)['peak_bytes'],
+    }
+
+
+def main():
+    print(json.dumps(measure_import(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+ConversationClassificationを、生成し終えてから処理する場合と、Conversationごとに逐次処理する場合で比較する
+
+ScriptedChatModelでツール呼び出しの引数をトークンごとに生成し(token_latency)、
+1件の会話ごとに後段の処理(downstream秒、DB保存や埋め込みの計算を想定)を行う。
+逐次処理では後段の処理が生成と並行して進むため、全体の時間が短くなる。
+
+    python -m src.bench.structured_stream --conversations 30
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import (
+    Conversation,
+    ConversationClassification,
+    build_chain,
+    build_stream_chain,
+)
+
+INPUTS = {'messages': [('human', '今日はいい天気だね'), ('ai', 'そうだね、どうしたの？')]}
+
+
+async def _process(conversation: Conversation, downstream: float) -> None:
+    await asyncio.sleep(downstream)
+
+
+async def _blocking(llm: ScriptedChatModel, downstream: float) -> dict:
+    start = time.perf_counter()
+    result = await build_chain(llm).ainvoke(INPUTS)
+    first = time.perf_counter() - start
+    for conversation in result.conversations:
+        await _process(conversation, downstream)
+    return {'first_item_seconds': first, 'total_seconds': time.perf_counter() - start}
+
+
+async def _streaming(llm: ScriptedChatModel, downstream: float) -> dict:
+    start = time.perf_counter()
+    first = None
+    tasks = []
+    async for conversation in build_stream_chain(llm).astream(INPUTS):
+        if first is None:
+            first = time.perf_counter() - start
+        # 後段の処理は生成を待たずに始める
+        tasks.append(asyncio.create_task(_process(conversation, downstream)))
+    await asyncio.gather(*tasks)
+    return {'first_item_seconds': first, 'total_seconds': time.perf_counter() - start}
+
+
+def run(
+    conversations: int = 30,
+    token_latency: float = 0.002,
+    chunk_size: int = 8,
+    downstream: float = 0.02,
+    iterations: int = 3,
+) -> dict:
+    result = ConversationClassification(
+        conversations=[
+            Conversation(
+                category='雑談',
+                purpose=f'天気の話 {i}',
+                discourse_analysis='相手の近況を確かめるための雑談',
+                text='今日はいい天気だね',
+                keywords=['天気', '雑談'],
+                emotion_fluctuation=80,
+            )
+            for i in range(conversations)
+        ]
+    )
+    llm = ScriptedChatModel(responses=[result], token_latency=token_latency, chunk_size=chunk_size)
+    report = {'conversations': conversations, 'downstream_seconds_per_item': downstream}
+    for name, measure in (('blocking', _blocking), ('streaming', _streaming)):
+        samples = [asyncio.run(measure(llm, downstream)) for _ in range(iterations)]
+        for key in ('first_item_seconds', 'total_seconds'):
+            report[f'{name}_{key}'] = statistics.median(s[key] for s in samples)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=30)
+    parser.add_argument('--token-latency', type=float, default=0.002)
+    parser.add_argument('--downstream', type=float, default=0.02)
+    args = parser.parse_args()
+    print(json.dumps(run(args.conversations, args.token_latency, downstream=args.downstream), indent=2))
+
+
+if __name__ == '__main__':
+    main()
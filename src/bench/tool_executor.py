@@ -0,0 +1,130 @@
+"""
+react agentで足し算をする場合の、LLMの呼び出し回数と時間を比較する
+
+- llm_tool: as_toolでchainから作ったadd_tool(足し算のたびにLLMを呼ぶ)を、既定のToolNodeで実行する
+- local_tool: ローカルのaddを、ParallelToolNodeでその場で実行する
+エージェントのLLMは1回目に足し算をcalls個まとめて呼び、2回目で答える。
+ツールのLLMも含めて、LLMはScriptedChatModelでlatency秒かけて応答する。
+
+また、応答しない検索ツールが混ざった場合に、ToolNodeとParallelToolNode(timeout付き)の待ち時間を比較する。
+
+    python -m src.bench.tool_executor --questions 20 --calls 3 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.prebuilt import ToolNode, create_react_agent
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.tool_calling import add, build_add_tool, build_agent
+from src.graph.tool_executor import ParallelToolNode
+
+
+def _agent_model(tool_name: str, calls: int, latency: float) -> ScriptedChatModel:
+    def respond(messages):
+        if isinstance(messages[-1], ToolMessage):
+            return '計算しました'
+        tool_calls = [{'name': tool_name, 'args': {'a': i, 'b': i + 1}, 'id': f'call_{i}'} for i in range(calls)]
+        return AIMessage(content='', tool_calls=tool_calls)
+
+    return ScriptedChatModel(responses=[respond], latency=latency)
+
+
+def _adding_llm(latency: float) -> ScriptedChatModel:
+    def respond(messages):
+        a, b = map(int, re.findall(r'\d+', str(messages[-1].content)))
+        return str(a + b)
+
+    return ScriptedChatModel(responses=[respond], latency=latency)
+
+
+async def _measure(agent, questions: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(agent.ainvoke({'messages': ['足し算をして']}) for _ in range(questions)))
+    return time.perf_counter() - start
+
+
+def _arithmetic(questions: int, calls: int, latency: float) -> dict:
+    model = _agent_model('add_tool', calls, latency)
+    tool_llm = _adding_llm(latency)
+    llm_tool = asyncio.run(_measure(build_agent(model, [build_add_tool(tool_llm)], tool_node=ToolNode), questions))
+    llm_tool_calls = model.call_count + tool_llm.call_count
+
+    model = _agent_model('add', calls, latency)
+    tool_node = ParallelToolNode([add])
+    local_tool = asyncio.run(_measure(create_react_agent(model, tools=tool_node), questions))
+    return {
+        'llm_tool': {'seconds': llm_tool, 'llm_calls_per_question': llm_tool_calls / questions},
+        'local_tool': {
+            'seconds': local_tool,
+            'llm_calls_per_question': model.call_count / questions,
+            'tools': tool_node.summary(),
+        },
+    }
+
+
+@tool
+def search(query: str) -> str:
+    """検索する"""
+    time.sleep(0.02)
+    return f'{query}の結果'
+
+
+@tool
+def stuck_search(query: str) -> str:
+    """応答が返ってこない検索"""
+    time.sleep(1.0)
+    return f'{query}の結果'
+
+
+def _timeout(timeout: float) -> dict:
+    inputs = {
+        'messages': [
+            AIMessage(
+                content='',
+                tool_calls=[
+                    {'name': 'search', 'args': {'query': 'a'}, 'id': 'call_0'},
+                    {'name': 'stuck_search', 'args': {'query': 'b'}, 'id': 'call_1'},
+                ],
+            )
+        ]
+    }
+    report = {}
+    for name, node in [
+        ('tool_node', ToolNode([search, stuck_search])),
+        ('parallel_tool_node', ParallelToolNode([search, stuck_search], timeout=timeout)),
+    ]:
+        start = time.perf_counter()
+        asyncio.run(node.ainvoke(inputs))
+        report[f'{name}_seconds'] = time.perf_counter() - start
+    return report
+
+
+def run(questions: int = 20, calls: int = 3, latency: float = 0.05, timeout: float = 0.1) -> dict:
+    return {
+        'questions': questions,
+        'calls_per_question': calls,
+        'llm_latency': latency,
+        'arithmetic': _arithmetic(questions, calls, latency),
+        'stuck_tool': _timeout(timeout),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--calls', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=0.1)
+    args = parser.parse_args()
+    print(json.dumps(run(args.questions, args.calls, args.latency, args.timeout), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
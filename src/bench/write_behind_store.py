@@ -0,0 +1,103 @@
+"""
+store.pyのグラフで、記憶をstoreに直接書く場合とWriteBehindStoreで後から書く場合の1ターンの時間の比較
+
+storeは永続化するDBを模擬する。putを含むbatchは1回にwrite_latency秒、読み出しはread_latency秒かかり、
+connections本の接続を使い回す。毎ターン、ユーザーが記憶するように頼む。
+
+    python -m src.bench.write_behind_store --turns 200 --write-latency 0.02
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langgraph.store.base import PutOp
+from langgraph.store.memory import InMemoryStore
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.store import build_graph
+from src.graph.write_behind_store import WriteBehindStore
+
+
+class DurableStore(InMemoryStore):
+    def __init__(self, write_latency: float, read_latency: float, connections: int = 4):
+        super().__init__()
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.write_batches = 0
+        self._connections = threading.Semaphore(connections)
+        self._lock = threading.Lock()
+
+    def batch(self, ops):
+        ops = list(ops)
+        writes = any(isinstance(op, PutOp) for op in ops)
+        with self._connections:
+            time.sleep(self.write_latency if writes else self.read_latency)
+            with self._lock:
+                self.write_batches += writes
+                return super().batch(ops)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def _measure(write_behind: bool, turns: int, users: int, write_latency: float, read_latency: float) -> dict:
+    durable = DurableStore(write_latency, read_latency)
+    store = WriteBehindStore(durable) if write_behind else durable
+    graph = build_graph(model=ScriptedChatModel(responses=[AIMessage(content='ok')]), store=store)
+    latencies: list[float] = []
+    start = time.perf_counter()
+    for turn in range(turns):
+        config = {'configurable': {'thread_id': str(turn), 'user_id': f'user-{turn % users}'}}
+        turn_start = time.perf_counter()
+        graph.invoke({'messages': [('user', f'Please remember this ({turn})')]}, config)
+        latencies.append(time.perf_counter() - turn_start)
+    seconds = time.perf_counter() - start
+
+    result = {
+        'seconds': seconds,
+        'turn_p50_ms': _percentile(latencies, 0.5) * 1000,
+        'turn_p99_ms': _percentile(latencies, 0.99) * 1000,
+    }
+    if isinstance(store, WriteBehindStore):
+        close_start = time.perf_counter()
+        store.close()
+        summary = store.stats.summary()
+        result['close_ms'] = (time.perf_counter() - close_start) * 1000
+        result['flushes'] = summary['flushes']
+        result['ops_per_flush'] = summary['ops_per_flush']
+    result['write_batches'] = durable.write_batches
+    # 閉じた後には、すべての記憶が書き込まれている
+    result['stored'] = sum(len(durable.search(('memories', f'user-{u}'), limit=turns)) for u in range(users))
+    return result
+
+
+def run(turns: int = 200, users: int = 10, write_latency: float = 0.02, read_latency: float = 0.002) -> dict:
+    direct = _measure(False, turns, users, write_latency, read_latency)
+    write_behind = _measure(True, turns, users, write_latency, read_latency)
+    return {
+        'turns': turns,
+        'write_latency': write_latency,
+        'read_latency': read_latency,
+        'direct': direct,
+        'write_behind': write_behind,
+        'turn_p50_speedup': direct['turn_p50_ms'] / write_behind['turn_p50_ms'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--write-latency', type=float, default=0.02)
+    parser.add_argument('--read-latency', type=float, default=0.002)
+    args = parser.parse_args()
+    print(json.dumps(run(args.turns, args.users, args.write_latency, args.read_latency), indent=2))
+
+
+if __name__ == '__main__':
+    main()
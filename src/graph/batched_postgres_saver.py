@@ -0,0 +1,209 @@
+"""
+書き込みをまとめて実行するAsyncPostgresSaver
+
+並行して動いている複数のthreadのput/put_writesをflush_interval秒の間バッファに貯め、
+1回の接続・パイプラインでまとめて書き込む。各呼び出しは自分の書き込みがflushされるまで待つため、
+永続化の保証は通常のAsyncPostgresSaverと変わらない。
+"""
+
+import asyncio
+from collections import defaultdict
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import WRITES_IDX_MAP, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver, Conn
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+
+@dataclass
+class FlushStats:
+    flushes: int = 0
+    checkpoints: int = 0
+    writes: int = 0
+
+    @property
+    def checkpoints_per_flush(self) -> float:
+        return self.checkpoints / self.flushes if self.flushes else 0.0
+
+
+class BatchingAsyncPostgresSaver(AsyncPostgresSaver):
+    """
+    Args:
+        flush_interval: 最初の書き込みからflushするまでに待つ秒数
+        max_batch_size: この件数の書き込みが貯まったら待たずにflushする
+    """
+
+    def __init__(
+        self,
+        conn: Conn,
+        *,
+        flush_interval: float = 0.005,
+        max_batch_size: int = 256,
+        serde: SerializerProtocol | None = None,
+    ) -> None:
+        super().__init__(conn, serde=serde)
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.stats = FlushStats()
+        self._blobs: list[tuple] = []
+        self._checkpoints: list[tuple] = []
+        # クエリ(upsert/insert)ごとのput_writesのパラメータ
+        self._writes: dict[str, list[tuple]] = defaultdict(list)
+        self._waiters: list[asyncio.Future] = []
+        self._timer: asyncio.TimerHandle | None = None
+        # 実行中のflushタスク(GCされないように参照を持っておく)
+        self._tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    @asynccontextmanager
+    async def from_pool(
+        cls,
+        conn_string: str,
+        *,
+        max_size: int = 20,
+        flush_interval: float = 0.005,
+        max_batch_size: int = 256,
+    ) -> AsyncIterator['BatchingAsyncPostgresSaver']:
+        """AsyncConnectionPoolを作成し、終了時に残っている書き込みをflushしてから閉じる"""
+        async with AsyncConnectionPool(
+            conninfo=conn_string,
+            max_size=max_size,
+            kwargs={'autocommit': True, 'prepare_threshold': 0, 'row_factory': dict_row},
+        ) as pool:
+            saver = cls(pool, flush_interval=flush_interval, max_batch_size=max_batch_size)
+            try:
+                yield saver
+            finally:
+                await saver.flush()
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        configurable = config['configurable'].copy()
+        thread_id = configurable.pop('thread_id')
+        checkpoint_ns = configurable.pop('checkpoint_ns')
+        checkpoint_id = configurable.pop('checkpoint_id', configurable.pop('thread_ts', None))
+
+        copy = checkpoint.copy()
+        blobs = await asyncio.to_thread(
+            self._dump_blobs,
+            thread_id,
+            checkpoint_ns,
+            copy.pop('channel_values'),  # type: ignore[misc]
+            new_versions,
+        )
+        self._blobs.extend(blobs)
+        self._checkpoints.append(
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint['id'],
+                checkpoint_id,
+                Jsonb(self._dump_checkpoint(copy)),
+                self._dump_metadata(metadata),
+            )
+        )
+        await self._enqueue()
+        return {
+            'configurable': {
+                'thread_id': thread_id,
+                'checkpoint_ns': checkpoint_ns,
+                'checkpoint_id': checkpoint['id'],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+    ) -> None:
+        query = (
+            self.UPSERT_CHECKPOINT_WRITES_SQL
+            if all(w[0] in WRITES_IDX_MAP for w in writes)
+            else self.INSERT_CHECKPOINT_WRITES_SQL
+        )
+        params = await asyncio.to_thread(
+            self._dump_writes,
+            config['configurable']['thread_id'],
+            config['configurable']['checkpoint_ns'],
+            config['configurable']['checkpoint_id'],
+            task_id,
+            writes,
+        )
+        self._writes[query].extend(params)
+        await self._enqueue()
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        # バッファに残っている書き込みも読めるように、先にflushする
+        await self.flush()
+        return await super().aget_tuple(config)
+
+    async def alist(self, config: RunnableConfig | None, **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        await self.flush()
+        async for item in super().alist(config, **kwargs):
+            yield item
+
+    async def _enqueue(self) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if len(self._waiters) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+        await waiter
+
+    def _start_flush(self) -> None:
+        task = asyncio.ensure_future(self._flush_pending())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_pending(self) -> None:
+        # 失敗は待っている呼び出し側に伝わるので、ここでは握りつぶす
+        try:
+            await self.flush()
+        except Exception:
+            pass
+
+    async def flush(self) -> None:
+        """バッファの書き込みを1つのパイプラインでまとめて実行する"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._waiters:
+            return
+        blobs, self._blobs = self._blobs, []
+        checkpoints, self._checkpoints = self._checkpoints, []
+        writes, self._writes = self._writes, defaultdict(list)
+        waiters, self._waiters = self._waiters, []
+
+        try:
+            async with self._cursor(pipeline=True) as cur:
+                if blobs:
+                    await cur.executemany(self.UPSERT_CHECKPOINT_BLOBS_SQL, blobs)
+                if checkpoints:
+                    await cur.executemany(self.UPSERT_CHECKPOINTS_SQL, checkpoints)
+                for query, params in writes.items():
+                    await cur.executemany(query, params)
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            raise
+        self.stats.flushes += 1
+        self.stats.checkpoints += len(checkpoints)
+        self.stats.writes += sum(len(params) for params in writes.values())
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
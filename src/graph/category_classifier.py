@@ -0,0 +1,374 @@
+"""
+会話の分類をローカルで先に判定し、確信度が低いものだけgpt-4oに回す2段構成の分類器
+
+1段目は文字n-gramをハッシュしたTF-IDFベクトルと、カテゴリごとの重心のコサイン類似度で判定する。
+学習データは分類パターン表(CATEGORY_TABLE)のパターン名・説明・キーワードと、
+過去にLLMで分類した結果(classification_pipelineの出力)。
+挨拶・感謝・確認のような短い定型的な会話だけをローカルで返し、それ以外はLLMに任せる。
+
+    # 過去の分類結果で学習・評価し、モデルを保存する
+    python -m src.graph.category_classifier classified.jsonl --threshold 0.8 --save category_model.npz
+"""
+
+import argparse
+import csv
+import io
+import json
+import re
+import time
+import unicodedata
+import zlib
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from src.graph.conversation_classification import (
+    CATEGORY_TABLE,
+    Conversation,
+    ConversationClassification,
+    build_chain,
+)
+from src.graph.response_cache import ResponseCache
+
+# ローカルで返す場合のemotion_fluctuation(判定できないので中間の値にする)
+NEUTRAL_EMOTION = 50
+
+# 定型的な会話のカテゴリに追加する学習用の例文
+KEYWORDS: dict[str, list[str]] = {
+    '挨拶': [
+        'おはよう',
+        'おはようございます',
+        'こんにちは',
+        'こんばんは',
+        'はじめまして',
+        'よろしくお願いします',
+        'またね',
+        'さようなら',
+        'おやすみ',
+        'お疲れさまです',
+    ],
+    '感謝': ['ありがとう', 'ありがとうございます', '助かりました', '感謝します'],
+    '謝罪': ['ごめんなさい', 'すみません', '申し訳ありません', '失礼しました'],
+    '確認': ['合ってますか', 'で大丈夫ですか', '確認ですが', 'ですよね'],
+    '同意': ['そうだね', 'いいね', '賛成です', 'その通り', 'わかりました'],
+    '拒否': ['結構です', 'いりません', 'お断りします', 'やめておきます'],
+}
+
+_PUNCTUATION = re.compile(r'[\s、。，．,.!！?？…・「」『』()（）]+')
+
+
+def load_categories(table: str = CATEGORY_TABLE) -> dict[str, str]:
+    """
+    パターン表のCSVから {パターン名: 説明} を返す
+    """
+    return {row['パターン名']: row['説明'] for row in csv.DictReader(io.StringIO(table))}
+
+
+def message_text(messages: Any) -> str:
+    """
+    chainの入力のmessages(文字列・(role, content)・BaseMessageのリスト)から本文だけをつなげる
+    """
+    if isinstance(messages, str):
+        return messages
+    texts = []
+    for message in messages:
+        if isinstance(message, BaseMessage):
+            texts.append(str(message.content))
+        elif isinstance(message, tuple | list):
+            texts.append(str(message[1]))
+        else:
+            texts.append(str(message))
+    return '\n'.join(texts)
+
+
+class CategoryModel:
+    """
+    文字n-gram(1〜3文字)をdim次元にハッシュしたTF-IDFベクトルで、カテゴリの重心に最も近いものを選ぶ
+
+    確信度は重心とのコサイン類似度をtemperature倍してsoftmaxした値。
+    """
+
+    def __init__(self, dim: int = 1 << 14, ngram: int = 3, temperature: float = 20.0, chunk_size: int = 256):
+        self.dim = dim
+        self.ngram = ngram
+        self.temperature = temperature
+        self.chunk_size = chunk_size
+        self.labels: list[str] = []
+        self.idf = np.ones(dim, dtype=np.float32)
+        self.centroids = np.zeros((0, dim), dtype=np.float32)
+
+    def features(self, text: str) -> list[int]:
+        text = _PUNCTUATION.sub(' ', unicodedata.normalize('NFKC', text).lower()).strip()
+        grams = []
+        for token in text.split():
+            # 先頭と末尾を区別できるように境界の記号を付ける
+            token = f'^{token}$'
+            for n in range(1, self.ngram + 1):
+                grams.extend(token[i : i + n] for i in range(len(token) - n + 1))
+        return [zlib.crc32(g.encode('utf-8')) % self.dim for g in grams]
+
+    def _counts(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """textsの(行, 次元, 出現回数)。出現した次元だけを持つ疎な形で返す"""
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            features = self.features(text)
+            rows.extend([row] * len(features))
+            cols.extend(features)
+        keys = np.asarray(rows, dtype=np.int64) * self.dim + np.asarray(cols, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        return keys // self.dim, keys % self.dim, counts.astype(np.float32)
+
+    def _weights(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """textsの正規化したTF-IDFの(行, 次元, 重み)"""
+        rows, cols, counts = self._counts(texts)
+        weights = np.log1p(counts) * self.idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights**2, minlength=len(texts)))
+        return rows, cols, (weights / np.maximum(norms[rows], 1e-12)).astype(np.float32)
+
+    def _chunks(self, texts: list[str]) -> Iterable[tuple[int, list[str]]]:
+        # n×dimの行列を作らないように、chunk_size件ずつ処理する
+        for start in range(0, len(texts), self.chunk_size):
+            yield start, texts[start : start + self.chunk_size]
+
+    def vectorize(self, texts: list[str]) -> np.ndarray:
+        rows, cols, weights = self._weights(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        vectors[rows, cols] = weights
+        return vectors
+
+    def fit(self, texts: list[str], labels: list[str]) -> 'CategoryModel':
+        document_frequency = np.zeros(self.dim, dtype=np.int64)
+        for _, chunk in self._chunks(texts):
+            document_frequency += np.bincount(self._counts(chunk)[1], minlength=self.dim)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self.labels = sorted(set(labels))
+        index = {label: i for i, label in enumerate(self.labels)}
+        codes = np.asarray([index[label] for label in labels], dtype=np.intp)
+        centroids = np.zeros((len(self.labels), self.dim), dtype=np.float32)
+        for start, chunk in self._chunks(texts):
+            rows, cols, weights = self._weights(chunk)
+            np.add.at(centroids, (codes[start + rows], cols), weights)
+        self.centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return self
+
+    def predict(self, texts: list[str]) -> list[tuple[str, float]]:
+        """
+        textsそれぞれの(カテゴリ, 確信度)を返す
+        """
+        predictions = []
+        for _, chunk in self._chunks(texts):
+            logits = self.vectorize(chunk) @ self.centroids.T * self.temperature
+            logits -= logits.max(axis=1, keepdims=True)
+            probs = np.exp(logits)
+            probs /= probs.sum(axis=1, keepdims=True)
+            best = probs.argmax(axis=1)
+            predictions += [(self.labels[i], float(probs[row, i])) for row, i in enumerate(best)]
+        return predictions
+
+    def save(self, path: str | Path) -> None:
+        np.savez_compressed(
+            path,
+            labels=np.asarray(self.labels),
+            idf=self.idf,
+            centroids=self.centroids,
+            params=np.asarray([self.dim, self.ngram, self.temperature], dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> 'CategoryModel':
+        data = np.load(path)
+        dim, ngram, temperature = data['params']
+        model = cls(int(dim), int(ngram), float(temperature))
+        model.labels = [str(label) for label in data['labels']]
+        model.idf = data['idf']
+        model.centroids = data['centroids']
+        return model
+
+
+def seed_examples() -> list[tuple[str, str]]:
+    """
+    パターン表とKEYWORDSから作る学習データ [(テキスト, カテゴリ)]
+    """
+    examples = [(f'{name} {description}', name) for name, description in load_categories().items()]
+    examples += [(keyword, name) for name, keywords in KEYWORDS.items() for keyword in keywords]
+    return examples
+
+
+def load_labeled(path: str | Path) -> list[tuple[str, str]]:
+    """
+    classification_pipelineの出力(JSONL)から、LLMが分類した [(会話のtext, category)] を読む
+    """
+    examples = []
+    with Path(path).open(encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            for conversation in (row.get('result') or {}).get('conversations', []):
+                examples.append((conversation['text'], conversation['category']))
+    return examples
+
+
+def train(history: Iterable[tuple[str, str]] = (), **kwargs: Any) -> CategoryModel:
+    examples = seed_examples() + list(history)
+    return CategoryModel(**kwargs).fit([text for text, _ in examples], [label for _, label in examples])
+
+
+@dataclass
+class TierStats:
+    local: int = 0
+    llm: int = 0
+    local_seconds: float = 0.0
+    llm_seconds: float = 0.0
+
+    def summary(self) -> dict[str, Any]:
+        total = self.local + self.llm
+        avg_local_ms = self.local_seconds / self.local * 1000 if self.local else None
+        avg_llm_ms = self.llm_seconds / self.llm * 1000 if self.llm else None
+        return {
+            **asdict(self),
+            'local_rate': self.local / total if total else 0.0,
+            'avg_local_ms': avg_local_ms,
+            'avg_llm_ms': avg_llm_ms,
+            'saved_seconds': self.local * (avg_llm_ms - avg_local_ms) / 1000
+            if avg_local_ms is not None and avg_llm_ms
+            else 0.0,
+        }
+
+
+class TieredClassifier:
+    """
+    ローカルのCategoryModelで判定し、確信度がthreshold以上ならLLMを呼ばずに結果を返す
+
+    max_charsより長い会話は複数の会話に分かれている可能性があるため、常にLLMに回す。
+    """
+
+    def __init__(self, model: CategoryModel, threshold: float = 0.8, max_chars: int = 40):
+        self.model = model
+        self.threshold = threshold
+        self.max_chars = max_chars
+        self.categories = load_categories()
+        self.stats = TierStats()
+
+    def classify(self, text: str) -> ConversationClassification | None:
+        """
+        ローカルで判定できればConversationClassificationを、できなければNoneを返す
+        """
+        if not text or len(text) > self.max_chars:
+            return None
+        category, confidence = self.model.predict([text])[0]
+        if confidence < self.threshold:
+            return None
+        conversation = Conversation(
+            category=category,
+            purpose=self.categories.get(category, ''),
+            discourse_analysis=f'ローカル分類器による判定(確信度 {confidence:.2f})',
+            text=text,
+            keywords=[k for k in KEYWORDS.get(category, []) if k in text],
+            emotion_fluctuation=NEUTRAL_EMOTION,
+        )
+        return ConversationClassification(conversations=[conversation])
+
+    def as_runnable(self, chain: Runnable) -> Runnable:
+        """
+        build_chainと同じ入力({'messages': ...})を受け取り、ローカルで判定できなければchainを呼ぶ
+        """
+
+        def _local(inputs: dict) -> tuple[ConversationClassification | None, float]:
+            start = time.perf_counter()
+            result = self.classify(message_text(inputs['messages']))
+            if result is not None:
+                self.stats.local += 1
+                self.stats.local_seconds += time.perf_counter() - start
+            return result, start
+
+        def _record_llm(start: float) -> None:
+            self.stats.llm += 1
+            self.stats.llm_seconds += time.perf_counter() - start
+
+        def invoke(inputs: dict, config: RunnableConfig) -> ConversationClassification:
+            result, start = _local(inputs)
+            if result is not None:
+                return result
+            result = chain.invoke(inputs, config)
+            _record_llm(start)
+            return result
+
+        async def ainvoke(inputs: dict, config: RunnableConfig) -> ConversationClassification:
+            result, start = _local(inputs)
+            if result is not None:
+                return result
+            result = await chain.ainvoke(inputs, config)
+            _record_llm(start)
+            return result
+
+        return RunnableLambda(invoke, afunc=ainvoke, name='tiered_classification')
+
+
+def build_tiered_chain(
+    llm: BaseChatModel | None = None,
+    model: CategoryModel | None = None,
+    threshold: float = 0.8,
+    cache: ResponseCache | None = None,
+) -> Runnable:
+    """
+    build_chainの前にローカルの分類器を置いたチェーン。modelを省略するとパターン表だけで学習する
+    """
+    classifier = TieredClassifier(model if model is not None else train(), threshold=threshold)
+    return classifier.as_runnable(build_chain(llm, cache))
+
+
+def evaluate(
+    model: CategoryModel, examples: list[tuple[str, str]], threshold: float = 0.8, max_chars: int = 40
+) -> dict[str, Any]:
+    """
+    保存済みのラベル(LLMの分類結果)に対して、ローカルで返す割合(coverage)とその一致率を計算する
+    """
+    classifier = TieredClassifier(model, threshold=threshold, max_chars=max_chars)
+    local = agreed = 0
+    start = time.perf_counter()
+    for text, label in examples:
+        result = classifier.classify(text)
+        if result is None:
+            continue
+        local += 1
+        agreed += result.conversations[0].category == label
+    seconds = time.perf_counter() - start
+    return {
+        'examples': len(examples),
+        'threshold': threshold,
+        'local': local,
+        'coverage': local / len(examples) if examples else 0.0,
+        'agreement_rate': agreed / local if local else None,
+        'avg_classify_ms': seconds / len(examples) * 1000 if examples else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('labeled', help='classification_pipelineの出力(JSONL)')
+    parser.add_argument('--threshold', type=float, nargs='+', default=[0.6, 0.7, 0.8, 0.9])
+    parser.add_argument('--test-ratio', type=float, default=0.2)
+    parser.add_argument(
+        '--llm-seconds', type=float, default=2.0, help='LLMでの分類1件あたりの平均時間(節約時間の見積もりに使う)'
+    )
+    parser.add_argument('--save', help='全データで学習したモデルの保存先(.npz)')
+    args = parser.parse_args()
+
+    examples = load_labeled(args.labeled)
+    split = int(len(examples) * (1 - args.test_ratio))
+    model = train(examples[:split])
+    for threshold in args.threshold:
+        report = evaluate(model, examples[split:], threshold)
+        report['saved_seconds_estimate'] = report['local'] * args.llm_seconds
+        print(json.dumps(report, ensure_ascii=False))
+    if args.save:
+        train(examples).save(args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+checkpointの履歴を索引で引く(タイムトラベル用)
+
+get_state_historyを全てリストにして添字で選ぶと、1回の参照ごとに履歴の長さに比例する時間とメモリを使う。
+threadを最初に参照したときにthreadごとの索引(checkpoint_id・step・書き込んだノード・時刻)を作り、
+以後はcheckpointerのput時に追加しておく。二分探索で目的のcheckpointを見つけてから、その1つだけを読み込む。
+索引は最近参照したthreadの分だけ持つ(CheckpointIndexのmax_threads)。追い出されたthreadは、
+checkpointerのhistory_refsでid・メタデータだけを読んで作り直す(checkpointの値は読み込まない)。
+
+    graph = builder.compile(checkpointer=IndexedMemorySaver())
+    history = CheckpointHistory(graph)
+    ref = history.at_step(config, 3)                  # stepで探す
+    ref = history.last_written_by(config, 'call_model')  # ノードで探す
+    ref = history.at_time(config, datetime(...))      # 時刻で探す
+    page = history.page(config, limit=20)             # 新しい順にページング(page.next_cursorで続きを取る)
+    graph.invoke(None, ref.config)                    # そのcheckpointから再開する
+    snapshot = history.state(ref)                     # 値が必要な場合だけ読み込む
+"""
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.pregel import Pregel
+from langgraph.pregel.types import StateSnapshot
+
+
+@dataclass(frozen=True)
+class CheckpointRef:
+    """
+    索引の1件。値は持たず、configで1つのcheckpointを指す
+    """
+
+    thread_id: str
+    checkpoint_ns: str
+    checkpoint_id: str
+    step: int
+    created_at: str
+    source: str
+    # このcheckpointを作ったsuperstepで書き込んだノード
+    writers: tuple[str, ...]
+    parent_id: str | None
+
+    @property
+    def config(self) -> RunnableConfig:
+        return {
+            'configurable': {
+                'thread_id': self.thread_id,
+                'checkpoint_ns': self.checkpoint_ns,
+                'checkpoint_id': self.checkpoint_id,
+            }
+        }
+
+
+def metadata_ref(
+    thread_id: str,
+    checkpoint_ns: str,
+    checkpoint_id: str,
+    created_at: str,
+    metadata: CheckpointMetadata,
+    parent_id: str | None,
+) -> CheckpointRef:
+    """
+    checkpointのid・作成時刻・メタデータからrefを作る。history_refsを実装するsaverで使う
+    """
+    return CheckpointRef(
+        thread_id=thread_id,
+        checkpoint_ns=checkpoint_ns,
+        checkpoint_id=checkpoint_id,
+        step=metadata.get('step', -1),
+        created_at=created_at,
+        source=metadata.get('source', ''),
+        writers=tuple(metadata.get('writes') or ()),
+        parent_id=parent_id,
+    )
+
+
+def _ref(
+    config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, parent_id: str | None
+) -> CheckpointRef:
+    configurable = config['configurable']
+    return metadata_ref(
+        configurable['thread_id'],
+        configurable.get('checkpoint_ns', ''),
+        checkpoint['id'],
+        checkpoint['ts'],
+        metadata,
+        parent_id,
+    )
+
+
+def _tuple_ref(t: CheckpointTuple) -> CheckpointRef:
+    parent_id = (t.parent_config or {}).get('configurable', {}).get('checkpoint_id')
+    return _ref(t.config, t.checkpoint, t.metadata, parent_id)
+
+
+@dataclass
+class _ThreadIndex:
+    """
+    checkpoint_id(uuid6なので作成順に並ぶ)の昇順に並べた索引。created_atも同じ順に並ぶ
+    """
+
+    ids: list[str] = field(default_factory=list)
+    times: list[str] = field(default_factory=list)
+    refs: dict[str, CheckpointRef] = field(default_factory=dict)
+    by_step: dict[int, list[str]] = field(default_factory=dict)
+    by_node: dict[str, list[str]] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        # 最も古いcheckpointが親を持たなければ、threadの最初から索引にある
+        return bool(self.ids) and self.refs[self.ids[0]].parent_id is None
+
+    def add(self, ref: CheckpointRef) -> None:
+        if ref.checkpoint_id in self.refs:
+            return
+        self.refs[ref.checkpoint_id] = ref
+        # 新しいcheckpointは末尾に追加されるので、通常はO(1)
+        pos = bisect_right(self.ids, ref.checkpoint_id)
+        self.ids.insert(pos, ref.checkpoint_id)
+        self.times.insert(pos, ref.created_at)
+        insort(self.by_step.setdefault(ref.step, []), ref.checkpoint_id)
+        for node in ref.writers:
+            insort(self.by_node.setdefault(node, []), ref.checkpoint_id)
+
+
+class CheckpointIndex:
+    """
+    (thread_id, checkpoint_ns)ごとの索引。最近参照したmax_threads個のthreadだけを持つ(LRU)
+
+    HistoryIndexMixinはput時に、索引にあるthreadにだけ登録する。
+    索引に無いthreadは、CheckpointHistoryで参照したときにcheckpointerから読み込む。
+    """
+
+    def __init__(self, max_threads: int = 1024):
+        self.max_threads = max_threads
+        self.threads: OrderedDict[tuple[str, str], _ThreadIndex] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def thread(self, thread_id: str, checkpoint_ns: str = '') -> _ThreadIndex:
+        key = (thread_id, checkpoint_ns)
+        with self.lock:
+            index = self.threads.get(key)
+            if index is not None:
+                self.threads.move_to_end(key)
+                return index
+            index = self.threads[key] = _ThreadIndex()
+            while len(self.threads) > self.max_threads:
+                self.threads.popitem(last=False)
+            return index
+
+    def record(self, ref: CheckpointRef) -> None:
+        with self.lock:
+            index = self.threads.get((ref.thread_id, ref.checkpoint_ns))
+            if index is not None:
+                index.add(ref)
+
+
+class HistoryIndexMixin:
+    """
+    checkpointerのput/aputで索引に登録するmixin。BaseCheckpointSaverのサブクラスより前に継承する
+
+        class IndexedPostgresSaver(HistoryIndexMixin, PostgresSaver): ...
+
+    索引に持つのは、CheckpointHistoryで最近参照したmax_history_threads個のthreadだけ。
+    追い出されたthreadの索引はhistory_refsで作り直すので、保存先から値を読まずにid・メタデータだけを
+    返せるsaverではhistory_refsを上書きする(IndexedMemorySaver・IndexedPostgresSaver)
+    """
+
+    def __init__(self, *args: Any, max_history_threads: int = 1024, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.history_index = CheckpointIndex(max_history_threads)
+
+    def history_refs(self, thread_id: str, checkpoint_ns: str = '') -> Iterator[CheckpointRef]:
+        """
+        threadの全てのcheckpointのref(順不同)。既定ではlistで値ごと読み込む
+        """
+        config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns}}
+        return map(_tuple_ref, self.list(config))
+
+    def _record_history(self, ref: CheckpointRef) -> None:
+        self.history_index.record(ref)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        self._record_history(_ref(config, checkpoint, metadata, config['configurable'].get('checkpoint_id')))
+        return next_config
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        # MemorySaverのaputはputを呼ぶため二重に登録されるが、同じcheckpoint_idは無視する
+        next_config = await super().aput(config, checkpoint, metadata, new_versions)
+        self._record_history(_ref(config, checkpoint, metadata, config['configurable'].get('checkpoint_id')))
+        return next_config
+
+
+class IndexedMemorySaver(HistoryIndexMixin, MemorySaver):
+    """
+    checkpointと一緒に値を持たないrefも保存しておき、索引を作り直すときはそれだけを読む
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # (thread_id, checkpoint_ns) -> checkpoint_id -> ref。storageと同じく消さない
+        self.checkpoint_refs: defaultdict[tuple[str, str], dict[str, CheckpointRef]] = defaultdict(dict)
+
+    def history_refs(self, thread_id: str, checkpoint_ns: str = '') -> Iterator[CheckpointRef]:
+        return iter(list(self.checkpoint_refs[(thread_id, checkpoint_ns)].values()))
+
+    def _record_history(self, ref: CheckpointRef) -> None:
+        self.checkpoint_refs[(ref.thread_id, ref.checkpoint_ns)][ref.checkpoint_id] = ref
+        super()._record_history(ref)
+
+
+@dataclass
+class HistoryPage:
+    items: list[CheckpointRef]
+    # 続きのページを取るときにpage(cursor=...)に渡す。最後のページならNone
+    next_cursor: str | None
+
+
+class CheckpointHistory:
+    """
+    グラフのcheckpointの履歴を索引で検索する
+
+    checkpointerがHistoryIndexMixinを使っていればその索引を使う。
+    索引に無いthread(初めて参照するもの・LRUで追い出されたもの)は、最初の1回だけcheckpointer.history_refsで読み込む。
+    索引を持たないcheckpointerでは、参照のたびに前回より新しいcheckpointだけをlistで読み込んで索引に加える。
+    """
+
+    def __init__(self, graph: Pregel):
+        self.graph = graph
+        self.checkpointer: BaseCheckpointSaver = graph.checkpointer
+        self.indexed = hasattr(self.checkpointer, 'history_index')
+        self.index: CheckpointIndex = self.checkpointer.history_index if self.indexed else CheckpointIndex()
+
+    def _thread(self, config: RunnableConfig) -> _ThreadIndex:
+        configurable = config['configurable']
+        thread_id = configurable['thread_id']
+        checkpoint_ns = configurable.get('checkpoint_ns', '')
+        index = self.index.thread(thread_id, checkpoint_ns)
+        thread_config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns}}
+        with self.index.lock:
+            newest = index.ids[-1] if index.ids else None
+            oldest = index.ids[0] if index.ids else None
+        if not self.indexed and newest is not None:
+            # listは新しい順なので、索引にある最も新しいcheckpointまで読めばよい
+            self._load(index, self.checkpointer.list(thread_config), stop=newest)
+        if not index.complete and self.indexed:
+            refs = self.checkpointer.history_refs(thread_id, checkpoint_ns)
+            self._add(index, sorted(refs, key=lambda ref: ref.checkpoint_id))
+        elif not index.complete:
+            before = {'configurable': {'checkpoint_id': oldest}} if oldest else None
+            self._load(index, self.checkpointer.list(thread_config, before=before))
+        return index
+
+    def _load(self, index: _ThreadIndex, tuples: Iterator[CheckpointTuple], stop: str | None = None) -> None:
+        refs = []
+        for t in tuples:
+            if stop is not None and t.checkpoint['id'] <= stop:
+                break
+            refs.append(_tuple_ref(t))
+        self._add(index, refs)
+
+    def _add(self, index: _ThreadIndex, refs: list[CheckpointRef]) -> None:
+        with self.index.lock:
+            for ref in refs:
+                index.add(ref)
+
+    def _newest(self, index: _ThreadIndex, ids: list[str] | None) -> CheckpointRef | None:
+        return index.refs[ids[-1]] if ids else None
+
+    def latest(self, config: RunnableConfig) -> CheckpointRef | None:
+        index = self._thread(config)
+        with self.index.lock:
+            return self._newest(index, index.ids)
+
+    def at_step(self, config: RunnableConfig, step: int) -> CheckpointRef | None:
+        """
+        stepのcheckpoint。分岐して同じstepが複数ある場合は最も新しいものを返す
+        """
+        index = self._thread(config)
+        with self.index.lock:
+            return self._newest(index, index.by_step.get(step))
+
+    def last_written_by(self, config: RunnableConfig, node: str) -> CheckpointRef | None:
+        index = self._thread(config)
+        with self.index.lock:
+            return self._newest(index, index.by_node.get(node))
+
+    def at_time(self, config: RunnableConfig, when: datetime | str) -> CheckpointRef | None:
+        """
+        when以前に作られた最も新しいcheckpoint
+        """
+        if isinstance(when, datetime):
+            when = when.astimezone(UTC).isoformat()
+        index = self._thread(config)
+        with self.index.lock:
+            pos = bisect_right(index.times, when)
+            return index.refs[index.ids[pos - 1]] if pos else None
+
+    def page(
+        self, config: RunnableConfig, *, limit: int = 20, cursor: str | None = None, node: str | None = None
+    ) -> HistoryPage:
+        """
+        新しい順にlimit件返す。cursorには前のページのnext_cursorを、nodeを指定するとそのノードが書き込んだものだけ
+        """
+        index = self._thread(config)
+        with self.index.lock:
+            ids = index.ids if node is None else index.by_node.get(node, [])
+            end = bisect_left(ids, cursor) if cursor is not None else len(ids)
+            start = max(end - limit, 0)
+            items = [index.refs[cid] for cid in reversed(ids[start:end])]
+        return HistoryPage(items=items, next_cursor=items[-1].checkpoint_id if start > 0 else None)
+
+    def state(self, ref: CheckpointRef) -> StateSnapshot:
+        return self.graph.get_state(ref.config)
+
+    async def astate(self, ref: CheckpointRef) -> StateSnapshot:
+        return await self.graph.aget_state(ref.config)
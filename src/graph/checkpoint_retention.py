@@ -0,0 +1,192 @@
+"""
+MemorySaverに保存されるcheckpointの保持ポリシーと、バックグラウンドでの削除(compaction)
+
+MemorySaverは全てのthreadの全てのsuperstepを保持し続けるため、長時間動くworkerではメモリが増え続ける。
+RetainingMemorySaverはputされたthreadを記録しておき、compact()で変更のあったthreadだけをポリシーに従って削除する。
+各threadの最新のcheckpointとその親は、実行の再開に必要なため常に残す。
+"""
+
+import atexit
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    Args:
+        keep_last: threadごとに新しい順にこの件数だけ残す
+        branch_points_only: 分岐点(子が2つ以上)と各分岐の先端だけを残す
+        ttl: この秒数より前に保存されたcheckpointを削除する
+
+    複数指定した場合は全ての条件を満たすものを残す(branch_points_only → ttl → keep_lastの順に絞り込む)
+    """
+
+    keep_last: int | None = None
+    branch_points_only: bool = False
+    ttl: float | None = None
+
+
+class RetainingMemorySaver(MemorySaver):
+    def __init__(self, policy: RetentionPolicy, *, clock: Callable[[], float] = time.monotonic, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.policy = policy
+        self.clock = clock
+        self.put_times: dict[tuple[str, str, str], float] = {}
+        # 前回のcompaction以降にputされた(thread_id, checkpoint_ns)
+        self.dirty: set[tuple[str, str]] = set()
+        self.deleted = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._worker: threading.Thread | None = None
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config['configurable']['thread_id']
+            checkpoint_ns = config['configurable']['checkpoint_ns']
+            self.put_times[(thread_id, checkpoint_ns, checkpoint['id'])] = self.clock()
+            self.dirty.add((thread_id, checkpoint_ns))
+            return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Any, task_id: str) -> None:
+        with self._lock:
+            super().put_writes(config, writes, task_id)
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        with self._lock:
+            return super().get_tuple(config)
+
+    def list(self, config: RunnableConfig | None, **kwargs: Any) -> Iterator[CheckpointTuple]:
+        # compactionと並行して辞書を走査しないよう、ロックを取って結果を確定させてから返す
+        with self._lock:
+            items = list(super().list(config, **kwargs))
+        yield from items
+
+    def _retained(self, thread_id: str, checkpoint_ns: str) -> set[str]:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        ids = sorted(checkpoints)
+        if not ids:
+            return set()
+        parents = {cid: checkpoints[cid][2] for cid in ids}
+        head = ids[-1]
+        protected = {head, parents[head]} - {None}
+
+        candidates = ids
+        if self.policy.branch_points_only:
+            children: dict[str, int] = defaultdict(int)
+            for parent in parents.values():
+                if parent is not None:
+                    children[parent] += 1
+            candidates = [cid for cid in candidates if children[cid] != 1]
+        if self.policy.ttl is not None:
+            deadline = self.clock() - self.policy.ttl
+            candidates = [
+                cid for cid in candidates if self.put_times.get((thread_id, checkpoint_ns, cid), deadline) > deadline
+            ]
+        if self.policy.keep_last is not None:
+            candidates = candidates[-self.policy.keep_last :] if self.policy.keep_last > 0 else []
+        return set(candidates) | protected
+
+    def _compact_thread(self, thread_id: str, checkpoint_ns: str) -> int:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        retained = self._retained(thread_id, checkpoint_ns)
+        removed = [cid for cid in checkpoints if cid not in retained]
+        if not removed:
+            return 0
+        removed_set = set(removed)
+
+        # 残すcheckpointの親は、削除されない最も近い祖先に付け替える
+        for cid in retained:
+            saved, metadata, parent = checkpoints[cid]
+            if parent in removed_set:
+                while parent in removed_set:
+                    parent = checkpoints[parent][2]
+                checkpoints[cid] = (saved, metadata, parent)
+        for cid in removed:
+            del checkpoints[cid]
+            self.writes.pop((thread_id, checkpoint_ns, cid), None)
+            self.put_times.pop((thread_id, checkpoint_ns, cid), None)
+        return len(removed)
+
+    def compact(self, max_threads: int | None = None) -> int:
+        """
+        変更のあったthreadをポリシーに従って削除し、削除したcheckpointの数を返す
+
+        max_threadsを指定すると1回に処理するthread数を制限する(残りは次回に回す)。
+        ttlを使う場合は時間の経過だけで削除対象が増えるため、全threadを対象にする
+        """
+        with self._lock:
+            if self.policy.ttl is not None:
+                self.dirty.update((t, ns) for t, namespaces in self.storage.items() for ns in namespaces)
+            targets = list(self.dirty)[:max_threads] if max_threads is not None else list(self.dirty)
+            self.dirty.difference_update(targets)
+        removed = 0
+        for thread_id, checkpoint_ns in targets:
+            # 1thread分ずつロックを取り、実行中のグラフを長く止めないようにする
+            with self._lock:
+                removed += self._compact_thread(thread_id, checkpoint_ns)
+        self.deleted += removed
+        return removed
+
+    def start(self, interval: float = 1.0, max_threads: int | None = 100) -> None:
+        """
+        バックグラウンドのスレッドでinterval秒ごとにcompact()を実行する
+        stop()(withブロックの終わり、プロセスの終了時のatexitでも呼ぶ)で止める
+        """
+        if self._worker is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.compact(max_threads)
+
+        self._worker = threading.Thread(target=run, name='checkpoint-compaction', daemon=True)
+        self._worker.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._stop.set()
+        self._worker.join()
+        self._worker = None
+        atexit.unregister(self.stop)
+
+    def __exit__(self, *args: Any) -> bool | None:
+        self.stop()
+        return super().__exit__(*args)
+
+    def stats(self) -> dict[str, int]:
+        """保持しているthread・checkpoint・書き込みの数と、シリアライズ済みデータの合計バイト数"""
+        with self._lock:
+            checkpoints = 0
+            size = 0
+            for namespaces in self.storage.values():
+                for saved in namespaces.values():
+                    checkpoints += len(saved)
+                    size += sum(len(c[1]) + len(m[1]) for c, m, _ in saved.values())
+            writes = sum(len(w) for w in self.writes.values())
+            size += sum(len(v[2][1]) for w in self.writes.values() for v in w.values())
+            return {
+                'threads': len(self.storage),
+                'checkpoints': checkpoints,
+                'writes': writes,
+                'bytes': size,
+                'deleted': self.deleted,
+            }
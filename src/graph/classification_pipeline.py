@@ -0,0 +1,226 @@
+"""
+会話ログを一括で分類するパイプライン
+
+JSONL(1行1会話)を読みながら、上限付きの並列数で分類チェーンを呼び出し、結果を1行ずつ書き出す。
+キューの長さを制限しているため、分類が追いつかない場合は読み込みが待たされる(バックプレッシャー)。
+進捗はチェックポイントファイルに保存し、途中で落ちても続きから再開できる。
+分類に失敗した行(レート制限やタイムアウトなど)はエラーの行を書いた上で、再開したときにもう一度分類する。
+JSONとして読めない行は、何度実行しても同じなのでエラーの行を書いて完了にする。
+
+入力の各行: {"id": "...", "messages": [["human", "..."], ["ai", "..."]]}
+出力の各行: {"index": 0, "id": "...", "result": {...}} もしくは {"index": 0, "id": "...", "error": "..."}
+(再開して分類し直した行は、同じindexのエラーの行の後に書く)
+
+    python -m src.graph.classification_pipeline conversations.jsonl classified.jsonl --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from langchain_core.runnables import Runnable
+
+from src.graph.conversation_classification import build_chain
+
+# キューの終端を表す
+_DONE = object()
+
+
+@dataclass
+class PipelineStats:
+    processed: int = 0
+    skipped: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+    @property
+    def conversations_per_second(self) -> float:
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> dict[str, Any]:
+        return {**asdict(self), 'conversations_per_second': self.conversations_per_second}
+
+
+@dataclass
+class Checkpoint:
+    """
+    watermark以下の行は全て完了済み。並列実行で先に終わった行はdone_aboveに持つ。
+    failedは分類に失敗した行で、watermarkは進めるが完了とはみなさず、再開時にもう一度分類する。
+    output_bytesは保存時点の出力ファイルのサイズで、再開時にそれ以降の書き込みを切り捨てる
+    """
+
+    watermark: int = -1
+    done_above: set[int] = field(default_factory=set)
+    output_bytes: int = 0
+    failed: set[int] = field(default_factory=set)
+
+    def is_done(self, index: int) -> bool:
+        return (index <= self.watermark or index in self.done_above) and index not in self.failed
+
+    def mark_done(self, index: int, failed: bool = False) -> None:
+        if failed:
+            self.failed.add(index)
+        else:
+            self.failed.discard(index)
+        self.done_above.add(index)
+        while self.watermark + 1 in self.done_above:
+            self.watermark += 1
+            self.done_above.remove(self.watermark)
+
+    @classmethod
+    def load(cls, path: Path) -> 'Checkpoint':
+        if not path.exists():
+            return cls()
+        data = json.loads(path.read_text())
+        return cls(data['watermark'], set(data['done_above']), data['output_bytes'], set(data.get('failed', [])))
+
+    def save(self, path: Path) -> None:
+        data = {
+            'watermark': self.watermark,
+            'done_above': sorted(self.done_above),
+            'output_bytes': self.output_bytes,
+            'failed': sorted(self.failed),
+        }
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        tmp.write_text(json.dumps(data))
+        # 書き込み途中で落ちても壊れたチェックポイントが残らないようにする
+        os.replace(tmp, path)
+
+
+def _to_input(record: dict) -> dict:
+    return {'messages': [tuple(m) for m in record['messages']]}
+
+
+async def classify_jsonl(
+    chain: Runnable,
+    input_path: str | Path,
+    output_path: str | Path,
+    *,
+    concurrency: int = 8,
+    checkpoint_path: str | Path | None = None,
+    checkpoint_interval: int = 100,
+    limit: int | None = None,
+) -> PipelineStats:
+    """
+    input_pathの会話をchainで分類し、output_pathに追記する
+
+    Args:
+        concurrency: 同時に実行するchain.ainvokeの数
+        checkpoint_path: 省略時はoutput_pathに'.checkpoint'を付けたパス
+        checkpoint_interval: 何件ごとにチェックポイントを保存するか
+        limit: 今回の実行で処理する最大件数(省略時は全件)
+    """
+    input_path = Path(input_path)
+    output_path = Path(output_path)
+    checkpoint_path = (
+        Path(checkpoint_path) if checkpoint_path else output_path.with_name(output_path.name + '.checkpoint')
+    )
+
+    checkpoint = Checkpoint.load(checkpoint_path)
+    # 前回のチェックポイント以降に書き込まれた行は、チェックポイントに反映されていないので切り捨てて再処理する
+    if output_path.exists() and output_path.stat().st_size > checkpoint.output_bytes:
+        with output_path.open('r+b') as f:
+            f.truncate(checkpoint.output_bytes)
+
+    stats = PipelineStats()
+    tasks: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def produce():
+        queued = 0
+        with input_path.open(encoding='utf-8') as f:
+            for index, line in enumerate(f):
+                if not line.strip():
+                    continue
+                if checkpoint.is_done(index):
+                    stats.skipped += 1
+                    continue
+                if limit is not None and queued >= limit:
+                    break
+                queued += 1
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError('会話はJSONのオブジェクトである必要があります')
+                except ValueError as e:
+                    # 壊れた行で全体を止めず、その行のエラーとして書く(再試行しても同じなので完了にする)
+                    await results.put(({'index': index, 'id': None, 'error': repr(e)}, False))
+                    continue
+                # キューが一杯の間はここで待つ
+                await tasks.put((index, record))
+        for _ in range(concurrency):
+            await tasks.put(_DONE)
+
+    async def work():
+        while (item := await tasks.get()) is not _DONE:
+            index, record = item
+            output = {'index': index, 'id': record.get('id')}
+            try:
+                result = await chain.ainvoke(_to_input(record))
+                output['result'] = result.model_dump(mode='json')
+            except Exception as e:
+                output['error'] = repr(e)
+            # 分類の失敗は一時的なもの(レート制限・タイムアウトなど)もあるので、再開時にやり直す
+            await results.put((output, 'error' in output))
+        await results.put(_DONE)
+
+    async def write():
+        finished_workers = 0
+        since_checkpoint = 0
+        with output_path.open('ab') as f:
+            while finished_workers < concurrency:
+                item = await results.get()
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                output, retry = item
+                f.write((json.dumps(output, ensure_ascii=False) + '\n').encode('utf-8'))
+                stats.processed += 1
+                if 'error' in output:
+                    stats.errors += 1
+                checkpoint.mark_done(output['index'], failed=retry)
+                since_checkpoint += 1
+                if since_checkpoint >= checkpoint_interval:
+                    f.flush()
+                    checkpoint.output_bytes = f.tell()
+                    checkpoint.save(checkpoint_path)
+                    since_checkpoint = 0
+            f.flush()
+            checkpoint.output_bytes = f.tell()
+        checkpoint.save(checkpoint_path)
+
+    start = time.perf_counter()
+    await asyncio.gather(produce(), write(), *(work() for _ in range(concurrency)))
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--checkpoint-interval', type=int, default=100)
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    stats = asyncio.run(
+        classify_jsonl(
+            build_chain(),
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            checkpoint_interval=args.checkpoint_interval,
+            limit=args.limit,
+        )
+    )
+    print(json.dumps(stats.summary(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
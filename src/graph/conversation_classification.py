@@ -1,10 +1,16 @@
 from datetime import datetime
 
 from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from src.graph.micro_batch import MicroBatcher
+from src.graph.partial_json import stream_structured_items
+from src.graph.response_cache import ResponseCache, cached_structured_output
+
 load_dotenv()
 
 
@@ -32,16 +38,8 @@ class ConversationClassification(BaseModel):
     conversations: list[Conversation] = Field(..., description='会話の構成')
 
 
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            'system',
-            """
-            与えられた会話の要点をまとめて、会話の分類を行ってください
-
-            カテゴリには以下のパターン名のいずれかを入れてください
-
-パターンID,パターン名,説明
+# 会話の分類パターン(CSV)。プロンプトに埋め込むほか、category_classifierの学習にも使う
+CATEGORY_TABLE = """パターンID,パターン名,説明
 1,雑談,"関係を築いたり沈黙を埋めるための些細な事柄についてのカジュアルな会話。"
 2,噂話,"不在の第三者についての情報共有で、しばしば否定的な内容を含む。"
 3,討論,"参加者が対立する見解を議論する構造化された議論。"
@@ -82,12 +80,62 @@ prompt = ChatPromptTemplate.from_messages(
 38,批判,"建設的または否定的な評価を提供すること。"
 39,確認,"情報や理解を確認すること。"
 40,応答,"他者の発言や行動に対する返答や反応を示すこと。"
-            """,
+"""
+
+prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            'system',
+            f"""
+            与えられた会話の要点をまとめて、会話の分類を行ってください
+
+            カテゴリには以下のパターン名のいずれかを入れてください
+
+{CATEGORY_TABLE}            """,
         ),
         ('placeholder', '{messages}'),
     ]
 )
-chain = prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(ConversationClassification)
+
+
+def build_llm() -> BaseChatModel:
+    return ChatOpenAI(model='gpt-4o', temperature=0)
+
+
+def bind_structured_output(
+    llm: BaseChatModel,
+    schema: type[BaseModel],
+    cache: ResponseCache | None = None,
+    batcher: MicroBatcher | None = None,
+) -> Runnable:
+    # cacheを渡した場合は、同じ(モデル, プロンプト, スキーマ)の呼び出しをキャッシュから返す
+    # batcherを渡した場合は、同時に届いた呼び出しをまとめてbatchで実行する(キャッシュに無いものだけ)
+    structured_llm = llm.with_structured_output(schema)
+    if batcher is not None:
+        structured_llm = batcher.wrap(structured_llm, name=f'batched_{schema.__name__}')
+    if cache is None:
+        return structured_llm
+    return cached_structured_output(llm, schema, cache, structured_llm)
+
+
+def build_chain(
+    llm: BaseChatModel | None = None, cache: ResponseCache | None = None, batcher: MicroBatcher | None = None
+) -> Runnable:
+    if llm is None:
+        llm = build_llm()
+    return prompt | bind_structured_output(llm, ConversationClassification, cache, batcher)
+
+
+def build_stream_chain(llm: BaseChatModel | None = None) -> Runnable:
+    """
+    build_chainのストリーミング版。Conversationを生成し終えたものから1件ずつ返す
+
+        async for conversation in build_stream_chain().astream({'messages': [...]}):
+            ...
+    """
+    if llm is None:
+        llm = build_llm()
+    return prompt | stream_structured_items(llm, ConversationClassification, ('conversations',))
 
 
 class ReplyConversation(BaseModel):
@@ -118,7 +166,13 @@ reply_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-reply_chain = reply_prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(ReplyConversation)
+
+def build_reply_chain(
+    llm: BaseChatModel | None = None, cache: ResponseCache | None = None, batcher: MicroBatcher | None = None
+) -> Runnable:
+    if llm is None:
+        llm = build_llm()
+    return reply_prompt | bind_structured_output(llm, ReplyConversation, cache, batcher)
 
 
 class Memory(BaseModel):
@@ -144,10 +198,19 @@ memory_prompt = ChatPromptTemplate.from_messages(
         ),
     ]
 )
-memory_chain = memory_prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(Memory)
+
+
+def build_memory_chain(
+    llm: BaseChatModel | None = None, cache: ResponseCache | None = None, batcher: MicroBatcher | None = None
+) -> Runnable:
+    if llm is None:
+        llm = build_llm()
+    return memory_prompt | bind_structured_output(llm, Memory, cache, batcher)
 
 
 if __name__ == '__main__':
+    chain = build_chain()
+    memory_chain = build_memory_chain()
     conversation = chain.invoke(
         {
             'messages': [
@@ -0,0 +1,410 @@
+"""
+分類したConversationを列ごとのファイルに追記して保存し、集計をnumpyでまとめて行う
+
+何百万件ものConversationをpydanticのインスタンスのまま持つと、1件ごとにdictと文字列のオブジェクトができて
+メモリが足りなくなる。列ごとに固定長の配列としてファイルに追記し、読むときはnp.memmapでファイルを直接参照する。
+category・キーワード・ユーザーは辞書で整数に置き換える(辞書の値は種類の数しか持たない)。
+purposeなどの自由な文章は、UTF-8のバイト列とその終端の位置の配列に分けて持つ。
+
+    store = ConversationStore('data/conversations')
+    store.append(result.conversations, user='user-1')
+    store.category_histogram(start=datetime(2024, 10, 1))
+    store.keyword_frequency(top=20, category='相談')
+    store.period_aggregates('week')   # 週ごとの件数とemotion_fluctuationの平均・最小・最大
+    store.conversations([0, 1, 2])    # 行番号を指定してConversationに戻す
+
+書き込みは1プロセスからだけ行う。全ての列を書き終えてから行数をmeta.jsonに書き込むので、
+途中で落ちた場合は次に開いたときにmeta.jsonの行数より後ろを切り捨てる(classification_pipelineと同じ考え方)。
+"""
+
+import json
+import os
+import threading
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from src.graph.conversation_classification import Conversation
+
+# 1行に1つの値を持つ列
+FIXED_COLUMNS: dict[str, type[np.generic]] = {
+    # UTCのエポックからのマイクロ秒
+    'created_at': np.int64,
+    'emotion_fluctuation': np.uint8,
+    'category': np.int32,
+    'user': np.int32,
+    # その行までのキーワードの数(行iのキーワードはkeywords[offsets[i-1]:offsets[i]])
+    'keyword_offsets': np.int64,
+}
+STRING_COLUMNS = ('purpose', 'discourse_analysis', 'text')
+# 値を整数に置き換える辞書。keywordの辞書はkeywords列に使う
+DICTIONARIES = ('category', 'user', 'keyword')
+PERIODS = ('day', 'week', 'month')
+
+_US_PER_DAY = 86_400_000_000
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+_US = timedelta(microseconds=1)
+
+
+def to_micros(value: datetime) -> int:
+    """タイムゾーンの無い日時はローカル時刻として扱う(Conversation.created_atの既定値はdatetime.now())"""
+    return (value.astimezone() - _EPOCH) // _US
+
+
+def _local_offset() -> timedelta:
+    return datetime.now().astimezone().utcoffset() or timedelta(0)
+
+
+@dataclass
+class ColumnBatch:
+    """
+    追記する行を列ごとに持つ。appendはConversationをこの形にしてから書き込む
+    """
+
+    created_at: np.ndarray
+    emotion_fluctuation: np.ndarray
+    category: Sequence[str]
+    keywords: Sequence[Sequence[str]]
+    user: Sequence[str]
+    strings: dict[str, Sequence[str]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.created_at)
+
+    @classmethod
+    def from_conversations(cls, conversations: Sequence[Conversation], user: str | Sequence[str] = '') -> 'ColumnBatch':
+        return cls(
+            created_at=np.fromiter((to_micros(c.created_at) for c in conversations), np.int64, len(conversations)),
+            emotion_fluctuation=np.fromiter((c.emotion_fluctuation for c in conversations), np.uint8),
+            category=[c.category for c in conversations],
+            keywords=[c.keywords for c in conversations],
+            user=[user] * len(conversations) if isinstance(user, str) else user,
+            strings={name: [getattr(c, name) for c in conversations] for name in STRING_COLUMNS},
+        )
+
+
+class _Dictionary:
+    """値 -> 整数の対応。ファイルには1行に1つ、JSONの文字列で追記する"""
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.values: list[str] = []
+        self.codes: dict[str, int] = {}
+        self.pending: list[str] = []
+        if size:
+            with path.open(encoding='utf-8') as f:
+                for line, _ in zip(f, range(size), strict=False):
+                    self._add(json.loads(line))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _add(self, value: str) -> int:
+        self.codes[value] = len(self.values)
+        self.values.append(value)
+        return self.codes[value]
+
+    def encode(self, values: Sequence[str]) -> np.ndarray:
+        if not len(values):
+            return np.zeros(0, np.int32)
+        # 種類ごとに1回だけ辞書を引く。新しい値には最初に現れた順に番号を振る
+        unique, first, inverse = np.unique(np.asarray(values, dtype=object), return_index=True, return_inverse=True)
+        codes = np.empty(len(unique), np.int32)
+        for i in np.argsort(first):
+            value = unique[i]
+            code = self.codes.get(value)
+            if code is None:
+                code = self._add(value)
+                self.pending.append(value)
+            codes[i] = code
+        return codes[inverse]
+
+    def lookup(self, value: str) -> int:
+        return self.codes.get(value, -1)
+
+    def rollback(self, size: int) -> None:
+        """size件より後に追加した値を忘れる"""
+        for value in self.values[size:]:
+            del self.codes[value]
+        del self.values[size:]
+        self.pending.clear()
+
+    def flush(self) -> int:
+        """追記して、ファイルのサイズを返す"""
+        with self.path.open('ab') as f:
+            f.writelines((json.dumps(v, ensure_ascii=False) + '\n').encode('utf-8') for v in self.pending)
+            self.pending.clear()
+            return f.tell()
+
+
+class ConversationStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._columns: dict[str, np.ndarray] = {}
+        meta_path = self.path / 'meta.json'
+        self.meta: dict[str, Any] = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        self.rows: int = self.meta.get('rows', 0)
+        sizes = self.meta.get('dictionaries', {})
+        self.dictionaries = {name: _Dictionary(self.path / f'{name}.dict', sizes.get(name, 0)) for name in DICTIONARIES}
+        self._truncate()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _files(self) -> dict[str, int]:
+        """ファイル名 -> meta.jsonに記録した時点のサイズ(バイト)"""
+        keywords = self.meta.get('keywords', 0)
+        string_bytes = self.meta.get('string_bytes', {})
+        files = {f'{name}.bin': self.rows * np.dtype(dtype).itemsize for name, dtype in FIXED_COLUMNS.items()}
+        files['keywords.bin'] = keywords * np.dtype(np.int32).itemsize
+        for name in STRING_COLUMNS:
+            files[f'{name}.offsets.bin'] = self.rows * np.dtype(np.int64).itemsize
+            files[f'{name}.utf8'] = string_bytes.get(name, 0)
+        files.update({f'{name}.dict': self.meta.get('dictionary_bytes', {}).get(name, 0) for name in DICTIONARIES})
+        return files
+
+    def _truncate(self) -> None:
+        # 行数を書き込む前に落ちた追記を切り捨てる
+        for name, size in self._files().items():
+            file = self.path / name
+            if file.exists() and file.stat().st_size > size:
+                with file.open('r+b') as f:
+                    f.truncate(size)
+
+    def _rollback(self) -> None:
+        self._truncate()
+        sizes = self.meta.get('dictionaries', {})
+        for name, d in self.dictionaries.items():
+            d.rollback(sizes.get(name, 0))
+
+    # 書き込み
+
+    def append(self, conversations: Iterable[Conversation], user: str | Sequence[str] = '') -> int:
+        """追記して、追記した行数を返す。userには全ての行に共通のIDか、行ごとのIDの列を渡す"""
+        return self.append_batch(ColumnBatch.from_conversations(list(conversations), user))
+
+    def append_batch(self, batch: ColumnBatch) -> int:
+        n = len(batch)
+        if n == 0:
+            return 0
+        with self._lock:
+            try:
+                self._append(batch, n)
+            except BaseException:
+                # 書きかけのバイトと、辞書に足した値を取り消す。残すと次の追記がその後ろに書かれてしまう
+                self._rollback()
+                raise
+        return n
+
+    def _append(self, batch: ColumnBatch, n: int) -> None:
+        keyword_counts = np.fromiter((len(k) for k in batch.keywords), np.int64, n)
+        keyword_total = self.meta.get('keywords', 0)
+        flat_keywords = [k for keywords in batch.keywords for k in keywords]
+        columns = {
+            'created_at': np.asarray(batch.created_at, np.int64),
+            'emotion_fluctuation': np.asarray(batch.emotion_fluctuation, np.uint8),
+            'category': self.dictionaries['category'].encode(batch.category),
+            'user': self.dictionaries['user'].encode(batch.user),
+            'keyword_offsets': keyword_total + np.cumsum(keyword_counts),
+            'keywords': self.dictionaries['keyword'].encode(flat_keywords),
+        }
+        string_bytes = dict(self.meta.get('string_bytes', {}))
+        for name in STRING_COLUMNS:
+            encoded = [s.encode('utf-8') for s in batch.strings.get(name, [''] * n)]
+            lengths = np.fromiter((len(b) for b in encoded), np.int64, n)
+            columns[f'{name}.offsets'] = string_bytes.get(name, 0) + np.cumsum(lengths)
+            with (self.path / f'{name}.utf8').open('ab') as f:
+                f.write(b''.join(encoded))
+            string_bytes[name] = int(columns[f'{name}.offsets'][-1])
+        for name, values in columns.items():
+            with (self.path / f'{name}.bin').open('ab') as f:
+                f.write(values.tobytes())
+        dictionary_bytes = {name: d.flush() for name, d in self.dictionaries.items()}
+        self._commit(
+            {
+                'rows': self.rows + n,
+                'keywords': keyword_total + len(flat_keywords),
+                'string_bytes': string_bytes,
+                'dictionaries': {name: len(d) for name, d in self.dictionaries.items()},
+                'dictionary_bytes': dictionary_bytes,
+            }
+        )
+
+    def _commit(self, meta: dict[str, Any]) -> None:
+        tmp = self.path / 'meta.json.tmp'
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / 'meta.json')
+        self.meta = meta
+        self.rows = meta['rows']
+        self._columns.clear()
+
+    # 読み込み
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        列をnp.memmapで返す。名前はFIXED_COLUMNSと'keywords'、'{STRING_COLUMNS}.offsets'
+        """
+        if name not in self._columns:
+            if name == 'keywords':
+                dtype, size = np.int32, self.meta.get('keywords', 0)
+            else:
+                dtype, size = FIXED_COLUMNS.get(name, np.int64), self.rows
+            if size == 0:
+                self._columns[name] = np.zeros(0, dtype)
+            else:
+                self._columns[name] = np.memmap(self.path / f'{name}.bin', dtype=dtype, mode='r', shape=(size,))
+        return self._columns[name]
+
+    def strings(self, name: str, rows: Sequence[int]) -> list[str]:
+        offsets = self.column(f'{name}.offsets')
+        size = self.meta.get('string_bytes', {}).get(name, 0)
+        data = np.memmap(self.path / f'{name}.utf8', dtype=np.uint8, mode='r', shape=(size,)) if size else None
+        values = []
+        for row in rows:
+            start = offsets[row - 1] if row > 0 else 0
+            values.append(bytes(data[start : offsets[row]]).decode('utf-8') if data is not None else '')
+        return values
+
+    def conversations(self, rows: Sequence[int]) -> list[Conversation]:
+        """行番号を指定してConversationに戻す。結果の一部だけを表示する場合などに"""
+        rows = list(rows)
+        created_at = self.column('created_at')
+        emotion = self.column('emotion_fluctuation')
+        category = self.column('category')
+        offsets = self.column('keyword_offsets')
+        keywords = self.column('keywords')
+        categories = self.dictionaries['category'].values
+        keyword_values = self.dictionaries['keyword'].values
+        strings = {name: self.strings(name, rows) for name in STRING_COLUMNS}
+        result = []
+        for i, row in enumerate(rows):
+            start = offsets[row - 1] if row > 0 else 0
+            result.append(
+                Conversation(
+                    category=categories[category[row]],
+                    keywords=[keyword_values[k] for k in keywords[start : offsets[row]]],
+                    created_at=(_EPOCH + int(created_at[row]) * _US).astimezone(),
+                    emotion_fluctuation=int(emotion[row]),
+                    **{name: strings[name][i] for name in STRING_COLUMNS},
+                )
+            )
+        return result
+
+    # 集計
+
+    def mask(
+        self,
+        *,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        category: str | None = None,
+        user: str | None = None,
+    ) -> np.ndarray | None:
+        """条件に合う行のbool配列。条件が無ければNone(全ての行)。endは含まない"""
+        mask = None
+
+        def _and(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if start is not None:
+            _and(self.column('created_at') >= to_micros(start))
+        if end is not None:
+            _and(self.column('created_at') < to_micros(end))
+        if category is not None:
+            _and(self.column('category') == self.dictionaries['category'].lookup(category))
+        if user is not None:
+            _and(self.column('user') == self.dictionaries['user'].lookup(user))
+        return mask
+
+    def category_histogram(self, **where: Any) -> dict[str, int]:
+        """カテゴリごとの件数(多い順)。whereはmask()の条件"""
+        codes = self.column('category')
+        mask = self.mask(**where)
+        if mask is not None:
+            codes = codes[mask]
+        counts = np.bincount(codes, minlength=len(self.dictionaries['category']))
+        categories = self.dictionaries['category'].values
+        return {categories[i]: int(counts[i]) for i in np.argsort(-counts, kind='stable') if counts[i]}
+
+    def keyword_frequency(self, top: int = 20, **where: Any) -> list[tuple[str, int]]:
+        """キーワードの出現回数の上位top件。whereはmask()の条件"""
+        keywords = self.column('keywords')
+        mask = self.mask(**where)
+        if mask is not None:
+            offsets = self.column('keyword_offsets')
+            counts = np.diff(offsets, prepend=0)
+            keywords = keywords[np.repeat(mask, counts)]
+        counts = np.bincount(keywords, minlength=len(self.dictionaries['keyword']))
+        order = np.argsort(-counts, kind='stable')[:top]
+        values = self.dictionaries['keyword'].values
+        return [(values[i], int(counts[i])) for i in order if counts[i]]
+
+    def period_aggregates(
+        self, period: str = 'day', *, utc_offset: timedelta | None = None, **where: Any
+    ) -> list[dict[str, Any]]:
+        """
+        期間(day・week・month)ごとの件数とemotion_fluctuationの平均・標準偏差・最小・最大
+
+        期間の区切りはutc_offsetの時刻で決める(省略時はローカル時刻)。週は月曜始まり
+        """
+        if period not in PERIODS:
+            raise ValueError(f'periodは{PERIODS}のいずれかです: {period}')
+        offset = utc_offset if utc_offset is not None else _local_offset()
+        created_at = self.column('created_at')
+        emotion = self.column('emotion_fluctuation')
+        mask = self.mask(**where)
+        if mask is not None:
+            created_at, emotion = created_at[mask], emotion[mask]
+        if len(created_at) == 0:
+            return []
+
+        days = (created_at + offset // _US) // _US_PER_DAY
+        if period == 'week':
+            # 1970-01-01は木曜日なので、3日ずらして月曜始まりにする
+            buckets = (days + 3) // 7
+        elif period == 'month':
+            buckets = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        else:
+            buckets = days
+        low = int(buckets.min())
+        index = buckets - low
+        size = int(index.max()) + 1
+        emotion = emotion.astype(np.float64)
+        counts = np.bincount(index, minlength=size)
+        sums = np.bincount(index, weights=emotion, minlength=size)
+        squares = np.bincount(index, weights=emotion * emotion, minlength=size)
+        minimum = np.full(size, np.inf)
+        maximum = np.full(size, -np.inf)
+        np.minimum.at(minimum, index, emotion)
+        np.maximum.at(maximum, index, emotion)
+
+        result = []
+        for i in np.flatnonzero(counts):
+            n = counts[i]
+            mean = sums[i] / n
+            result.append(
+                {
+                    'period': _period_label(period, low + int(i)),
+                    'count': int(n),
+                    'emotion_mean': float(mean),
+                    'emotion_std': float(np.sqrt(max(squares[i] / n - mean * mean, 0.0))),
+                    'emotion_min': int(minimum[i]),
+                    'emotion_max': int(maximum[i]),
+                }
+            )
+        return result
+
+
+def _period_label(period: str, bucket: int) -> str:
+    if period == 'month':
+        return str(np.datetime64(bucket, 'M'))
+    if period == 'week':
+        return str(np.datetime64(bucket * 7 - 3, 'D'))
+    return str(np.datetime64(bucket, 'D'))
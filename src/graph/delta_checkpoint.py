@@ -0,0 +1,148 @@
+"""
+MessagesStateのmessagesを差分で保存するMemorySaver
+
+MemorySaverはcheckpointごとにmessagesの全体をシリアライズするため、Nターンのthreadでは保存量が O(N²) になる。
+DeltaMemorySaverは親のcheckpointから追加されたメッセージだけを保存し、読み込み時に親をたどって復元する。
+snapshot_interval個の差分ごとに全体を保存し、復元のためにたどる長さを制限する。
+
+messagesは追加されたあと変更されない前提で、親のリストが先頭に一致しない場合(RemoveMessageや同じidでの置き換え)は全体を保存する。
+RetainingMemorySaverのcompactionとは併用できない(差分の元になるcheckpointを削除してしまうため)。
+"""
+
+from collections.abc import Iterator
+from typing import Any
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+DELTA_KEY = '__delta__'
+
+
+def _is_delta(value: Any) -> bool:
+    return isinstance(value, dict) and DELTA_KEY in value
+
+
+def _is_prefix(base: list, value: list) -> bool:
+    return len(base) <= len(value) and all(a is b or a == b for a, b in zip(base, value, strict=False))
+
+
+class DeltaMemorySaver(MemorySaver):
+    """
+    Args:
+        snapshot_interval: この数の差分が続いたら全体を保存する
+        channels: 差分で保存するチャネル(値がlistで、末尾に追加されていくもの)
+    """
+
+    def __init__(
+        self,
+        *,
+        snapshot_interval: int = 16,
+        channels: tuple[str, ...] = ('messages',),
+        serde: SerializerProtocol | None = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        self.snapshot_interval = snapshot_interval
+        self.channels = channels
+        # (thread_id, checkpoint_ns) -> 直前にputしたcheckpointのid と チャネルごとの(値, 差分の深さ)
+        # 次のputの親は通常これなので、親をストレージから復元せずに差分を計算できる
+        self._last: dict[tuple[str, str], tuple[str, dict[str, tuple[list, int]]]] = {}
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable']['checkpoint_ns']
+        parent_id = config['configurable'].get('checkpoint_id')
+
+        values = dict(checkpoint['channel_values'])
+        latest: dict[str, tuple[list, int]] = {}
+        for channel in self.channels:
+            value = values.get(channel)
+            if not isinstance(value, list):
+                continue
+            base = self._base(thread_id, checkpoint_ns, parent_id, channel)
+            depth = 0
+            if base is not None and base[1] + 1 < self.snapshot_interval and _is_prefix(base[0], value):
+                depth = base[1] + 1
+                values[channel] = {DELTA_KEY: parent_id, 'depth': depth, 'append': value[len(base[0]) :]}
+            latest[channel] = (list(value), depth)
+
+        next_config = super().put(config, {**checkpoint, 'channel_values': values}, metadata, new_versions)
+        self._last[(thread_id, checkpoint_ns)] = (checkpoint['id'], latest)
+        return next_config
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        item = super().get_tuple(config)
+        return self._resolve(item, {}) if item is not None else None
+
+    def list(self, config: RunnableConfig | None, **kwargs: Any) -> Iterator[CheckpointTuple]:
+        # 新しい順に返すので、子の復元で計算した親の値を使い回す
+        memo: dict[tuple[str, str], list] = {}
+        for item in super().list(config, **kwargs):
+            yield self._resolve(item, memo)
+
+    def _base(self, thread_id: str, checkpoint_ns: str, parent_id: str | None, channel: str) -> tuple[list, int] | None:
+        if parent_id is None:
+            return None
+        last = self._last.get((thread_id, checkpoint_ns))
+        if last is not None and last[0] == parent_id:
+            return last[1].get(channel)
+        # 過去のcheckpointから分岐した場合
+        return self._load(thread_id, checkpoint_ns, parent_id, channel, {})
+
+    def _load(
+        self,
+        thread_id: str,
+        checkpoint_ns: str,
+        checkpoint_id: str,
+        channel: str,
+        memo: dict[tuple[str, str], list],
+    ) -> tuple[list, int] | None:
+        """checkpoint_idのチャネルの値を、全体が保存されたcheckpointまで親をたどって復元する"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        deltas: list[tuple[str, dict]] = []
+        base: list | None = None
+        while True:
+            if (checkpoint_id, channel) in memo:
+                base = memo.pop((checkpoint_id, channel))
+                break
+            saved = checkpoints.get(checkpoint_id)
+            if saved is None:
+                return None
+            value = self.serde.loads_typed(saved[0])['channel_values'].get(channel)
+            if not _is_delta(value):
+                base = value if isinstance(value, list) else None
+                break
+            deltas.append((checkpoint_id, value))
+            checkpoint_id = value[DELTA_KEY]
+        if base is None:
+            return None
+
+        messages = list(base)
+        for cid, delta in reversed(deltas[1:]):
+            messages = messages + delta['append']
+            memo[(cid, channel)] = messages
+        if deltas:
+            messages = messages + deltas[0][1]['append']
+        return messages, deltas[0][1]['depth'] if deltas else 0
+
+    def _resolve(self, item: CheckpointTuple, memo: dict[tuple[str, str], list]) -> CheckpointTuple:
+        values = item.checkpoint['channel_values']
+        thread_id = item.config['configurable']['thread_id']
+        checkpoint_ns = item.config['configurable'].get('checkpoint_ns', '')
+        checkpoint_id = item.config['configurable']['checkpoint_id']
+        for channel in self.channels:
+            value = values.get(channel)
+            if not _is_delta(value):
+                continue
+            restored = self._load(thread_id, checkpoint_ns, value[DELTA_KEY], channel, memo)
+            if restored is None:
+                raise ValueError(f'checkpoint {checkpoint_id} の差分の元になるcheckpointが見つかりません')
+            values[channel] = restored[0] + value['append']
+        return item
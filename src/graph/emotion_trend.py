@@ -0,0 +1,328 @@
+"""
+ユーザーごとのemotion_fluctuationの推移を、会話が届くたびにO(1)で更新する
+
+新しい会話のたびにユーザーの全履歴から集計し直すと、履歴の長さに比例して遅くなる。
+ユーザーごとに次の値だけを持ち、1件ごとに更新する。
+
+- 直近window(created_atの期間)の件数・合計・二乗和: windowをbuckets個の区間に分けたリングバッファで持ち、
+  windowより古い区間は捨てる(平均と分散をここから求める)
+- 指数加重平均: 半減期の短いもの(short)と長いもの(long)。会話の間隔が不規則なので、間隔に応じて減衰させる
+- 落ち込みの検出: shortがlongをdrop_threshold以上下回ったら落ち込みとし、入った時点でalertを立てる
+  (shortがlongのdrop_threshold / 2以内に戻ったら解除する)
+
+全ユーザーの状態をnumpyの配列にまとめて持つので、ユーザー1人あたり数百バイトで、save/loadで保存・復元できる。
+過去の履歴はbackfillで配列のまままとめて取り込める(ConversationStoreからも取り込める)。
+
+    engine = TrendEngine.load(path) if path.exists() else TrendEngine()
+    snapshot = engine.update_conversation('user-1', conversation)
+    if snapshot.alert:
+        notify_care_team(snapshot)
+    engine.save(path)
+"""
+
+import os
+import threading
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from src.graph.conversation_classification import Conversation
+from src.graph.conversation_store import ConversationStore, to_micros
+
+_US = timedelta(microseconds=1)
+
+
+@dataclass(frozen=True)
+class TrendConfig:
+    window: timedelta = timedelta(days=7)
+    # windowを区切る区間の数。多いほど区間の境界での誤差が小さくなり、状態が大きくなる
+    buckets: int = 7
+    short_half_life: timedelta = timedelta(days=1)
+    long_half_life: timedelta = timedelta(days=14)
+    # shortがlongをこの値以上下回ったら落ち込みとする(emotion_fluctuationの0〜100の目盛りで)
+    drop_threshold: float = 15.0
+    # 履歴がこの件数に満たないユーザーは判定しない
+    min_count: int = 3
+
+    @property
+    def bucket_width(self) -> int:
+        return self.window // _US // self.buckets
+
+    @property
+    def half_lives(self) -> np.ndarray:
+        return np.array([self.short_half_life / _US, self.long_half_life / _US])
+
+
+@dataclass(frozen=True)
+class TrendSnapshot:
+    user: str
+    count: int
+    window_count: int
+    window_mean: float | None
+    window_std: float | None
+    ewma_short: float
+    ewma_long: float
+    dropping: bool
+    # この更新で落ち込みに入った
+    alert: bool = False
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class TrendEngine:
+    # 配列の名前と、ユーザー1人あたりの形
+    _FIELDS = {
+        'count': ((), np.int64),
+        'last_at': ((), np.int64),
+        'ewma': ((2,), np.float64),
+        # リングバッファの最新の区間の番号(created_at // bucket_width)
+        'bucket_at': ((), np.int64),
+        'window_count': (('buckets',), np.int32),
+        'window_sum': (('buckets',), np.float64),
+        'window_squares': (('buckets',), np.float64),
+        'dropping': ((), np.bool_),
+    }
+
+    def __init__(self, config: TrendConfig | None = None, capacity: int = 1024):
+        self.config = config or TrendConfig()
+        self.users: list[str] = []
+        self.index: dict[str, int] = {}
+        self.state = {name: self._empty(name, capacity) for name in self._FIELDS}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def _empty(self, name: str, n: int) -> np.ndarray:
+        shape, dtype = self._FIELDS[name]
+        return np.zeros((n, *(self.config.buckets if s == 'buckets' else s for s in shape)), dtype)
+
+    def _user(self, user: str) -> int:
+        i = self.index.get(user)
+        if i is None:
+            i = self.index[user] = len(self.users)
+            self.users.append(user)
+            capacity = len(self.state['count'])
+            if i >= capacity:
+                # 足りなくなったら倍に広げる
+                for name, values in self.state.items():
+                    self.state[name] = np.concatenate([values, self._empty(name, capacity)])
+        return i
+
+    # 1件ずつの更新
+
+    def update(self, user: str, emotion: float, created_at: datetime | int | np.integer) -> TrendSnapshot:
+        """
+        created_atにはdatetimeか、UTCのエポックからのマイクロ秒を渡す
+        (ConversationStore.column('created_at')の値(np.int64)もそのまま渡せる)
+        """
+        at = int(created_at) if isinstance(created_at, int | np.integer) else to_micros(created_at)
+        with self._lock:
+            i = self._user(user)
+            s = self.state
+            if s['count'][i] == 0:
+                s['ewma'][i] = emotion
+            else:
+                # 古い会話が後から届いた場合は、間隔を0として平均には反映しない
+                dt = max(at - s['last_at'][i], 0)
+                weight = 1 - 0.5 ** (dt / self.config.half_lives)
+                s['ewma'][i] += weight * (emotion - s['ewma'][i])
+            s['count'][i] += 1
+            s['last_at'][i] = max(s['last_at'][i], at)
+
+            bucket = at // self.config.bucket_width
+            self._advance(i, bucket)
+            if bucket > s['bucket_at'][i] - self.config.buckets:
+                slot = bucket % self.config.buckets
+                s['window_count'][i, slot] += 1
+                s['window_sum'][i, slot] += emotion
+                s['window_squares'][i, slot] += emotion * emotion
+
+            was_dropping = bool(s['dropping'][i])
+            s['dropping'][i] = self._dropping(s['ewma'][i], s['count'][i], was_dropping)
+            return self._snapshot(i, alert=bool(s['dropping'][i]) and not was_dropping)
+
+    def update_conversation(self, user: str, conversation: Conversation) -> TrendSnapshot:
+        return self.update(user, conversation.emotion_fluctuation, conversation.created_at)
+
+    def _advance(self, i: int, bucket: int) -> None:
+        """リングバッファの最新の区間をbucketまで進め、windowから外れた区間を空にする"""
+        s = self.state
+        if s['count'][i] == 1:
+            s['bucket_at'][i] = bucket
+            return
+        if bucket <= s['bucket_at'][i]:
+            return
+        n = self.config.buckets
+        # 進める区間の数はbuckets個までなので、1件あたりの手間は一定
+        for b in range(max(s['bucket_at'][i] + 1, bucket - n + 1), bucket + 1):
+            s['window_count'][i, b % n] = 0
+            s['window_sum'][i, b % n] = 0
+            s['window_squares'][i, b % n] = 0
+        s['bucket_at'][i] = bucket
+
+    def _dropping(self, ewma: np.ndarray, count: int, was_dropping: bool) -> bool:
+        if count < self.config.min_count:
+            return False
+        gap = ewma[0] - ewma[1]
+        if was_dropping:
+            return gap < -self.config.drop_threshold / 2
+        return gap <= -self.config.drop_threshold
+
+    def _snapshot(self, i: int, now: int | None = None, alert: bool = False) -> TrendSnapshot:
+        s = self.state
+        counts, sums, squares = s['window_count'][i], s['window_sum'][i], s['window_squares'][i]
+        if now is not None:
+            # nowから見てwindowより古い区間は数えない
+            n = self.config.buckets
+            latest = s['bucket_at'][i]
+            age = (latest - np.arange(n)) % n
+            valid = latest - age > now // self.config.bucket_width - n
+            counts, sums, squares = counts * valid, sums * valid, squares * valid
+        window_count = int(counts.sum())
+        mean = std = None
+        if window_count:
+            mean = float(sums.sum() / window_count)
+            std = float(np.sqrt(max(squares.sum() / window_count - mean * mean, 0.0)))
+        return TrendSnapshot(
+            user=self.users[i],
+            count=int(s['count'][i]),
+            window_count=window_count,
+            window_mean=mean,
+            window_std=std,
+            ewma_short=float(s['ewma'][i, 0]),
+            ewma_long=float(s['ewma'][i, 1]),
+            dropping=bool(s['dropping'][i]),
+            alert=alert,
+        )
+
+    def snapshot(self, user: str, now: datetime | None = None) -> TrendSnapshot | None:
+        """nowを渡すと、その時点のwindowで平均と分散を求める(省略時は最後の会話の時点)"""
+        with self._lock:
+            i = self.index.get(user)
+            if i is None:
+                return None
+            return self._snapshot(i, to_micros(now) if now is not None else None)
+
+    def dropping_users(self) -> list[str]:
+        with self._lock:
+            return [self.users[i] for i in np.flatnonzero(self.state['dropping'][: len(self.users)])]
+
+    # まとめて取り込む
+
+    def backfill(
+        self, user_codes: np.ndarray, names: Sequence[str], emotion: np.ndarray, created_at: np.ndarray
+    ) -> None:
+        """
+        過去の履歴を配列のまままとめて取り込む。件数・windowの集計・指数加重平均は1件ずつupdateした場合と同じになる。
+        落ち込みの判定は取り込み後の値で1回だけ行う(途中の会話でのalertは返さない)
+
+        user_codes[i]はnamesの添字。各ユーザーの履歴は、既に取り込んだ会話より新しいものである必要がある。
+        """
+        if len(user_codes) == 0:
+            return
+        config = self.config
+        with self._lock:
+            codes = np.unique(user_codes)
+            mapping = np.full(len(names), -1, np.int64)
+            mapping[codes] = [self._user(names[c]) for c in codes]
+            s = self.state
+            idx = mapping[user_codes]
+            order = np.lexsort((created_at, idx))
+            idx, at, x = idx[order], np.asarray(created_at, np.int64)[order], np.asarray(emotion, np.float64)[order]
+            n_users = len(self.users)
+
+            # 直前の会話からの間隔。ユーザーの最初の会話は、既に取り込んだ最後の会話との間隔にする
+            first = np.ones(len(idx), bool)
+            first[1:] = idx[1:] != idx[:-1]
+            previous = np.empty_like(at)
+            previous[1:] = at[:-1]
+            had_state = s['count'][idx] > 0
+            previous[first] = s['last_at'][idx[first]]
+            dt = np.maximum(at - previous, 0).astype(np.float64)
+
+            # 指数加重平均は e_n = Σ w_i x_i * 0.5 ** ((t_n - t_i) / h) と展開でき、
+            # w_i = 1 - 0.5 ** (dt_i / h) (履歴の無いユーザーの最初の会話だけw = 1)
+            last_at = s['last_at'][:n_users].copy()
+            np.maximum.at(last_at, idx, at)
+            touched = np.zeros(n_users, bool)
+            touched[idx] = True
+            for k, half_life in enumerate(config.half_lives):
+                weight = 1 - 0.5 ** (dt / half_life)
+                weight[first & ~had_state] = 1.0
+                terms = weight * x * 0.5 ** ((last_at[idx] - at) / half_life)
+                ewma = s['ewma'][:n_users, k].copy()
+                ewma[touched] *= 0.5 ** ((last_at[touched] - s['last_at'][:n_users][touched]) / half_life)
+                ewma[touched & (s['count'][:n_users] == 0)] = 0.0
+                s['ewma'][:n_users, k] = ewma + np.bincount(idx, weights=terms, minlength=n_users)
+
+            # リングバッファ: 最新の区間を進めて古い区間を空にしてから、windowに入る会話を足す
+            n = config.buckets
+            bucket = at // config.bucket_width
+            new_bucket_at = np.where(s['count'][:n_users] > 0, s['bucket_at'][:n_users], np.iinfo(np.int64).min)
+            np.maximum.at(new_bucket_at, idx, bucket)
+            old_bucket_at = s['bucket_at'][:n_users]
+            for slot in range(n):
+                # 各スロットが表していた区間の番号
+                held = old_bucket_at - (old_bucket_at - slot) % n
+                stale = touched & (held <= new_bucket_at - n)
+                s['window_count'][:n_users, slot][stale] = 0
+                s['window_sum'][:n_users, slot][stale] = 0
+                s['window_squares'][:n_users, slot][stale] = 0
+            in_window = bucket > new_bucket_at[idx] - n
+            cell = (idx[in_window], bucket[in_window] % n)
+            np.add.at(s['window_count'], cell, 1)
+            np.add.at(s['window_sum'], cell, x[in_window])
+            np.add.at(s['window_squares'], cell, x[in_window] ** 2)
+
+            s['bucket_at'][:n_users][touched] = new_bucket_at[touched]
+            s['last_at'][:n_users] = last_at
+            s['count'][:n_users] += np.bincount(idx, minlength=n_users)
+            for i in np.flatnonzero(touched):
+                s['dropping'][i] = self._dropping(s['ewma'][i], s['count'][i], bool(s['dropping'][i]))
+
+    def backfill_store(self, store: ConversationStore, **where: Any) -> None:
+        """ConversationStoreの会話を取り込む。whereはConversationStore.maskの条件"""
+        user, emotion, created_at = (
+            store.column('user'),
+            store.column('emotion_fluctuation'),
+            store.column('created_at'),
+        )
+        mask = store.mask(**where)
+        if mask is not None:
+            user, emotion, created_at = user[mask], emotion[mask], created_at[mask]
+        self.backfill(np.asarray(user), store.dictionaries['user'].values, emotion, created_at)
+
+    # 保存
+
+    def save(self, path: str | Path) -> None:
+        """途中で落ちても前回の状態が残るよう、一時ファイルに書いてから置き換える"""
+        path = Path(path)
+        tmp = path.with_name(path.name + '.tmp')
+        with self._lock:
+            n = len(self.users)
+            with tmp.open('wb') as f:
+                np.savez(
+                    f,
+                    users=np.array(self.users, dtype=str),
+                    **{name: values[:n] for name, values in self.state.items()},
+                )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | Path, config: TrendConfig | None = None) -> 'TrendEngine':
+        """configは保存したときと同じ区間の数(buckets)である必要がある"""
+        with np.load(path) as data:
+            engine = cls(config, capacity=max(len(data['users']), 1))
+            if data['window_count'].shape[1:] != (engine.config.buckets,):
+                raise ValueError(f'保存した状態とbucketsの数が違います: {data["window_count"].shape[1:]}')
+            engine.users = [str(u) for u in data['users']]
+            engine.index = {u: i for i, u in enumerate(engine.users)}
+            for name in cls._FIELDS:
+                engine.state[name][: len(engine.users)] = data[name]
+        return engine
@@ -0,0 +1,345 @@
+"""
+コンパイル済みのグラフのノードごとに、実行時間・LLMとツールの時間・トークン数・リトライ回数を集計する
+
+    metrics = GraphMetrics()
+    llm = ChatOpenAI(model='gpt-4o', callbacks=[metrics.handler('plan_and_execute')])
+    app = instrument(build_app(planner=build_planner(llm), ...), metrics, name='plan_and_execute')
+    await app.ainvoke(inputs)
+    print(metrics.to_prometheus())  # Prometheusのテキスト形式
+    print(json.dumps(metrics.summary()))
+
+ノードの実行時間・例外・リトライはノードを包んで計測する(LangChainのコールバックを使わないのでオーバーヘッドが小さい)。
+LLMとツールの時間・トークン数はGraphInstrumentationコールバックで集計する。
+グラフ全体にコールバックを付けるとグラフ内の全てのRunnableでコールバックの処理が走るため、
+モデルやツールのcallbacksに直接渡すか、instrument(..., callbacks=True)で有効にする。
+サブグラフ(react agentなど)の中で呼ばれたLLMやツールは、呼び出し元のトップレベルのノードに集計する。
+"""
+
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass, field
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig
+from langgraph.pregel import Pregel
+from langgraph.pregel.read import DEFAULT_BOUND, PregelNode
+from langgraph.utils.config import merge_configs
+
+# 秒単位のバケット。LLMの応答待ちを含むため、Prometheusの既定値より上限を広げている
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# リトライの検出のために覚えておく、例外で終了したタスクの数の上限
+MAX_FAILED_TASKS = 1024
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 最後の要素は+Infのバケット
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """バケットの中で線形補間して分位数を推定する(Prometheusのhistogram_quantileと同じ考え方)"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    def summary(self) -> dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+@dataclass
+class NodeMetrics:
+    wall: Histogram = field(default_factory=Histogram)
+    llm: Histogram = field(default_factory=Histogram)
+    tool: Histogram = field(default_factory=Histogram)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    errors: int = 0
+
+
+# (メトリクス名, 説明, NodeMetricsの属性)
+_HISTOGRAMS = [
+    ('graph_node_duration_seconds', 'ノードの実行時間', 'wall'),
+    ('graph_llm_duration_seconds', 'ノード内のLLM呼び出しの時間', 'llm'),
+    ('graph_tool_duration_seconds', 'ノード内のツール呼び出しの時間', 'tool'),
+]
+_COUNTERS = [
+    ('graph_prompt_tokens_total', 'LLMに入力したトークン数', 'prompt_tokens'),
+    ('graph_completion_tokens_total', 'LLMが出力したトークン数', 'completion_tokens'),
+    ('graph_node_retries_total', 'RetryPolicyによるノードのリトライ回数', 'retries'),
+    ('graph_node_errors_total', '例外で終了したノードの数', 'errors'),
+]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class GraphMetrics:
+    """(グラフ名, ノード名)ごとのメトリクス。複数のグラフ・スレッドから共有できる"""
+
+    def __init__(self):
+        self.nodes: dict[tuple[str, str], NodeMetrics] = {}
+        self.lock = threading.Lock()
+
+    def node(self, graph: str, node: str) -> NodeMetrics:
+        metrics = self.nodes.get((graph, node))
+        if metrics is None:
+            metrics = self.nodes.setdefault((graph, node), NodeMetrics())
+        return metrics
+
+    def handler(self, graph: str) -> 'GraphInstrumentation':
+        """モデルやツールのcallbacksに渡して、LLMとツールの時間・トークン数を記録するコールバック"""
+        return GraphInstrumentation(self, graph)
+
+    def _sorted(self) -> list[tuple[tuple[str, str], NodeMetrics]]:
+        with self.lock:
+            return sorted(self.nodes.items())
+
+    def to_prometheus(self) -> str:
+        nodes = self._sorted()
+        lines: list[str] = []
+        for name, help_text, attr in _HISTOGRAMS:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (graph, node), metrics in nodes:
+                histogram: Histogram = getattr(metrics, attr)
+                if histogram.count == 0:
+                    continue
+                labels = f'graph="{_escape(graph)}",node="{_escape(node)}"'
+                cumulative = 0
+                for bound, n in zip((*histogram.buckets, float('inf')), histogram.counts, strict=True):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels},le="{_format_float(bound)}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {_format_float(histogram.sum)}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        for name, help_text, attr in _COUNTERS:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (graph, node), metrics in nodes:
+                labels = f'graph="{_escape(graph)}",node="{_escape(node)}"'
+                lines.append(f'{name}{{{labels}}} {getattr(metrics, attr)}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """{グラフ名: {ノード名: メトリクス}} の形のJSONにできる辞書"""
+        result: dict[str, dict[str, dict[str, Any]]] = {}
+        for (graph, node), metrics in self._sorted():
+            result.setdefault(graph, {})[node] = {
+                'wall_seconds': metrics.wall.summary(),
+                'llm_seconds': metrics.llm.summary(),
+                'tool_seconds': metrics.tool.summary(),
+                'prompt_tokens': metrics.prompt_tokens,
+                'completion_tokens': metrics.completion_tokens,
+                'retries': metrics.retries,
+                'errors': metrics.errors,
+            }
+        return result
+
+
+def top_level_node(metadata: dict | None) -> str | None:
+    """langgraphがコールバックに渡すmetadataから、トップレベルのノード名を取り出す"""
+    ns = (metadata or {}).get('langgraph_checkpoint_ns')
+    return ns.split('|', 1)[0].split(':', 1)[0] if ns else None
+
+
+def token_usage(response: Any) -> tuple[int, int]:
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage:
+                return usage.get('input_tokens', 0), usage.get('output_tokens', 0)
+    usage = (response.llm_output or {}).get('token_usage') or {}
+    return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+
+
+class _TimedNode(Runnable):
+    """ノードのRunnableを包み、1回の実行ごとの時間・例外・リトライをGraphMetricsに記録する"""
+
+    def __init__(self, bound: Runnable, metrics: GraphMetrics, graph: str, node: str, failed: dict[str, None]):
+        self.bound = bound
+        self.metrics = metrics
+        self.graph = graph
+        self.node = node
+        self.name = bound.get_name()
+        self.node_metrics = metrics.node(graph, node)
+        # 例外で終了したタスクのcheckpoint_ns。同じタスクがもう一度始まったらリトライとみなす
+        # (リトライされずにグラフが終了した分が溜まり続けないよう、古いものから捨てる)
+        self.failed = failed
+
+    def _start(self, config: RunnableConfig | None) -> tuple[str | None, float]:
+        ns = (config or {}).get('metadata', {}).get('langgraph_checkpoint_ns')
+        if ns is not None and self.failed.pop(ns, False) is None:
+            with self.metrics.lock:
+                self.node_metrics.retries += 1
+        return ns, time.perf_counter()
+
+    def _end(self, ns: str | None, start: float, error: BaseException | None) -> None:
+        elapsed = time.perf_counter() - start
+        if error is not None and ns is not None:
+            self.failed[ns] = None
+            if len(self.failed) > MAX_FAILED_TASKS:
+                del self.failed[next(iter(self.failed))]
+        with self.metrics.lock:
+            self.node_metrics.wall.observe(elapsed)
+            if error is not None:
+                self.node_metrics.errors += 1
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        ns, start = self._start(config)
+        try:
+            output = self.bound.invoke(input, config, **kwargs)
+        except BaseException as e:
+            self._end(ns, start, e)
+            raise
+        self._end(ns, start, None)
+        return output
+
+    async def ainvoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        ns, start = self._start(config)
+        try:
+            output = await self.bound.ainvoke(input, config, **kwargs)
+        except BaseException as e:
+            self._end(ns, start, e)
+            raise
+        self._end(ns, start, None)
+        return output
+
+    def stream(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Iterator[Any]:
+        ns, start = self._start(config)
+        try:
+            yield from self.bound.stream(input, config, **kwargs)
+        except BaseException as e:
+            self._end(ns, start, e)
+            raise
+        self._end(ns, start, None)
+
+    async def astream(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> AsyncIterator[Any]:
+        ns, start = self._start(config)
+        try:
+            async for chunk in self.bound.astream(input, config, **kwargs):
+                yield chunk
+        except BaseException as e:
+            self._end(ns, start, e)
+            raise
+        self._end(ns, start, None)
+
+
+class GraphInstrumentation(BaseCallbackHandler):
+    """LLMとツールの時間・トークン数をGraphMetricsに記録するコールバック。複数の実行で使い回せる"""
+
+    # スレッドプールを経由せずにその場で呼び出す(計測の誤差とオーバーヘッドを減らす)
+    run_inline = True
+    # ノードの時間は_TimedNodeで計測するため、chainのイベントは受け取らない
+    ignore_chain = True
+
+    def __init__(self, metrics: GraphMetrics, graph: str):
+        self.metrics = metrics
+        self.graph = graph
+        # run_id -> (ノード名, 開始時刻)
+        self._llm: dict[UUID, tuple[str, float]] = {}
+        self._tools: dict[UUID, tuple[str, float]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        node = top_level_node(metadata)
+        if node is not None:
+            self._llm[run_id] = (node, time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm.pop(run_id, None)
+        if started is None:
+            return
+        node, start = started
+        elapsed = time.perf_counter() - start
+        prompt_tokens, completion_tokens = token_usage(response)
+        with self.metrics.lock:
+            metrics = self.metrics.node(self.graph, node)
+            metrics.llm.observe(elapsed)
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._llm.pop(run_id, None)
+        if started is not None:
+            elapsed = time.perf_counter() - started[1]
+            with self.metrics.lock:
+                self.metrics.node(self.graph, started[0]).llm.observe(elapsed)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata=None, **kwargs: Any) -> None:
+        node = top_level_node(metadata)
+        if node is not None:
+            self._tools[run_id] = (node, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._tools.pop(run_id, None)
+        if started is not None:
+            elapsed = time.perf_counter() - started[1]
+            with self.metrics.lock:
+                self.metrics.node(self.graph, started[0]).tool.observe(elapsed)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_tool_end(None, run_id=run_id)
+
+
+_NODE_PARAMS = set(inspect.signature(PregelNode).parameters) - {'bound'}
+
+
+def instrument[G: Pregel](graph: G, metrics: GraphMetrics, name: str | None = None, *, callbacks: bool = False) -> G:
+    """
+    graphのトップレベルのノードを計測するコピー(graphと同じクラス)を返す。get_stateなどのメソッドはそのまま使える
+
+    callbacks=Trueにすると、GraphInstrumentationをグラフ全体に付けてLLMとツールも計測する
+    (モデルやツールに直接コールバックを渡せない場合に使う)
+    """
+    name = name or graph.get_name()
+    failed: dict[str, None] = {}
+    nodes = {}
+    for node_name, node in graph.nodes.items():
+        bound = node.bound
+        if bound is DEFAULT_BOUND:
+            # __start__などの入力をそのまま書き込むだけのノードは計測しない
+            nodes[node_name] = node
+            continue
+        if isinstance(bound, _TimedNode):
+            bound = bound.bound
+        attrs = {k: v for k, v in vars(node).items() if k in _NODE_PARAMS}
+        nodes[node_name] = PregelNode(**attrs, bound=_TimedNode(bound, metrics, name, node_name, failed))
+    update: dict[str, Any] = {'nodes': nodes}
+    if callbacks:
+        # with_configではなくconfigを書き換えたコピーにする(RunnableBindingで包むとget_stateなどが使えなくなる)
+        update['config'] = merge_configs(graph.config, {'callbacks': [GraphInstrumentation(metrics, name)]})
+    return graph.copy(update=update)
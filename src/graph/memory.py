@@ -1,66 +1,98 @@
+from functools import partial
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 
-model = ChatOpenAI(model='gpt-4o')
+from src.graph.checkpoint_history import CheckpointHistory, IndexedMemorySaver
+from src.graph.checkpoint_retention import RetainingMemorySaver, RetentionPolicy
+from src.graph.micro_batch import MicroBatcher
 
 
-def call_model(state: MessagesState):
+def call_model(state: MessagesState, *, model: Runnable):
     response = model.invoke(state['messages'])
     return {'messages': response}
 
 
-builder = StateGraph(MessagesState)
-builder.add_node('call_model', call_model)
-builder.add_edge(START, 'call_model')
-graph = builder.compile()
-
-# checkpointerをコンパイル時に指定する
-memory = MemorySaver()
-
-# thread_idを指定する
-config = {'configurable': {'thread_id': '1'}}
-graph = builder.compile(checkpointer=memory)
-
-answer1 = graph.invoke(
-    {
-        'messages': [
-            {
-                'role': 'user',
-                'content': '次に与える2つの数字に対して、計算してください [2,3]',
-            }
-        ]
-    },
-    config,
-)
-answer2_1 = graph.invoke(
-    {
-        'messages': [
-            {
-                'role': 'user',
-                'content': '与えられた数字の合計は？',
-            }
-        ]
-    },
-    config,
-)
-print('復元前の回答: ', answer2_1['messages'][-1].content)
-
-# 各ステップのチェックポイントを取得
-all_states = []
-for state in graph.get_state_history(config):
-    all_states.append(state)
-
-answer2_2 = graph.invoke(
-    {
-        'messages': [
-            {
-                'role': 'user',
-                'content': '与えられた数字を掛け算してください',
-            }
-        ]
-    },
-    all_states[3].config,
-)
-print('--------------------------------')
-print('復元後の回答: ', answer2_2['messages'][-1].content)
+def build_graph(
+    model: BaseChatModel | None = None,
+    checkpointer: BaseCheckpointSaver | None = None,
+    retention: RetentionPolicy | None = None,
+    batcher: MicroBatcher | None = None,
+    compaction_interval: float = 1.0,
+) -> CompiledStateGraph:
+    if model is None:
+        model = ChatOpenAI(model='gpt-4o')
+    # batcherを渡した場合は、複数のthreadから同時に届いたモデルの呼び出しをまとめてbatchで実行する
+    runnable: Runnable = model if batcher is None else batcher.wrap(model)
+
+    builder = StateGraph(MessagesState)
+    builder.add_node('call_model', partial(call_model, model=runnable))
+    builder.add_edge(START, 'call_model')
+
+    # checkpointerをコンパイル時に指定する
+    # retentionを指定した場合は、ポリシーに従って古いcheckpointをcompaction_interval秒ごとに
+    # バックグラウンドで削除するMemorySaverを使う(graph.checkpointer.stop()かプロセスの終了で止まる)
+    # そうでなければ、履歴を索引で引けるMemorySaverを使う(CheckpointHistory)
+    if checkpointer is None and retention is not None:
+        checkpointer = RetainingMemorySaver(retention)
+        checkpointer.start(compaction_interval)
+    elif checkpointer is None:
+        checkpointer = IndexedMemorySaver()
+    return builder.compile(checkpointer=checkpointer)
+
+
+def main():
+    graph = build_graph()
+
+    # thread_idを指定する
+    config = {'configurable': {'thread_id': '1'}}
+
+    graph.invoke(
+        {
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': '次に与える2つの数字に対して、計算してください [2,3]',
+                }
+            ]
+        },
+        config,
+    )
+    answer2_1 = graph.invoke(
+        {
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': '与えられた数字の合計は？',
+                }
+            ]
+        },
+        config,
+    )
+    print('復元前の回答: ', answer2_1['messages'][-1].content)
+
+    # 1回目の回答を書き込んだ時点(step 1)のチェックポイントを索引で探す
+    history = CheckpointHistory(graph)
+    first_answer = history.at_step(config, 1)
+
+    answer2_2 = graph.invoke(
+        {
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': '与えられた数字を掛け算してください',
+                }
+            ]
+        },
+        first_answer.config,
+    )
+    print('--------------------------------')
+    print('復元後の回答: ', answer2_2['messages'][-1].content)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+store.putされた記憶をベクトル化して索引し、質問に関係する上位k件だけを取り出す
+
+埋め込みは外部APIを使わないハッシュ埋め込み(単語と文字bigramを次元に割り当てる)で、
+namespaceごとにnumpyの行列として持つ。検索は内積とargpartitionでまとめて計算する。
+"""
+
+import itertools
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Any
+
+import numpy as np
+from langgraph.store.base import BaseStore, GetOp, Item, Op, PutOp, Result, SearchOp
+
+_WORD = re.compile(r'[a-z0-9]+')
+_NON_ASCII_RUN = re.compile(r'[^\x00-\x7f]+')
+
+
+class HashingEmbedder:
+    """
+    英数字は単語、日本語などは文字bigramを特徴量として、dim次元に符号付きでハッシュする
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def features(self, text: str) -> list[str]:
+        text = text.lower()
+        features = _WORD.findall(text)
+        for run in _NON_ASCII_RUN.findall(text):
+            if len(run) == 1:
+                features.append(run)
+            features.extend(run[i : i + 2] for i in range(len(run) - 1))
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                # hash()はプロセスごとに値が変わるため、crc32で安定させる
+                h = zlib.crc32(feature.encode('utf-8'))
+                rows.append(row)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    1つのnamespaceの索引。行列の末尾に追記し、削除は最終行で埋めることでO(1)にする
+    """
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.keys: list[str] = []
+        self.rows: dict[str, int] = {}
+        # 追加順(古い順)。上限を超えたときはここから削除する
+        self.order: OrderedDict[str, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, vector: np.ndarray) -> None:
+        if key in self.rows:
+            self.vectors[self.rows[key]] = vector
+            self.order.move_to_end(key)
+            return
+        if len(self.keys) == len(self.vectors):
+            grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[: len(self.keys)] = self.vectors[: len(self.keys)]
+            self.vectors = grown
+        self.rows[key] = len(self.keys)
+        self.vectors[len(self.keys)] = vector
+        self.keys.append(key)
+        self.order[key] = None
+
+    def remove(self, key: str) -> None:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        self.order.pop(key)
+        last_key = self.keys.pop()
+        if last_key != key:
+            self.vectors[row] = self.vectors[len(self.keys)]
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+
+    def top_k(self, query: np.ndarray, k: int) -> list[str]:
+        n = len(self.keys)
+        if n == 0 or k <= 0:
+            return []
+        scores = self.vectors[:n] @ query
+        if n > k:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(n)
+        ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [self.keys[i] for i in ordered]
+
+
+class IndexedMemoryStore(BaseStore):
+    """
+    BaseStoreのラッパー。putの度に記憶を索引し、namespaceごとの件数がmax_itemsを超えたら古いものから削除する
+
+    索引はメモリにだけ持つ。namespaceに初めて触れたときに、storeに入っている記憶から作り直す(再起動後も検索できる)。
+    索引はstoreへの書き込みが成功してから更新する。
+
+        store = IndexedMemoryStore(InMemoryStore(), max_items=1000)
+        store.search_top_k(('memories', user_id), 'What is my name?', k=5)
+    """
+
+    # 索引を作り直すときに、storeから1回に読む件数
+    LOAD_PAGE_SIZE = 1000
+
+    def __init__(
+        self,
+        store: BaseStore,
+        *,
+        embedder: HashingEmbedder | None = None,
+        max_items: int | None = None,
+        text_key: str = 'data',
+    ):
+        self.store = store
+        self.embedder = embedder or HashingEmbedder()
+        self.max_items = max_items
+        self.text_key = text_key
+        self.indexes: dict[tuple[str, ...], VectorIndex] = {}
+        self._lock = threading.Lock()
+
+    def _text(self, value: dict[str, Any] | None) -> str | None:
+        text = value.get(self.text_key) if value else None
+        return text if isinstance(text, str) else None
+
+    def _unloaded(self, ops: Iterable[Op]) -> list[tuple[str, ...]]:
+        namespaces = {op.namespace for op in ops if isinstance(op, PutOp)}
+        return [namespace for namespace in namespaces if namespace not in self.indexes]
+
+    def _page(self, namespace: tuple[str, ...], offset: int) -> SearchOp:
+        return SearchOp(namespace, limit=self.LOAD_PAGE_SIZE, offset=offset)
+
+    def _install(self, namespace: tuple[str, ...], items: list[Item]) -> None:
+        """storeから読んだ記憶で索引を作る。他のスレッドが先に作っていたらそちらを使う"""
+        # searchは前方一致なので、下の階層のnamespaceの記憶を除く
+        items = sorted((item for item in items if item.namespace == namespace), key=lambda item: item.updated_at)
+        texts = [self._text(item.value) for item in items]
+        embedded = [i for i, text in enumerate(texts) if text is not None]
+        vectors = self.embedder.embed([texts[i] for i in embedded]) if embedded else []
+        index = VectorIndex(self.embedder.dim, capacity=max(len(embedded), 64))
+        for i, vector in zip(embedded, vectors, strict=True):
+            index.add(items[i].key, vector)
+        with self._lock:
+            self.indexes.setdefault(namespace, index)
+
+    def _load(self, namespace: tuple[str, ...]) -> None:
+        items: list[Item] = []
+        while True:
+            (page,) = self.store.batch([self._page(namespace, len(items))])
+            items += page
+            if len(page) < self.LOAD_PAGE_SIZE:
+                break
+        self._install(namespace, items)
+
+    async def _aload(self, namespace: tuple[str, ...]) -> None:
+        items: list[Item] = []
+        while True:
+            (page,) = await self.store.abatch([self._page(namespace, len(items))])
+            items += page
+            if len(page) < self.LOAD_PAGE_SIZE:
+                break
+        self._install(namespace, items)
+
+    def _apply(self, ops: list[Op]) -> list[PutOp]:
+        """書き込めたputを索引に反映し、上限を超えて削除する記憶のPutOpを返す"""
+        puts = [op for op in ops if isinstance(op, PutOp)]
+        if not puts:
+            return []
+        texts = [self._text(op.value) for op in puts]
+        embedded = [i for i, text in enumerate(texts) if text is not None]
+        vectors = self.embedder.embed([texts[i] for i in embedded]) if embedded else None
+        vector_of = {i: vectors[n] for n, i in enumerate(embedded)} if vectors is not None else {}
+
+        evictions: list[PutOp] = []
+        with self._lock:
+            for i, op in enumerate(puts):
+                index = self.indexes[op.namespace]
+                if i in vector_of:
+                    index.add(op.key, vector_of[i])
+                else:
+                    index.remove(op.key)
+            for namespace in {op.namespace for op in puts}:
+                index = self.indexes[namespace]
+                if self.max_items is not None and len(index) > self.max_items:
+                    oldest = list(itertools.islice(index.order, len(index) - self.max_items))
+                    evictions += [PutOp(namespace, key, None) for key in oldest]
+        return evictions
+
+    def _evicted(self, evictions: list[PutOp]) -> None:
+        with self._lock:
+            for op in evictions:
+                self.indexes[op.namespace].remove(op.key)
+
+    def batch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        for namespace in self._unloaded(ops):
+            self._load(namespace)
+        results = self.store.batch(ops)
+        evictions = self._apply(ops)
+        if evictions:
+            self.store.batch(evictions)
+            self._evicted(evictions)
+        return results
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        for namespace in self._unloaded(ops):
+            await self._aload(namespace)
+        results = await self.store.abatch(ops)
+        evictions = self._apply(ops)
+        if evictions:
+            await self.store.abatch(evictions)
+            self._evicted(evictions)
+        return results
+
+    def _top_k_ops(self, namespace: tuple[str, ...], query: str, k: int) -> list[Op]:
+        index = self.indexes.get(namespace)
+        if index is None:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            keys = index.top_k(query_vector, k)
+        return [GetOp(namespace, key) for key in keys]
+
+    def search_top_k(self, namespace: tuple[str, ...], query: str, k: int = 5) -> list[Item]:
+        """queryに近い順にk件の記憶を返す"""
+        if namespace not in self.indexes:
+            self._load(namespace)
+        ops = self._top_k_ops(namespace, query, k)
+        return [item for item in self.store.batch(ops) if item is not None] if ops else []
+
+    async def asearch_top_k(self, namespace: tuple[str, ...], query: str, k: int = 5) -> list[Item]:
+        if namespace not in self.indexes:
+            await self._aload(namespace)
+        ops = self._top_k_ops(namespace, query, k)
+        return [item for item in await self.store.abatch(ops) if item is not None] if ops else []
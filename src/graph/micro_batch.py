@@ -0,0 +1,194 @@
+"""
+同時に届いたLLMの呼び出しをまとめて、1回のbatchで実行する(マイクロバッチ)
+
+多数の会話が同時に動いていると、memory_chainやreply_chain、memory.pyのcall_modelの呼び出しが
+数ミリ秒のうちに何百件も届く。最初の呼び出しからwindow秒待つか、max_batch_size件集まった時点で
+包んだRunnableのbatch/abatchにまとめて渡し、結果をそれぞれの呼び出し元に返す。
+
+    batcher = MicroBatcher(max_batch_size=32, window=0.005)
+    memory_chain = build_memory_chain(llm, batcher=batcher)
+    graph = memory.build_graph(model, batcher=batcher)
+    print(batcher.summary())
+
+Runnableのbatchは既定では要素ごとに並行にinvokeするだけなので、1回のリクエストにまとまるのは
+batch/abatchを実装したモデル(バッチ推論のエンドポイントを持つもの)の場合。
+包むRunnableごとに別々にまとめるので、同じbatcherを複数のチェーンで使ってもスキーマが混ざることはない。
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from src.graph.instrumentation import Histogram
+
+DEFAULT_MAX_BATCH_SIZE = 16
+# 最初の呼び出しから次の呼び出しを待つ時間(秒)。LLMの応答時間に比べて十分小さくする
+DEFAULT_WINDOW = 0.005
+
+# バッチの埋まり具合(件数 / max_batch_size)のバケット
+FILL_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+
+@dataclass
+class BatchStats:
+    # バッチの埋まり具合
+    fill: Histogram = field(default_factory=lambda: Histogram(FILL_BUCKETS))
+    # 呼び出してからバッチが実行されるまでの待ち時間(秒)。まとめることで増えた遅延
+    added_latency: Histogram = field(default_factory=Histogram)
+    batches: int = 0
+    calls: int = 0
+    # max_batch_sizeに達して、windowを待たずに実行したバッチの数
+    full_batches: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'calls': self.calls,
+            'full_batches': self.full_batches,
+            'mean_batch_size': self.calls / self.batches if self.batches else 0.0,
+            'fill': self.fill.summary(),
+            'added_latency': self.added_latency.summary(),
+        }
+
+
+@dataclass
+class _Call:
+    input: Any
+    config: RunnableConfig
+    future: Any
+    submitted: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class _Batch:
+    calls: list[_Call] = field(default_factory=list)
+    # スレッドから呼ばれた場合に、先頭の呼び出しがwindowの終わりより前に起こされるためのイベント
+    full: threading.Event = field(default_factory=threading.Event)
+    timer: asyncio.TimerHandle | None = None
+
+
+class _Coalescer:
+    """
+    1つのRunnableへの呼び出しをまとめる。スレッドからの呼び出しとイベントループからの呼び出しは別々にまとめる
+
+    スレッドの場合は、バッチを始めた呼び出しがwindowだけ待ってから、そのスレッドで全員分のbatchを実行する。
+    """
+
+    def __init__(self, runnable: Runnable, batcher: 'MicroBatcher'):
+        self.runnable = runnable
+        self.batcher = batcher
+        self._lock = threading.Lock()
+        self._batch: _Batch | None = None
+        self._abatches: dict[asyncio.AbstractEventLoop, _Batch] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def _join(self, batch: _Batch, call: _Call) -> bool:
+        """バッチに加え、max_batch_sizeに達したらTrueを返す"""
+        batch.calls.append(call)
+        return len(batch.calls) >= self.batcher.max_batch_size
+
+    def invoke(self, input: Any, config: RunnableConfig) -> Any:
+        call = _Call(input, config, Future())
+        with self._lock:
+            leader = self._batch is None
+            if leader:
+                self._batch = _Batch()
+            batch = self._batch
+            if self._join(batch, call):
+                self._batch = None
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.batcher.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._dispatch(batch)
+        return call.future.result()
+
+    def _dispatch(self, batch: _Batch) -> None:
+        self.batcher.record(batch)
+        try:
+            results = self.runnable.batch(
+                [c.input for c in batch.calls], [c.config for c in batch.calls], return_exceptions=True
+            )
+        except BaseException as e:
+            results = [e] * len(batch.calls)
+        for call, result in zip(batch.calls, results, strict=True):
+            if isinstance(result, BaseException):
+                call.future.set_exception(result)
+            else:
+                call.future.set_result(result)
+
+    async def ainvoke(self, input: Any, config: RunnableConfig) -> Any:
+        loop = asyncio.get_running_loop()
+        call = _Call(input, config, loop.create_future())
+        batch = self._abatches.get(loop)
+        if batch is None:
+            batch = self._abatches[loop] = _Batch()
+            batch.timer = loop.call_later(self.batcher.window, self._aflush, loop, batch)
+        if self._join(batch, call):
+            batch.timer.cancel()
+            self._aflush(loop, batch)
+        return await call.future
+
+    def _aflush(self, loop: asyncio.AbstractEventLoop, batch: _Batch) -> None:
+        if self._abatches.get(loop) is batch:
+            del self._abatches[loop]
+        task = loop.create_task(self._adispatch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _adispatch(self, batch: _Batch) -> None:
+        self.batcher.record(batch)
+        # 待つのをやめた(キャンセルされた)呼び出しは除く
+        calls = [c for c in batch.calls if not c.future.done()]
+        if not calls:
+            return
+        try:
+            results = await self.runnable.abatch(
+                [c.input for c in calls], [c.config for c in calls], return_exceptions=True
+            )
+        except BaseException as e:
+            results = [e] * len(calls)
+        for call, result in zip(calls, results, strict=True):
+            if call.future.done():
+                continue
+            if isinstance(result, BaseException):
+                call.future.set_exception(result)
+            else:
+                call.future.set_result(result)
+
+
+class MicroBatcher:
+    def __init__(self, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, window: float = DEFAULT_WINDOW):
+        self.max_batch_size = max_batch_size
+        self.window = window
+        self.stats = BatchStats()
+        self._lock = threading.Lock()
+
+    def record(self, batch: _Batch) -> None:
+        now = time.perf_counter()
+        size = len(batch.calls)
+        with self._lock:
+            self.stats.batches += 1
+            self.stats.calls += size
+            self.stats.full_batches += size >= self.max_batch_size
+            self.stats.fill.observe(size / self.max_batch_size)
+            for call in batch.calls:
+                self.stats.added_latency.observe(now - call.submitted)
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            return self.stats.summary()
+
+    def wrap(self, runnable: Runnable, name: str | None = None) -> Runnable:
+        """
+        runnableと同じ入出力のRunnableを返す。invoke/ainvokeを同時に呼んだものがまとめてbatch/abatchで実行される
+        """
+        coalescer = _Coalescer(runnable, self)
+        return RunnableLambda(coalescer.invoke, afunc=coalescer.ainvoke, name=name or f'batched_{runnable.get_name()}')
@@ -0,0 +1,234 @@
+"""
+生成途中のJSONテキストを少しずつ読み進めるスキャナー
+
+構造化出力をストリーミングすると、LLMのトークンはJSONの断片として届く。
+届くたびに全体をパースし直すと応答の長さの2乗に比例して遅くなるため、
+新しく届いた部分だけを読み、文字列の値を確定した分からパスごとに取り出す。
+また、指定したパスの配列の要素を、オブジェクトが閉じた時点で1件ずつ取り出す。
+
+    scanner = JsonStreamScanner()
+    scanner.feed('{"action": {"respon')     # => []
+    scanner.feed('se": "東京で')             # => [(('action', 'response'), '東京で')]
+
+    scanner = JsonStreamScanner(items=('conversations',))
+    scanner.feed('{"conversations": [{"text": "a"}, {"te')
+    scanner.take_items()                    # => [{'text': 'a'}]
+"""
+
+import json
+import re
+from collections.abc import AsyncIterator, Iterator
+from typing import Any, get_args, get_origin
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import Runnable, RunnableGenerator
+from pydantic import BaseModel
+
+# 文字列の外で読み飛ばさずに処理する文字
+_STRUCTURAL = re.compile(r'[{}\[\]:,"]')
+# 文字列の中で特別に扱う文字
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+Path = tuple[str | int, ...]
+
+
+class JsonStreamScanner:
+    """
+    JSONテキストを先頭から順に受け取り、文字列の値をパスごとに返す
+
+    パスはオブジェクトのキーと配列のindexのtuple。feedは今回新しく確定した文字列の断片を
+    [(path, text), ...]で返す。1つの文字列が複数回のfeedにまたがる場合は、同じパスで続きが返る。
+
+    itemsを指定すると、そのパスにある配列の要素(オブジェクトか配列)が閉じるたびに、
+    要素をパースしてtake_itemsで取り出せるようにする。items=()ならトップレベルの値そのものを取り出す。
+    """
+
+    def __init__(self, items: Path | None = None):
+        self.items = items
+        self._ready: list[Any] = []
+        # 読んでいる途中の要素のテキストと、要素を開いた後の深さ
+        self._item_parts: list[str] = []
+        self._item_depth: int | None = None
+        # 開いているコンテナごとの [種類('{' or '['), 現在のキーかindex, 次に来るのがキーか]
+        self._stack: list[list] = []
+        self._in_string = False
+        self._is_key = False
+        self._key_chars: list[str] = []
+        # バックスラッシュの後: ''、\uXXXXの途中: 'u' + 読んだ16進数
+        self._escape: str | None = None
+        self._high_surrogate: int | None = None
+
+    @property
+    def path(self) -> Path:
+        return tuple(frame[1] for frame in self._stack)
+
+    @property
+    def depth(self) -> int:
+        return len(self._stack)
+
+    def take_items(self) -> list[Any]:
+        """
+        前回の呼び出し以降に閉じた要素を返す
+        """
+        items, self._ready = self._ready, []
+        return items
+
+    def feed(self, chunk: str) -> list[tuple[Path, str]]:
+        fragments: list[tuple[Path, str]] = []
+        value: list[str] = []
+        # このchunkのうち、読んでいる途中の要素のテキストが始まる位置
+        item_start = 0 if self._item_depth is not None else None
+        i = 0
+        while i < len(chunk):
+            if self._in_string:
+                i = self._read_string(chunk, i, self._key_chars if self._is_key else value)
+                if not self._in_string and not self._is_key:
+                    self._flush(fragments, value)
+                continue
+            match = _STRUCTURAL.search(chunk, i)
+            if match is None:
+                break
+            i = match.end()
+            c = match.group()
+            if c in '{[' and self._item_depth is None and self._is_item_start():
+                item_start = match.start()
+                self._item_depth = len(self._stack) + 1
+            elif c in '}]' and self._item_depth is not None and len(self._stack) == self._item_depth:
+                self._item_parts.append(chunk[item_start:i])
+                self._ready.append(json.loads(''.join(self._item_parts)))
+                self._item_parts = []
+                self._item_depth = None
+                item_start = None
+            self._structural(c)
+        if self._in_string and not self._is_key:
+            self._flush(fragments, value)
+        if item_start is not None:
+            self._item_parts.append(chunk[item_start:])
+        return fragments
+
+    def _is_item_start(self) -> bool:
+        if self.items is None:
+            return False
+        if not self.items:
+            return not self._stack
+        return bool(self._stack) and self._stack[-1][0] == '[' and self.path[:-1] == self.items
+
+    def _flush(self, fragments: list[tuple[Path, str]], value: list[str]) -> None:
+        if value:
+            fragments.append((self.path, ''.join(value)))
+            value.clear()
+
+    def _structural(self, c: str) -> None:
+        if c == '"':
+            self._in_string = True
+            self._is_key = bool(self._stack) and self._stack[-1][2]
+            self._key_chars = []
+        elif c in '{[':
+            # キーが来るまではNone、配列は0番目から
+            self._stack.append([c, None if c == '{' else 0, c == '{'])
+        elif c in '}]':
+            if self._stack:
+                self._stack.pop()
+        elif c == ',' and self._stack:
+            frame = self._stack[-1]
+            if frame[0] == '[':
+                frame[1] += 1
+            else:
+                frame[2] = True
+
+    def _read_string(self, chunk: str, i: int, out: list[str]) -> int:
+        while i < len(chunk):
+            if self._escape is not None:
+                i = self._read_escape(chunk, i, out)
+                continue
+            match = _STRING_SPECIAL.search(chunk, i)
+            end = match.start() if match else len(chunk)
+            if end > i:
+                out.append(chunk[i:end])
+            if match is None:
+                return len(chunk)
+            if match.group() == '\\':
+                self._escape = ''
+                i = end + 1
+                continue
+            # 文字列の終わり
+            self._in_string = False
+            if self._is_key:
+                frame = self._stack[-1]
+                frame[1] = ''.join(self._key_chars)
+                frame[2] = False
+            return end + 1
+        return i
+
+    def _read_escape(self, chunk: str, i: int, out: list[str]) -> int:
+        if self._escape == '':
+            c = chunk[i]
+            if c == 'u':
+                self._escape = 'u'
+            else:
+                out.append(_ESCAPES.get(c, c))
+                self._escape = None
+            return i + 1
+        # \uXXXX: 4桁揃うまで読む
+        need = 5 - len(self._escape)
+        self._escape += chunk[i : i + need]
+        i += min(need, len(chunk) - i)
+        if len(self._escape) == 5:
+            code = int(self._escape[1:], 16)
+            self._escape = None
+            if 0xD800 <= code < 0xDC00:
+                self._high_surrogate = code
+            elif 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+                out.append(chr(0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)))
+                self._high_surrogate = None
+            else:
+                out.append(chr(code))
+        return i
+
+
+def _item_type(schema: type[BaseModel], items: Path) -> type[BaseModel]:
+    # ('conversations',) -> ConversationClassification.conversations: list[Conversation] -> Conversation
+    item_type: Any = schema
+    for key in items:
+        item_type = item_type.model_fields[key].annotation
+        if get_origin(item_type) is list:
+            item_type = get_args(item_type)[0]
+    return item_type
+
+
+def stream_structured_items(llm: BaseChatModel, schema: type[BaseModel], items: Path) -> Runnable:
+    """
+    llm.with_structured_output(schema)のストリーミング版
+
+    ツール呼び出しの引数(JSON)を生成途中から読み、itemsのパスにある配列の要素を
+    オブジェクトが閉じた時点でpydanticモデルにして1件ずつ返す。stream/astreamで使う。
+
+        chain = prompt | stream_structured_items(llm, ConversationClassification, ('conversations',))
+        async for conversation in chain.astream({'messages': [...]}):
+            ...
+    """
+    item_type = _item_type(schema, items)
+    # with_structured_output(method='function_calling')と同じく、schemaのツールを必ず呼ばせる
+    structured_llm = llm.bind_tools([schema], tool_choice=schema.__name__)
+
+    def parse(scanner: JsonStreamScanner, chunk: AIMessageChunk) -> list[BaseModel]:
+        for tool_call_chunk in chunk.tool_call_chunks:
+            scanner.feed(tool_call_chunk.get('args') or '')
+        return [item_type.model_validate(item) for item in scanner.take_items()]
+
+    def transform(inputs: Iterator[Any]) -> Iterator[BaseModel]:
+        for prompt_value in inputs:
+            scanner = JsonStreamScanner(items)
+            for chunk in structured_llm.stream(prompt_value):
+                yield from parse(scanner, chunk)
+
+    async def atransform(inputs: AsyncIterator[Any]) -> AsyncIterator[BaseModel]:
+        async for prompt_value in inputs:
+            scanner = JsonStreamScanner(items)
+            async for chunk in structured_llm.astream(prompt_value):
+                for item in parse(scanner, chunk):
+                    yield item
+
+    return RunnableGenerator(transform, atransform, name=f'stream_{schema.__name__}')
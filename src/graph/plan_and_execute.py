@@ -1,26 +1,43 @@
+import argparse
 import asyncio
 import operator
-from typing import Annotated
+import time
+import weakref
+from collections.abc import AsyncIterator
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Annotated, Any
 
 from dotenv import load_dotenv
-from langchain import hub
 from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 from langgraph.prebuilt import create_react_agent
+from langgraph.types import Send
 from pydantic import BaseModel, Field
 from typing_extensions import TypedDict
 
+from src.graph.partial_json import JsonStreamScanner
+from src.graph.run_budget import RunBudget, run_with_budget, warn_if_unenforced
+from src.graph.search_cache import SearchCache
+from src.graph.tool_executor import ParallelToolNode
+
 load_dotenv()
 
-# 検索ツール(Travily)
-# tavily_search_results_jsonという名前でweb検索を行うツールを作成
-tools = [TavilySearchResults(max_results=3)]
+# 1つのwaveで同時に実行するステップ数の上限(config['configurable']['max_parallel_steps']で変更できる)
+# waveの実行可能なステップは全て送り、上限を超えた分は同じwaveの中で空きを待つ
+DEFAULT_MAX_PARALLEL_STEPS = 4
 
-# プロンプト
-prompt = hub.pull('ih/ih-react-agent-executor')
-prompt.pretty_print()
+# 要約モードで1ステップの結果に割り当てるトークン数は、予算のこの割合まで
+# (予算内に最低でも直近DIGEST_MIN_ENTRIES件のステップが残るようにする)
+DIGEST_MIN_ENTRIES = 4
 
 agent_prompt = ChatPromptTemplate.from_messages(
     [
@@ -33,11 +50,22 @@ agent_prompt = ChatPromptTemplate.from_messages(
         ('placeholder', '{messages}'),
     ]
 )
-agent_prompt.pretty_print()
 
-# エージェント
-llm = ChatOpenAI(model='gpt-4-turbo-preview')
-# 次のようなグラフになる
+
+def build_agent_executor(llm: BaseChatModel | None = None, tools: list[BaseTool] | None = None) -> CompiledStateGraph:
+    if tools is None:
+        # 検索ツール(Travily)
+        # tavily_search_results_jsonという名前でweb検索を行うツールを作成
+        # 同じクエリの検索はキャッシュし、実行中なら結果を待つ
+        tools = [SearchCache().wrap(TavilySearchResults(max_results=3))]
+    # エージェント
+    if llm is None:
+        llm = ChatOpenAI(model='gpt-4-turbo-preview')
+    # 検索は並列に実行し、応答がなければ制限時間で打ち切る
+    return create_react_agent(llm, ParallelToolNode(tools), state_modifier=agent_prompt)
+
+
+# build_agent_executorは次のようなグラフになる
 # %%{init: {'flowchart': {'curve': 'linear'}}}%%
 # graph TD;
 #         __start__([<p>__start__</p>]):::first
@@ -53,20 +81,53 @@ llm = ChatOpenAI(model='gpt-4-turbo-preview')
 #         classDef default fill:#f2f0ff,line-height:1.2
 #         classDef first fill-opacity:0
 #         classDef last fill:#bfb6fc
-agent_executor = create_react_agent(llm, tools, state_modifier=agent_prompt)
+
+
+class PastStepsDigest(TypedDict):
+    """
+    replannerに渡す完了済みステップの要約
+
+    past_stepsのうちdigested件までを反映済みで、新しいステップだけを追記していく
+    """
+
+    lines: list[str]
+    line_tokens: list[int]
+    digested: int
+    evicted: int
 
 
 class PlanExecute(TypedDict):
     input: str
     plan: list[str]
+    dependencies: list[list[int]]
     past_steps: Annotated[list[tuple], operator.add]
+    past_steps_digest: PastStepsDigest
+    # replanごとのプロンプトのトークン数(推定値)
+    replan_prompt_tokens: Annotated[list[int], operator.add]
+    # 投機実行の結果(replanごとに1件)と、投機実行したステップを採用したのでagentを経ずにもう一度replanするか
+    speculation: Annotated[list[dict], operator.add]
+    replan_again: bool
     response: str
 
 
+class StepTask(TypedDict):
+    """
+    Sendでagentに渡す1ステップ分の入力
+    """
+
+    plan: list[str]
+    step_index: int
+
+
 class Plan(BaseModel):
     """Plan to follow in future"""
 
     steps: list[str] = Field(description='different steps to follow, should be in sorted order')
+    dependencies: list[list[int]] = Field(
+        default_factory=list,
+        description='For each step (same order as steps), the 1-based numbers of the steps it depends on. '
+        'Use an empty list for steps that can run independently.',
+    )
 
 
 planner_prompt = ChatPromptTemplate.from_messages(
@@ -78,13 +139,19 @@ planner_prompt = ChatPromptTemplate.from_messages(
 この計画には、個々のタスクが含まれており、それを正確に実行すれば、正しい答えが得られるようになっています。
 不要なステップは追加しないでください。
 最終ステップの結果が最終的な答えになります。各ステップには必要な情報がすべて含まれていることを確認し、ステップを飛ばさないようにしてください。
+他のステップの結果を必要としないステップは並列に実行されるため、各ステップが依存するステップの番号をdependenciesに記載してください。
 出力は日本語で行ってください。
 """,
         ),
         ('placeholder', '{messages}'),
     ]
 )
-planner = planner_prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(Plan)
+
+
+def build_planner(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI(model='gpt-4o', temperature=0)
+    return planner_prompt | llm.with_structured_output(Plan)
 
 
 class Response(BaseModel):
@@ -115,87 +182,438 @@ replanner_prompt = ChatPromptTemplate.from_template(
 あなたの元の計画は次の通りでした：
 {plan}
 
+各ステップが依存するステップの番号は次の通りでした：
+{dependencies}
+
 これまでに行ったステップは次の通りです：
 {past_steps}
 
 それに基づいて、計画を更新してください。もし、これ以上ステップが不要でユーザーに返答できる場合は、その旨を伝えてください。そうでなければ、必要なステップのみを計画に追加してください。既に完了したステップを再度計画に含めないようにしてください。
+計画を更新する場合は、更新後の計画の番号でdependenciesも記載してください。
 """
 )
 
-replanner = replanner_prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(
-    schema=Act, method='json_schema'
-)
 
+# response_formatにはpydanticモデルではなくJSON Schemaを渡す。
+# langchain-openaiはpydanticモデルのresponse_formatだとトークンをストリーミングせず、最終回答を逐次表示できないため。
+# strictでは全てのobjectで、デフォルトのあるものも含めて全てのpropertyがrequiredに入っている必要がある。
+# langchainの変換はデフォルトのあるpropertyをrequiredに入れないので、全てのobjectで入れ直す
+def _require_all(schema: Any) -> Any:
+    if isinstance(schema, dict):
+        if 'properties' in schema:
+            schema['required'] = list(schema['properties'])
+        for value in schema.values():
+            _require_all(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            _require_all(value)
+    return schema
+
+
+ACT_SCHEMA = _require_all(convert_to_openai_tool(Act, strict=True)['function'])
+
+
+def build_replanner(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI(model='gpt-4o', temperature=0)
+    return replanner_prompt | llm.with_structured_output(schema=ACT_SCHEMA, method='json_schema') | Act.model_validate
 
-async def execute_step(state: PlanExecute):
+
+def ready_steps(plan: list[str], dependencies: list[list[int]]) -> list[int]:
+    """
+    依存するステップが全て完了しているステップのindexを返す
+
+    dependenciesは1始まりのステップ番号で、現在の計画に残っているステップは未完了として扱う。
+    dependenciesが無いステップは直前のステップに依存する(従来の逐次実行と同じ)。
+    """
+    ready = []
+    for i in range(len(plan)):
+        deps = dependencies[i] if i < len(dependencies) else ([i] if i > 0 else [])
+        if all(not 1 <= d <= len(plan) or d - 1 == i for d in deps):
+            ready.append(i)
+    # 循環した依存関係で実行できるステップが無い場合は、先頭から進める
+    if plan and not ready:
+        ready = [0]
+    return ready
+
+
+def dispatch_steps(state: PlanExecute, config: RunnableConfig) -> list[Send]:
+    plan = state.get('plan') or []
+    indices = ready_steps(plan, state.get('dependencies') or [])
+    return [Send('agent', {'plan': plan, 'step_index': i}) for i in indices]
+
+
+# waveごとのセマフォ。実行中のステップが持っている間だけ残る
+_wave_semaphores: weakref.WeakValueDictionary[tuple, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+
+def _wave_semaphore(config: RunnableConfig) -> asyncio.Semaphore:
+    configurable = config.get('configurable', {})
+    max_parallel = configurable.get('max_parallel_steps', DEFAULT_MAX_PARALLEL_STEPS)
+    # 同じwave(superstep)のステップは同じ親のcheckpointを持つ(checkpointerが無くてもIDは振られる)
+    key = (tuple(sorted((configurable.get('checkpoint_map') or {}).items())), max_parallel)
+    semaphore = _wave_semaphores.get(key)
+    if semaphore is None:
+        semaphore = _wave_semaphores[key] = asyncio.Semaphore(max_parallel)
+    return semaphore
+
+
+async def execute_step(state: StepTask, config: RunnableConfig | None = None, *, agent_executor: Runnable):
+    if config is not None:
+        async with _wave_semaphore(config):
+            return await _execute_step(state, agent_executor)
+    return await _execute_step(state, agent_executor)
+
+
+async def _execute_step(state: StepTask, agent_executor: Runnable):
     plan = state['plan']
-    plan_str = '\n'.join(f'{i+1}. {step}' for i, step in enumerate(plan))
-    task = plan[0]
-    task_formatted = (
-        f"""次の計画に基づいて行動してください。: {plan_str}\n\nあなたのタスクはステップ {1} の実行です: {task}."""
-    )
+    step_index = state['step_index']
+    plan_str = '\n'.join(f'{i + 1}. {step}' for i, step in enumerate(plan))
+    task = plan[step_index]
+    task_formatted = f"""次の計画に基づいて行動してください。: {plan_str}\n\nあなたのタスクはステップ {step_index + 1} の実行です: {task}."""
     agent_response = await agent_executor.ainvoke({'messages': [('user', task_formatted)]})
     return {
         'past_steps': [(task, agent_response['messages'][-1].content)],
     }
 
 
-async def plan_step(state: PlanExecute):
+async def plan_step(state: PlanExecute, config: RunnableConfig, *, planner: Runnable):
+    warn_if_unenforced(config)
     plan = await planner.ainvoke({'messages': [('user', state['input'])]})
     print(plan)
-    return {'plan': plan.steps}
+    return {'plan': plan.steps, 'dependencies': plan.dependencies}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算。ASCIIは4文字で1トークン、それ以外(日本語など)は1文字1トークンとして数える
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 末尾の省略記号の分を残して切り詰める
+    limit = max(max_tokens - 1, 0)
+    ascii_chars = 0
+    other_chars = 0
+    for end, c in enumerate(text):
+        if c.isascii():
+            ascii_chars += 1
+        else:
+            other_chars += 1
+        if (ascii_chars + 3) // 4 + other_chars > limit:
+            return text[:end] + '…'
+    return text
+
+
+def update_digest(digest: PastStepsDigest | None, past_steps: list[tuple], token_budget: int) -> PastStepsDigest:
+    """
+    まだ反映していないステップだけを要約に追記し、予算を超えた分は古いステップから削除する
+    """
+    if digest is None:
+        digest = {'lines': [], 'line_tokens': [], 'digested': 0, 'evicted': 0}
+    lines = list(digest['lines'])
+    line_tokens = list(digest['line_tokens'])
+    evicted = digest['evicted']
+
+    entry_budget = max(token_budget // DIGEST_MIN_ENTRIES, 1)
+    for number, (task, result) in enumerate(past_steps[digest['digested'] :], start=digest['digested'] + 1):
+        line = truncate_to_tokens(f'{number}. {task}: {result}', entry_budget)
+        lines.append(line)
+        line_tokens.append(estimate_tokens(line))
+
+    total = sum(line_tokens)
+    while len(lines) > 1 and total > token_budget:
+        total -= line_tokens.pop(0)
+        lines.pop(0)
+        evicted += 1
+
+    return {'lines': lines, 'line_tokens': line_tokens, 'digested': len(past_steps), 'evicted': evicted}
 
 
-async def replan_step(state: PlanExecute):
-    output = await replanner.ainvoke(state)
+def render_digest(digest: PastStepsDigest) -> str:
+    lines = digest['lines']
+    if digest['evicted']:
+        lines = [f'(これより前の{digest["evicted"]}ステップは省略)'] + lines
+    return '\n'.join(lines)
+
+
+def pending_steps(plan: list[str], dependencies: list[list[int]], done: set[str]) -> tuple[list[str], list[list[int]]]:
+    """
+    完了したステップを計画から除き、dependenciesのステップ番号を付け直す(replannerが計画を変えなかった場合の予想)
+    """
+    keep = [i for i, step in enumerate(plan) if step not in done]
+    if not dependencies:
+        return [plan[i] for i in keep], []
+    numbers = {old + 1: new + 1 for new, old in enumerate(keep)}
+    remapped = []
+    for i in keep:
+        deps = dependencies[i] if i < len(dependencies) else ([i] if i > 0 else [])
+        remapped.append([numbers[d] for d in deps if d in numbers])
+    return [plan[i] for i in keep], remapped
+
+
+async def _timed(coro) -> tuple[Any, float]:
+    result = await coro
+    return result, time.perf_counter()
+
+
+def _speculate(state: PlanExecute, agent_executor: Runnable) -> tuple[asyncio.Task, str] | None:
+    """
+    replannerが計画を変えずに完了したステップを除くだけと予想し、次のステップを先に実行し始める
+
+    次のwaveが1ステップだけの場合に限る(複数のステップを並列に実行できる場合はagentに任せる)
+    """
+    plan, dependencies = pending_steps(
+        state['plan'], state.get('dependencies') or [], {task for task, _ in state['past_steps']}
+    )
+    if not plan or ready_steps(plan, dependencies) != [0]:
+        return None
+    step = {'plan': plan, 'step_index': 0}
+    return asyncio.create_task(_timed(execute_step(step, agent_executor=agent_executor))), plan[0]
+
+
+async def _settle_speculation(
+    task: asyncio.Task, speculated: str, start: float, replanned: float, output: Act
+) -> tuple[dict, dict]:
+    """
+    新しい計画が投機実行したステップから始まっていれば結果を採用し、そうでなければ取り消して捨てる
+
+    (past_stepsへの追加分, 記録)を返す。saved_secondsはreplannerと重なって実行できた時間
+    """
+    hit = isinstance(output.action, Plan) and output.action.steps[:1] == [speculated]
+    if not hit:
+        task.cancel()
+    try:
+        update, finished = await task
+    except asyncio.CancelledError:
+        return {}, {'step': speculated, 'hit': False, 'saved_seconds': 0.0, 'wasted_seconds': replanned - start}
+    except Exception:
+        # 投機実行の失敗は無視する(採用しなかった場合と同じく、通常どおりagentで実行し直す)
+        update, hit, finished = {}, False, time.perf_counter()
+    overlap = min(finished, replanned) - start
+    if not hit:
+        return {}, {'step': speculated, 'hit': False, 'saved_seconds': 0.0, 'wasted_seconds': overlap}
+    return update, {'step': speculated, 'hit': True, 'saved_seconds': overlap, 'wasted_seconds': 0.0}
+
+
+def speculation_summary(records: list[dict]) -> dict[str, Any]:
+    """
+    1回の実行の投機実行の結果(state['speculation'])を集計する
+    """
+    hits = sum(1 for r in records if r['hit'])
+    return {
+        'speculated': len(records),
+        'hits': hits,
+        'hit_rate': hits / len(records) if records else 0.0,
+        'saved_seconds': sum(r['saved_seconds'] for r in records),
+        'wasted_seconds': sum(r['wasted_seconds'] for r in records),
+    }
+
+
+async def replan_step(
+    state: PlanExecute, config: RunnableConfig, *, replanner: Runnable, agent_executor: Runnable | None = None
+):
+    inputs = {
+        'input': state['input'],
+        'plan': state['plan'],
+        'dependencies': state.get('dependencies') or [],
+        'past_steps': state['past_steps'],
+    }
+    update = {}
+    # 要約モード: past_stepsを全て展開する代わりに、予算内の要約を差分更新して使う
+    token_budget = config.get('configurable', {}).get('past_steps_token_budget')
+    if token_budget is not None:
+        digest = update_digest(state.get('past_steps_digest'), state['past_steps'], token_budget)
+        inputs['past_steps'] = render_digest(digest)
+        update['past_steps_digest'] = digest
+    update['replan_prompt_tokens'] = [estimate_tokens(replanner_prompt.format(**inputs))]
+
+    # 投機実行モード: replannerの応答を待つ間に、次のステップをagentで実行しておく
+    speculation = None
+    if agent_executor is not None and config.get('configurable', {}).get('speculative'):
+        speculation = _speculate(state, agent_executor)
+        update['replan_again'] = False
+    start = time.perf_counter()
+    try:
+        output = await replanner.ainvoke(inputs)
+    except BaseException:
+        if speculation is not None:
+            speculation[0].cancel()
+        raise
+    if speculation is not None:
+        speculated, record = await _settle_speculation(*speculation, start, time.perf_counter(), output)
+        update.update(speculated, speculation=[record], replan_again=record['hit'])
     if isinstance(output.action, Response):
-        return {'response': output.action.response}
+        return {**update, 'response': output.action.response}
+    elif not output.action.steps:
+        # 実行するステップが無い計画では先に進めないので、ここで終える
+        return {**update, 'plan': [], 'response': empty_plan_response(state)}
     else:
-        return {'plan': output.action.steps}
+        return {**update, 'plan': output.action.steps, 'dependencies': output.action.dependencies}
 
 
-def should_end(state: PlanExecute):
+def empty_plan_response(state: PlanExecute) -> str:
+    """
+    replannerが回答ではなく空の計画を返した場合の回答。完了したステップの結果をそのまま並べる
+    """
+    past_steps = state.get('past_steps') or []
+    if not past_steps:
+        return '実行するステップが無かったため、回答を作成できませんでした。'
+    lines = [f'{i}. {task}: {result}' for i, (task, result) in enumerate(past_steps, start=1)]
+    return '計画に残りのステップが無いため、これまでの結果を返します。\n' + '\n'.join(lines)
+
+
+def partial_response(state: PlanExecute) -> str:
+    """
+    予算(run_budget)を使い切って途中で止めた場合の回答。完了したステップの結果をそのまま並べる
+    """
+    past_steps = state.get('past_steps') or []
+    if not past_steps:
+        return '時間または利用量の上限に達したため、回答を作成できませんでした。'
+    lines = [f'{i}. {task}: {result}' for i, (task, result) in enumerate(past_steps, start=1)]
+    return '時間または利用量の上限に達したため、途中までの結果を返します。\n' + '\n'.join(lines)
+
+
+def should_end(state: PlanExecute, config: RunnableConfig):
     if 'response' in state and state['response']:
         return END
+    elif state.get('replan_again'):
+        # 投機実行したステップを採用したので、その結果を見てもう一度replanする
+        return 'replan'
     else:
-        return 'agent'
+        # 依存関係を満たしたステップをまとめてagentに渡し、waveごとに1回だけreplanする
+        # (計画が空の場合はreplan_stepがresponseを入れるので、ここには来ない)
+        return dispatch_steps(state, config)
 
 
-workflow = StateGraph(PlanExecute)
+def after_plan(state: PlanExecute, config: RunnableConfig):
+    # plannerが空の計画を返した場合は、ステップを実行せずにreplannerに回答させる
+    return dispatch_steps(state, config) or 'replan'
 
-# Add the plan node
-workflow.add_node('planner', plan_step)
 
-# Add the execution step
-workflow.add_node('agent', execute_step)
+def build_app(
+    planner: Runnable | None = None,
+    replanner: Runnable | None = None,
+    agent_executor: Runnable | None = None,
+) -> CompiledStateGraph:
+    if planner is None:
+        planner = build_planner()
+    if replanner is None:
+        replanner = build_replanner()
+    if agent_executor is None:
+        agent_executor = build_agent_executor()
 
-# Add a replan node
-workflow.add_node('replan', replan_step)
+    workflow = StateGraph(PlanExecute)
 
-workflow.add_edge(START, 'planner')
+    # Add the plan node
+    workflow.add_node('planner', partial(plan_step, planner=planner))
 
-# From plan we go to agent
-workflow.add_edge('planner', 'agent')
+    # Add the execution step (実行可能なステップごとにSendで並列に呼び出される)
+    workflow.add_node('agent', partial(execute_step, agent_executor=agent_executor), input=StepTask)
 
-# From agent, we replan
-workflow.add_edge('agent', 'replan')
+    # Add a replan node
+    workflow.add_node('replan', partial(replan_step, replanner=replanner, agent_executor=agent_executor))
 
-workflow.add_conditional_edges(
-    'replan',
-    # Next, we pass in the function that will determine which node is called next.
-    should_end,
-    ['agent', END],
-)
+    workflow.add_edge(START, 'planner')
+
+    # From plan we go to agent
+    workflow.add_conditional_edges('planner', after_plan, ['agent', 'replan'])
+
+    # From agent, we replan
+    workflow.add_edge('agent', 'replan')
+
+    workflow.add_conditional_edges(
+        'replan',
+        # Next, we pass in the function that will determine which node is called next.
+        should_end,
+        ['agent', 'replan', END],
+    )
 
-app = workflow.compile()
+    return workflow.compile()
 
 
-async def main():
+# replannerの出力(Act)のうち、最終回答の文字列があるパス
+RESPONSE_PATH = ('action', 'response')
+
+
+@dataclass
+class StreamMetrics:
+    """
+    stream_responseの計測結果(秒はいずれもストリーム開始から)
+
+    ttft_seconds: 最終回答の最初の文字が届くまで
+    ttlt_seconds: 最終回答の最後の文字が届くまで
+    """
+
+    ttft_seconds: float | None = None
+    ttlt_seconds: float | None = None
+    total_seconds: float = 0.0
+    chunks: int = 0
+    chars: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+async def stream_response(
+    app: CompiledStateGraph,
+    inputs: dict,
+    config: RunnableConfig | None = None,
+    *,
+    metrics: StreamMetrics | None = None,
+) -> AsyncIterator[str]:
+    """
+    最終回答を、replannerが生成するそばから文字列の断片で返す
+
+    stream_mode='messages'でreplanノードのLLMのトークンを受け取り、ActのJSONを途中まで読んで
+    action.responseの値だけを取り出す。計画を更新するreplan(action.steps)からは何も返らない。
+    """
+    metrics = metrics if metrics is not None else StreamMetrics()
+    # LLMの呼び出し(メッセージid)ごとにJSONを読む
+    scanners: dict[str, JsonStreamScanner] = {}
+    start = time.perf_counter()
+    async for chunk, metadata in app.astream(inputs, config, stream_mode='messages'):
+        if metadata.get('langgraph_node') != 'replan' or not isinstance(chunk, AIMessageChunk):
+            continue
+        scanner = scanners.setdefault(chunk.id, JsonStreamScanner())
+        for path, text in scanner.feed(chunk.content):
+            if path != RESPONSE_PATH:
+                continue
+            elapsed = time.perf_counter() - start
+            if metrics.ttft_seconds is None:
+                metrics.ttft_seconds = elapsed
+            metrics.ttlt_seconds = elapsed
+            metrics.chunks += 1
+            metrics.chars += len(text)
+            yield text
+    metrics.total_seconds = time.perf_counter() - start
+
+
+async def main(stream: bool = False, speculative: bool = False, budget: RunBudget | None = None):
+    app = build_app()
     # mermaid = app.get_graph(xray=True).draw_mermaid()
     # print(mermaid)
 
-    config = {'recursion_limit': 50}
+    config = {'recursion_limit': 50, 'configurable': {'speculative': speculative, 'budget': budget}}
     inputs = {'input': '2024年のオリンピックの開催地はどこですか？'}
+    if stream:
+        # 最終回答をトークン単位で表示する
+        metrics = StreamMetrics()
+        async for text in stream_response(app, inputs, config, metrics=metrics):
+            print(text, end='', flush=True)
+        print()
+        print(metrics.summary())
+        return
+    if budget is not None:
+        # 予算を超えたら途中で止め、完了したステップまでの結果を返す
+        result = await run_with_budget(app, inputs, config, partial_response=partial_response)
+        print(result['response'])
+        print(result['budget'])
+        return
     async for event in app.astream(inputs, config=config):
         for k, v in event.items():
             if k != '__end__':
@@ -205,4 +623,14 @@ async def main():
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stream', action='store_true', help='最終回答をトークン単位で表示し、TTFT/TTLTを出力する')
+    parser.add_argument('--speculative', action='store_true', help='replanの間に次のステップを先に実行する')
+    parser.add_argument('--deadline', type=float, help='1回の実行の制限時間(秒)')
+    parser.add_argument('--max-tokens', type=int, help='1回の実行で使うトークン数の上限')
+    parser.add_argument('--max-tool-calls', type=int, help='1回の実行でのツール呼び出し回数の上限')
+    args = parser.parse_args()
+    budget = None
+    if args.deadline is not None or args.max_tokens is not None or args.max_tool_calls is not None:
+        budget = RunBudget(args.deadline, args.max_tokens, args.max_tool_calls)
+    asyncio.run(main(stream=args.stream, speculative=args.speculative, budget=budget))
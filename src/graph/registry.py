@@ -0,0 +1,69 @@
+"""
+グラフのファクトリを遅延生成で管理するレジストリ
+
+src.graph配下のモジュールはimport時にLLMの生成やネットワークアクセスを行わない。
+get_graph()で初めて要求されたときにbuild_*を呼び出し、生成したグラフをキャッシュする。
+"""
+
+import importlib
+import threading
+from collections.abc import Callable
+from typing import Any
+
+# 名前 -> 'モジュール:ファクトリ関数' (ファクトリのモジュールも使うまでimportしない)
+GRAPH_FACTORIES: dict[str, str | Callable[[], Any]] = {
+    'basic': 'src.graph.basic:build_graph',
+    'state_manage': 'src.graph.state_manage:build_graph',
+    'memory': 'src.graph.memory:build_graph',
+    'store': 'src.graph.store:build_graph',
+    'plan_and_execute': 'src.graph.plan_and_execute:build_app',
+    'tool_calling': 'src.graph.tool_calling:build_agent',
+    'conversation_classification': 'src.graph.conversation_classification:build_chain',
+    'conversation_classification_tiered': 'src.graph.category_classifier:build_tiered_chain',
+    'conversation_reply': 'src.graph.conversation_classification:build_reply_chain',
+    'conversation_memory': 'src.graph.conversation_classification:build_memory_chain',
+    'structured_output': 'src.graph.structured_output:build_chain',
+}
+
+_cache: dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def register(name: str, factory: str | Callable[[], Any]) -> None:
+    """ファクトリを登録する。同名の登録があれば置き換え、キャッシュも破棄する"""
+    with _lock:
+        GRAPH_FACTORIES[name] = factory
+        _cache.pop(name, None)
+
+
+def registered_names() -> list[str]:
+    return sorted(GRAPH_FACTORIES)
+
+
+def resolve_factory(name: str) -> Callable[[], Any]:
+    if name not in GRAPH_FACTORIES:
+        raise KeyError(f'未登録のグラフです: {name}')
+    factory = GRAPH_FACTORIES[name]
+    if callable(factory):
+        return factory
+    module_name, _, attr = factory.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def get_graph(name: str) -> Any:
+    """初回呼び出し時にグラフを生成し、以降はキャッシュを返す"""
+    if name in _cache:
+        return _cache[name]
+    with _lock:
+        # 他スレッドが先に生成している可能性があるため再確認する
+        if name not in _cache:
+            _cache[name] = resolve_factory(name)()
+        return _cache[name]
+
+
+def clear_cache(name: str | None = None) -> None:
+    with _lock:
+        if name is None:
+            _cache.clear()
+        else:
+            _cache.pop(name, None)
@@ -0,0 +1,220 @@
+"""
+構造化出力のレスポンスキャッシュ
+
+(モデル, 展開後のプロンプト, 出力スキーマ)のハッシュをキーに、検証済みのpydanticオブジェクトを返す。
+プロセス内のLRU(件数とTTLで破棄)と、SQLiteによる永続化の2段構成で使う。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from pydantic import BaseModel
+
+
+class CacheTier(Protocol):
+    name: str
+
+    def get(self, key: str) -> str | None: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+class LRUCacheTier:
+    """
+    プロセス内のLRUキャッシュ。max_sizeを超えると古いものから、ttl秒を過ぎたものは参照時に破棄する
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_size: int = 1024, ttl: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._items: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if self.ttl is not None and self.clock() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = (self.clock(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteCacheTier:
+    """
+    SQLiteに保存する永続キャッシュ。プロセスを再起動しても再利用できる
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = ':memory:', ttl: float | None = None, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)'
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute('SELECT value, stored_at FROM response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, stored_at = row
+            if self.ttl is not None and self.clock() - stored_at > self.ttl:
+                self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, stored_at) VALUES (?, ?, ?)',
+                (key, value, self.clock()),
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+@dataclass
+class CacheStats:
+    hits: dict[str, int] = field(default_factory=dict)
+    misses: int = 0
+    hit_seconds: float = 0.0
+    miss_seconds: float = 0.0
+
+    def record_hit(self, tier: str, seconds: float) -> None:
+        self.hits[tier] = self.hits.get(tier, 0) + 1
+        self.hit_seconds += seconds
+
+    def record_miss(self, seconds: float) -> None:
+        self.misses += 1
+        self.miss_seconds += seconds
+
+    def summary(self) -> dict[str, Any]:
+        """ヒット率と、ヒット時・ミス時の平均レイテンシ(ミリ秒)を返す"""
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        avg_hit_ms = self.hit_seconds / hits * 1000 if hits else None
+        avg_miss_ms = self.miss_seconds / self.misses * 1000 if self.misses else None
+        return {
+            'hits': dict(self.hits),
+            'misses': self.misses,
+            'hit_rate': hits / total if total else 0.0,
+            'avg_hit_ms': avg_hit_ms,
+            'avg_miss_ms': avg_miss_ms,
+            'saved_seconds': hits * (avg_miss_ms - avg_hit_ms) / 1000
+            if avg_hit_ms is not None and avg_miss_ms
+            else 0.0,
+        }
+
+
+class ResponseCache:
+    """
+    tiersを先頭から順に参照し、下位のtierでヒットした値は上位のtierにも書き戻す
+    """
+
+    def __init__(self, tiers: list[CacheTier] | None = None):
+        self.tiers = tiers if tiers is not None else [LRUCacheTier()]
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> tuple[str | None, str | None]:
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for upper in self.tiers[:i]:
+                    upper.set(key, value)
+                return value, tier.name
+        return None, None
+
+    def set(self, key: str, value: str) -> None:
+        for tier in self.tiers:
+            tier.set(key, value)
+
+
+def build_response_cache(path: str | None = None, max_size: int = 1024, ttl: float | None = None) -> ResponseCache:
+    tiers: list[CacheTier] = [LRUCacheTier(max_size=max_size, ttl=ttl)]
+    if path is not None:
+        tiers.append(SQLiteCacheTier(path, ttl=ttl))
+    return ResponseCache(tiers)
+
+
+def cache_key(llm_string: str, prompt_value: PromptValue, schema_string: str) -> str:
+    messages = [(m.type, m.content) for m in prompt_value.to_messages()]
+    payload = json.dumps([llm_string, messages, schema_string], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cached_structured_output(
+    llm: BaseChatModel, schema: type[BaseModel], cache: ResponseCache, structured_llm: Runnable | None = None
+) -> Runnable:
+    """
+    llm.with_structured_output(schema)の代わりに使う。プロンプトの後ろにつないで使う
+
+        chain = prompt | cached_structured_output(llm, Memory, cache)
+
+    structured_llmを渡すと、キャッシュに無い場合はllm.with_structured_output(schema)の代わりにそれを呼ぶ
+    """
+    if structured_llm is None:
+        structured_llm = llm.with_structured_output(schema)
+    llm_string = llm._get_llm_string()
+    schema_string = json.dumps(schema.model_json_schema(), sort_keys=True)
+
+    def _lookup(prompt_value: PromptValue) -> tuple[str, BaseModel | None, float]:
+        start = time.perf_counter()
+        key = cache_key(llm_string, prompt_value, schema_string)
+        value, tier = cache.get(key)
+        if value is None:
+            return key, None, start
+        result = schema.model_validate_json(value)
+        cache.stats.record_hit(tier, time.perf_counter() - start)
+        return key, result, start
+
+    def _store(key: str, result: BaseModel, start: float) -> BaseModel:
+        cache.set(key, result.model_dump_json())
+        cache.stats.record_miss(time.perf_counter() - start)
+        return result
+
+    def invoke(prompt_value: PromptValue, config: RunnableConfig) -> BaseModel:
+        key, result, start = _lookup(prompt_value)
+        if result is not None:
+            return result
+        return _store(key, structured_llm.invoke(prompt_value, config), start)
+
+    async def ainvoke(prompt_value: PromptValue, config: RunnableConfig) -> BaseModel:
+        key, result, start = _lookup(prompt_value)
+        if result is not None:
+            return result
+        return _store(key, await structured_llm.ainvoke(prompt_value, config), start)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f'cached_{schema.__name__}')
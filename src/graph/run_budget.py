@@ -0,0 +1,186 @@
+"""
+グラフの1回の実行に、時間・トークン数・ツール呼び出し回数の予算を設ける
+
+    budget = RunBudget(deadline_seconds=60, max_tokens=20000, max_tool_calls=20)
+    config = {'recursion_limit': 50, 'configurable': {'budget': budget}}
+    result = await run_with_budget(app, inputs, config, partial_response=partial_response)
+    result['budget']['exceeded']  # 'deadline' / 'tokens' / 'tool_calls' / None
+
+recursion_limitはステップ数しか制限しないため、1つのステップが長引くとワーカーが何分も占有される。
+予算を使い切った時点で実行中のグラフのタスクをキャンセルし、LLMの応答待ちやツールの待ちをそこで中断する。
+例外にはせず、最後に確定した状態からpartial_responseで途中までの回答を作って返す。
+
+予算を守らせるのはrun_with_budgetだけで、同じconfigでapp.ainvoke/astreamを呼んでも(GraphServerを含む)制限されない。
+budgetを読むノードではwarn_if_unenforcedを呼び、run_with_budgetを通していない場合に警告する。
+"""
+
+import asyncio
+import threading
+import time
+import warnings
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.runnables import RunnableConfig
+from langgraph.pregel import Pregel
+
+from src.graph.instrumentation import token_usage
+
+
+@dataclass
+class RunBudget:
+    """
+    いずれもNoneなら制限しない。config['configurable']['budget']にこのオブジェクトかdictで渡す
+    """
+
+    deadline_seconds: float | None = None
+    # 入力と出力を合わせたトークン数
+    max_tokens: int | None = None
+    max_tool_calls: int | None = None
+
+    @classmethod
+    def from_config(cls, config: RunnableConfig | None) -> 'RunBudget | None':
+        budget = (config or {}).get('configurable', {}).get('budget')
+        if budget is None or isinstance(budget, RunBudget):
+            return budget
+        return cls(**budget)
+
+
+class BudgetTracker(BaseCallbackHandler):
+    """
+    LLMのトークン数とツールの呼び出し回数を数え、予算を超えたらon_exceededを1回だけ呼ぶ
+
+    ストリーミング中のLLMは届いたトークンを1つずつ数え、生成の途中でも打ち切れるようにする
+    (終了時に使用量が分かれば、その値に置き換える)。ツールはスレッドからも呼ばれるためロックを取る。
+    """
+
+    run_inline = True
+    ignore_chain = True
+
+    def __init__(self, budget: RunBudget, on_exceeded: Callable[[], None] = lambda: None):
+        self.budget = budget
+        self.on_exceeded = on_exceeded
+        self.tokens = 0
+        self.tool_calls = 0
+        self.exceeded: str | None = None
+        self.start = time.perf_counter()
+        self._streamed: dict[UUID, int] = {}
+        self._lock = threading.Lock()
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'exceeded': self.exceeded,
+            'seconds': time.perf_counter() - self.start,
+            'tokens': self.tokens,
+            'tool_calls': self.tool_calls,
+        }
+
+    def exceed(self, reason: str) -> None:
+        with self._lock:
+            if self.exceeded is not None:
+                return
+            self.exceeded = reason
+        self.on_exceeded()
+
+    def _add(self, tokens: int = 0, tool_calls: int = 0) -> None:
+        with self._lock:
+            self.tokens += tokens
+            self.tool_calls += tool_calls
+            over_tokens = self.budget.max_tokens is not None and self.tokens > self.budget.max_tokens
+            over_tools = self.budget.max_tool_calls is not None and self.tool_calls > self.budget.max_tool_calls
+        if over_tokens:
+            self.exceed('tokens')
+        elif over_tools:
+            self.exceed('tool_calls')
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._streamed[run_id] = self._streamed.get(run_id, 0) + 1
+        self._add(tokens=1)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            streamed = self._streamed.pop(run_id, 0)
+        used = sum(token_usage(response))
+        if used:
+            self._add(tokens=used - streamed)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._streamed.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._add(tool_calls=1)
+
+
+def _with_callback(config: RunnableConfig, handler: BaseCallbackHandler) -> RunnableConfig:
+    callbacks = config.get('callbacks')
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    return {**config, 'callbacks': callbacks}
+
+
+def warn_if_unenforced(config: RunnableConfig) -> None:
+    """configに予算があるのに、run_with_budgetを通さずに実行されている場合に警告する"""
+    if RunBudget.from_config(config) is None:
+        return
+    callbacks = config.get('callbacks')
+    handlers = callbacks.handlers if isinstance(callbacks, BaseCallbackManager) else callbacks or []
+    if not any(isinstance(handler, BudgetTracker) for handler in handlers):
+        warnings.warn(
+            "config['configurable']['budget'] is only enforced by run_with_budget; this run is not limited",
+            RuntimeWarning,
+            stacklevel=2,
+        )
+
+
+async def run_with_budget(
+    app: Pregel,
+    inputs: dict,
+    config: RunnableConfig | None = None,
+    *,
+    partial_response: Callable[[dict], str],
+) -> dict:
+    """
+    appをconfig['configurable']['budget']の予算内で実行し、最後の状態を返す
+
+    予算を使い切った場合は、最後のステップ(superstep)が終わった時点の状態に
+    partial_responseで作った'response'を入れて返す。どちらの場合も'budget'に使用量と超えた予算の種類を入れる。
+    """
+    config = config or {}
+    budget = RunBudget.from_config(config) or RunBudget()
+    loop = asyncio.get_running_loop()
+    exhausted = asyncio.Event()
+    tracker = BudgetTracker(budget, on_exceeded=lambda: loop.call_soon_threadsafe(exhausted.set))
+    state: dict = {}
+
+    async def consume():
+        nonlocal state
+        async for values in app.astream(inputs, _with_callback(config, tracker), stream_mode='values'):
+            state = values
+
+    task = asyncio.create_task(consume())
+    waiter = asyncio.create_task(exhausted.wait())
+    stopped = False
+    try:
+        await asyncio.wait({task, waiter}, timeout=budget.deadline_seconds, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+        if not task.done():
+            task.cancel()
+            stopped = True
+    try:
+        await task
+    except asyncio.CancelledError:
+        # 予算で止めたのではないキャンセル(呼び出し側からのもの)は、そのまま伝える
+        if not stopped or asyncio.current_task().cancelling():
+            raise
+        tracker.exceed('deadline')
+        return {**state, 'response': partial_response(state), 'budget': tracker.summary()}
+    return {**state, 'budget': tracker.summary()}
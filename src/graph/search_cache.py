@@ -0,0 +1,207 @@
+"""
+検索ツールの結果のキャッシュ
+
+plan_and_executeでは、同時に動く複数のプランや同じプランの続くステップが、同じ(ほぼ同じ)クエリで検索することが多い。
+クエリを正規化したものをキーに、結果をttl秒だけ保持する。
+同じキーの検索が実行中なら、新しく検索せずにその結果を待つ(single-flight)。
+スレッド(invoke)・イベントループ(ainvoke)をまたいで共有できる。
+
+    cache = SearchCache(ttl=600)
+    search = cache.wrap(TavilySearchResults(max_results=3))
+    agent_executor = build_agent_executor(tools=[search])
+    print(cache.summary())
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from typing import Any
+from uuid import uuid4
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.tools import BaseTool, StructuredTool
+
+from src.graph.response_cache import CacheStats, LRUCacheTier
+
+# 検索結果を保持する時間(秒)
+DEFAULT_SEARCH_TTL = 600.0
+
+_SPACES = re.compile(r'\s+')
+# クエリの前後にあっても検索結果が変わらない記号
+_TRIM = ' ?？!！。.、,'
+# TavilySearchResultsは失敗するとrepr(e)を返すので、キャッシュしない
+_ERROR_RESULT = re.compile(r'^\w+(Error|Exception)\(')
+
+
+def normalize_query(query: str) -> str:
+    """全角・半角と大文字・小文字、空白の違い、前後の記号を無視する"""
+    query = unicodedata.normalize('NFKC', query).casefold()
+    return _SPACES.sub(' ', query).strip(_TRIM)
+
+
+def is_error_result(result: Any) -> bool:
+    return isinstance(result, str) and _ERROR_RESULT.match(result) is not None
+
+
+class SearchCache:
+    """
+    結果はJSONにして保持するため、検索結果はJSONにできる値(TavilySearchResultsならlist[dict])である必要がある。
+    JSONにできない結果は検索した呼び出しにだけ返し、実行中に待っていた呼び出しにはTypeErrorを返す。
+    例外やis_errorに当てはまる結果はキャッシュしない(実行中に待っていた呼び出しには同じ例外・結果を返す)。
+    """
+
+    def __init__(
+        self,
+        ttl: float | None = DEFAULT_SEARCH_TTL,
+        max_size: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+        is_error: Callable[[Any], bool] = is_error_result,
+    ):
+        self.tier = LRUCacheTier(max_size=max_size, ttl=ttl, clock=clock)
+        self.is_error = is_error
+        self.stats = CacheStats()
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(tool_name: str, args: dict[str, Any]) -> str:
+        args = {k: normalize_query(v) if isinstance(v, str) else v for k, v in args.items()}
+        return json.dumps([tool_name, args], ensure_ascii=False, sort_keys=True)
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            return {**self.stats.summary(), 'size': len(self.tier)}
+
+    def _claim(self, key: str) -> tuple[str | None, Future | None, bool]:
+        """
+        (キャッシュの値, 実行中の検索, 自分が検索するか)を返す
+        """
+        with self._lock:
+            value = self.tier.get(key)
+            if value is not None:
+                return value, None, False
+            future = self._inflight.get(key)
+            if future is not None:
+                return None, future, False
+            future = self._inflight[key] = Future()
+            return None, future, True
+
+    def _settle(
+        self,
+        key: str,
+        future: Future,
+        start: float,
+        result: Any = None,
+        error: BaseException | None = None,
+        is_error: Callable[[Any], bool] | None = None,
+    ):
+        value = None
+        try:
+            if error is None:
+                value = json.dumps(result, ensure_ascii=False)
+                # キャッシュに入れてから実行中の一覧から外す(その間に来た呼び出しはどちらかで結果を受け取れる)
+                if not (is_error or self.is_error)(result):
+                    self.tier.set(key, value)
+        except Exception as e:
+            # JSONにできない結果はキャッシュせず、待っていた呼び出しにはその例外を返す
+            error = e
+        finally:
+            # 何が起きても実行中の一覧から外して待っている呼び出しを起こす。残すと同じキーの呼び出しがすべて止まる
+            with self._lock:
+                del self._inflight[key]
+                self.stats.record_miss(time.perf_counter() - start)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    def _hit(self, tier: str, value: str, start: float) -> Any:
+        with self._lock:
+            self.stats.record_hit(tier, time.perf_counter() - start)
+        return json.loads(value)
+
+    def run(self, key: str, search: Callable[[], Any], is_error: Callable[[Any], bool] | None = None) -> Any:
+        start = time.perf_counter()
+        value, future, leader = self._claim(key)
+        if value is not None:
+            return self._hit('memory', value, start)
+        if not leader:
+            return self._hit('inflight', future.result(), start)
+        try:
+            result = search()
+        except BaseException as e:
+            self._settle(key, future, start, error=e)
+            raise
+        self._settle(key, future, start, result, is_error=is_error)
+        return result
+
+    async def arun(
+        self, key: str, search: Callable[[], Awaitable[Any]], is_error: Callable[[Any], bool] | None = None
+    ) -> Any:
+        start = time.perf_counter()
+        value, future, leader = self._claim(key)
+        if value is not None:
+            return self._hit('memory', value, start)
+        if not leader:
+            # 別のスレッドやイベントループで実行中の検索も待てるよう、concurrent.futures.Futureで待つ
+            return self._hit('inflight', await asyncio.wrap_future(future), start)
+        try:
+            result = await search()
+        except BaseException as e:
+            self._settle(key, future, start, error=e)
+            raise
+        self._settle(key, future, start, result, is_error=is_error)
+        return result
+
+    def wrap(self, tool: BaseTool) -> BaseTool:
+        """
+        toolと同じ名前・説明・引数・response_formatのツールを返す。エージェントに渡すプロンプトは変わらない
+        TavilySearchResultsのようにcontent_and_artifactのツールは、(content, artifact)の組をキャッシュする
+        """
+        if tool.response_format != 'content_and_artifact':
+
+            def search(callbacks: Callbacks = None, **kwargs: Any) -> Any:
+                return self.run(self.key(tool.name, kwargs), lambda: tool.invoke(kwargs, {'callbacks': callbacks}))
+
+            async def asearch(callbacks: Callbacks = None, **kwargs: Any) -> Any:
+                return await self.arun(
+                    self.key(tool.name, kwargs), lambda: tool.ainvoke(kwargs, {'callbacks': callbacks})
+                )
+
+        else:
+
+            def is_error(pair: list) -> bool:
+                return self.is_error(pair[0])
+
+            def tool_call(kwargs: dict[str, Any]) -> dict[str, Any]:
+                # ToolCallで呼ぶと、contentだけでなくartifactも入ったToolMessageが返る
+                return {'type': 'tool_call', 'name': tool.name, 'args': kwargs, 'id': str(uuid4())}
+
+            def search(callbacks: Callbacks = None, **kwargs: Any) -> tuple[Any, Any]:
+                def call() -> list:
+                    message = tool.invoke(tool_call(kwargs), {'callbacks': callbacks})
+                    return [message.content, message.artifact]
+
+                return tuple(self.run(self.key(tool.name, kwargs), call, is_error))
+
+            async def asearch(callbacks: Callbacks = None, **kwargs: Any) -> tuple[Any, Any]:
+                async def call() -> list:
+                    message = await tool.ainvoke(tool_call(kwargs), {'callbacks': callbacks})
+                    return [message.content, message.artifact]
+
+                return tuple(await self.arun(self.key(tool.name, kwargs), call, is_error))
+
+        return StructuredTool.from_function(
+            search,
+            coroutine=asearch,
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            metadata=tool.metadata,
+            response_format=tool.response_format,
+        )
@@ -0,0 +1,439 @@
+"""
+レジストリのグラフを、多数のthread_idからの要求に同時に応えるasyncioのサーバー
+
+    async with GraphServer(max_workers=64, max_pending=1024) as server:
+        await server.serve_http('127.0.0.1', 8000)  # HTTP/1.1 (keep-alive, NDJSONのストリーミング)
+        await server.serve_stdio()                  # 標準入出力のJSON Lines
+
+    python -m src.graph.server --port 8000
+    curl -N localhost:8000/graphs/memory/threads/1/runs \
+        -d '{"input": {"messages": [{"role": "user", "content": "こんにちは"}]}, "stream": true}'
+
+- threadごとのロック: 同じ(グラフ, thread_id)の実行は到着順に1つずつ行い、checkpointが競合しないようにする
+- ワーカー数の上限: 同時に実行するグラフをmax_workersに制限する。同期のノードもmax_workers個のスレッドで動かす
+- 受け付けの制御: 実行中と待ちの合計がmax_pendingに達していたら、待たせずにOverloaded(HTTPでは429)で断る
+- ストリーミング: astreamのchunkを届いた順に返す(stream_modeは'updates'・'values'・'messages'など)
+
+同じthreadの要求はロックを取ってからワーカーを取るので、前の実行を待つ間にワーカーを占有しない。
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from collections.abc import AsyncIterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any
+
+from langgraph.pregel import Pregel
+from pydantic import BaseModel
+
+from src.graph import registry
+from src.graph.instrumentation import Histogram
+
+# graphsを渡さない場合に、レジストリから公開するグラフ
+SERVED_GRAPHS = ('memory', 'store', 'plan_and_execute')
+DEFAULT_MAX_WORKERS = 64
+DEFAULT_MAX_PENDING = 1024
+DEFAULT_RECURSION_LIMIT = 50
+NOT_AN_OBJECT = '要求はJSONのオブジェクトである必要があります'
+
+
+class Overloaded(Exception):
+    """受け付けられる要求の上限に達している"""
+
+
+class UnknownGraph(KeyError):
+    pass
+
+
+@dataclass
+class ServerStats:
+    # 受け付けてから最後のchunkを返すまでの時間
+    latency: Histogram = field(default_factory=Histogram)
+    # threadのロックとワーカーを待った時間
+    queue_wait: Histogram = field(default_factory=Histogram)
+    requests: int = 0
+    rejected: int = 0
+    errors: int = 0
+    max_pending: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'max_pending': self.max_pending,
+            'latency': self.latency.summary(),
+            'queue_wait': self.queue_wait.summary(),
+        }
+
+
+@dataclass
+class _ThreadLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+class ThreadLocks:
+    """
+    (グラフ, thread_id)ごとのasyncio.Lock。待っている要求が無くなったら捨てるので、threadが増えても溜まらない
+    """
+
+    def __init__(self):
+        self._locks: dict[tuple[str, str], _ThreadLock] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: tuple[str, str]) -> AsyncIterator[None]:
+        entry = self._locks.setdefault(key, _ThreadLock())
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[key]
+
+
+def to_jsonable(value: Any) -> Any:
+    """json.dumpsのdefault。メッセージや構造化出力(pydanticモデル)をdictにする"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    return str(value)
+
+
+def _dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, default=to_jsonable).encode('utf-8')
+
+
+class GraphServer:
+    def __init__(
+        self,
+        graphs: Mapping[str, Pregel] | None = None,
+        *,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        queue_timeout: float | None = None,
+    ):
+        """
+        graphsを省略すると、SERVED_GRAPHSをレジストリから初めて要求されたときに生成する。
+        queue_timeoutを指定すると、その秒数以内に実行を始められない要求もOverloadedにする
+        """
+        self.graphs = dict(graphs) if graphs is not None else None
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.stats = ServerStats()
+        self.locks = ThreadLocks()
+        self.pending = 0
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='graph-server')
+        self._workers = asyncio.Semaphore(max_workers)
+        self._servers: list[asyncio.Server] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._previous_executor: ThreadPoolExecutor | None = None
+
+    def names(self) -> list[str]:
+        return sorted(self.graphs) if self.graphs is not None else list(SERVED_GRAPHS)
+
+    async def graph(self, name: str) -> Pregel:
+        if self.graphs is not None:
+            if name not in self.graphs:
+                raise UnknownGraph(name)
+            return self.graphs[name]
+        if name not in SERVED_GRAPHS:
+            raise UnknownGraph(name)
+        # 初回はモジュールのimportとモデルの生成があるため、イベントループを止めない
+        return await asyncio.to_thread(registry.get_graph, name)
+
+    async def start(self) -> 'GraphServer':
+        # 同期のノードはイベントループの既定のexecutorで動くため、ワーカー数と同じ大きさのものに置き換える
+        # (close()で元に戻す。公開のAPIでは取り出せないので、ループの属性から読む)
+        self._loop = asyncio.get_running_loop()
+        self._previous_executor = getattr(self._loop, '_default_executor', None)
+        self._loop.set_default_executor(self.executor)
+        return self
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        if self._loop is not None and getattr(self._loop, '_default_executor', None) is self.executor:
+            # 止めたexecutorを残すと、このループでのasyncio.to_threadなどが全て失敗する。
+            # 元が無ければNoneに戻し、次に使うときにループが新しく作る
+            self._loop._default_executor = self._previous_executor
+        self._loop = None
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> 'GraphServer':
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def summary(self) -> dict[str, Any]:
+        return {**self.stats.summary(), 'pending': self.pending, 'threads': len(self.locks)}
+
+    @asynccontextmanager
+    async def _slot(self, name: str, thread_id: str | None) -> AsyncIterator[None]:
+        """threadのロック、ワーカーの順に取る。thread_idが無ければロックは取らない"""
+        async with self._thread_lock(name, thread_id):
+            if self.queue_timeout is None:
+                await self._workers.acquire()
+            else:
+                try:
+                    await asyncio.wait_for(self._workers.acquire(), self.queue_timeout)
+                except TimeoutError:
+                    raise Overloaded(f'{self.queue_timeout}秒以内にワーカーが空きませんでした') from None
+            try:
+                yield
+            finally:
+                self._workers.release()
+
+    def _thread_lock(self, name: str, thread_id: str | None):
+        if thread_id is None:
+            return _noop()
+        return self.locks.hold((name, thread_id))
+
+    async def stream(
+        self,
+        name: str,
+        inputs: Any,
+        *,
+        thread_id: str | None = None,
+        configurable: dict | None = None,
+        stream_mode: str | list[str] = 'updates',
+        recursion_limit: int = DEFAULT_RECURSION_LIMIT,
+    ) -> AsyncIterator[Any]:
+        """
+        グラフのastreamのchunkを順に返す。混んでいれば最初のchunkの前にOverloadedを送出する
+        """
+        self.stats.requests += 1
+        if self.pending >= self.max_pending:
+            self.stats.rejected += 1
+            raise Overloaded(f'実行中と待ちの要求が上限({self.max_pending})に達しています')
+        self.pending += 1
+        self.stats.max_pending = max(self.stats.max_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            graph = await self.graph(name)
+            config = {
+                'configurable': {**(configurable or {}), 'thread_id': thread_id or uuid.uuid4().hex},
+                'recursion_limit': recursion_limit,
+            }
+            async with self._slot(name, thread_id):
+                self.stats.queue_wait.observe(time.perf_counter() - start)
+                async for chunk in graph.astream(inputs, config, stream_mode=stream_mode):
+                    yield chunk
+        except Overloaded:
+            self.stats.rejected += 1
+            raise
+        except (Exception, asyncio.CancelledError):
+            self.stats.errors += 1
+            raise
+        else:
+            self.stats.latency.observe(time.perf_counter() - start)
+        finally:
+            self.pending -= 1
+
+    async def invoke(self, name: str, inputs: Any, **kwargs: Any) -> Any:
+        """最後の状態を返す"""
+        last = None
+        async for values in self.stream(name, inputs, stream_mode='values', **kwargs):
+            last = values
+        return last
+
+    def _run_request(self, request: dict) -> AsyncIterator[Any]:
+        kwargs = {
+            'thread_id': request.get('thread_id'),
+            'configurable': request.get('configurable'),
+            'stream_mode': request.get('stream_mode', 'updates'),
+        }
+        if 'recursion_limit' in request:
+            kwargs['recursion_limit'] = request['recursion_limit']
+        return self.stream(request['graph'], request.get('input'), **kwargs)
+
+    # HTTP
+
+    async def serve_http(self, host: str = '127.0.0.1', port: int = 0) -> asyncio.Server:
+        """
+        GET  /graphs                                   公開しているグラフの名前
+        GET  /stats                                    summary()
+        POST /graphs/{name}/threads/{thread_id}/runs   {"input", "configurable", "stream", "stream_mode"}
+        POST /graphs/{name}/runs                       threadを持たない実行
+
+        streamがtrueならchunkを1行ずつのJSON(application/x-ndjson)でchunked転送し、
+        falseなら最後の状態を{"output": ...}で返す
+        """
+        server = await asyncio.start_server(self._handle_http, host, port)
+        self._servers.append(server)
+        return server
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                method, path, _ = lines[0].split(' ', 2)
+                headers = {k.strip().lower(): v.strip() for k, v in (line.split(':', 1) for line in lines[1:] if line)}
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                await self._respond_http(writer, method, path.split('?', 1)[0], body)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond_http(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes) -> None:
+        parts = path.strip('/').split('/')
+        if method == 'GET' and parts == ['graphs']:
+            return await _write_json(writer, '200 OK', {'graphs': self.names()})
+        if method == 'GET' and parts == ['stats']:
+            return await _write_json(writer, '200 OK', self.summary())
+        if method != 'POST' or parts[0] != 'graphs' or parts[-1] != 'runs' or len(parts) not in (3, 5):
+            return await _write_json(writer, '404 Not Found', {'error': f'{method} {path} is not supported'})
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError as e:
+            return await _write_json(writer, '400 Bad Request', {'error': str(e)})
+        if not isinstance(request, dict):
+            return await _write_json(writer, '400 Bad Request', {'error': NOT_AN_OBJECT})
+        request['graph'] = parts[1]
+        if len(parts) == 5:
+            request['thread_id'] = parts[3]
+
+        streaming = request.get('stream', False)
+        if not streaming:
+            request['stream_mode'] = 'values'
+        chunks = self._run_request(request)
+        # 最初のchunkまでに起きたエラーはステータスコードで返す
+        try:
+            first = await anext(chunks, None)
+        except Overloaded as e:
+            return await _write_json(writer, '429 Too Many Requests', {'error': str(e)})
+        except UnknownGraph as e:
+            return await _write_json(writer, '404 Not Found', {'error': f'未登録のグラフです: {e.args[0]}'})
+        except Exception as e:
+            return await _write_json(writer, '500 Internal Server Error', {'error': repr(e)})
+
+        if not streaming:
+            output = first
+            try:
+                async for values in chunks:
+                    output = values
+            except Exception as e:
+                return await _write_json(writer, '500 Internal Server Error', {'error': repr(e)})
+            return await _write_json(writer, '200 OK', {'output': output})
+
+        writer.write(b'HTTP/1.1 200 OK\r\ncontent-type: application/x-ndjson\r\ntransfer-encoding: chunked\r\n\r\n')
+        try:
+            if first is not None:
+                await _write_chunk(writer, _dumps(first) + b'\n')
+            async for chunk in chunks:
+                await _write_chunk(writer, _dumps(chunk) + b'\n')
+        except ConnectionError:
+            # クライアントが切断したら、実行中のグラフも止める
+            await chunks.aclose()
+            raise
+        except Exception as e:
+            await _write_chunk(writer, _dumps({'error': repr(e)}) + b'\n')
+        await _write_chunk(writer, b'')
+
+    # stdio
+
+    async def serve_stdio(self) -> None:
+        """
+        標準入力の1行に1つの要求({"id", "graph", "thread_id", "input", "configurable", "stream_mode"})を読み、
+        標準出力に{"id", "chunk"}を1行ずつ、最後に{"id", "done": true}か{"id", "error", "status"}を書く。
+        要求は並行に実行するので、出力は要求ごとのidで見分ける
+        """
+        tasks = set()
+        while line := await asyncio.to_thread(sys.stdin.readline):
+            if not line.strip():
+                continue
+            task = asyncio.create_task(self._handle_stdio(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _handle_stdio(self, line: str) -> None:
+        def emit(message: dict) -> None:
+            sys.stdout.buffer.write(_dumps(message) + b'\n')
+            sys.stdout.flush()
+
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            return emit({'id': None, 'error': str(e), 'status': 400})
+        if not isinstance(request, dict):
+            return emit({'id': None, 'error': NOT_AN_OBJECT, 'status': 400})
+        request_id = request.get('id')
+        try:
+            async for chunk in self._run_request(request):
+                emit({'id': request_id, 'chunk': chunk})
+        except Overloaded as e:
+            return emit({'id': request_id, 'error': str(e), 'status': 429})
+        except UnknownGraph as e:
+            return emit({'id': request_id, 'error': f'未登録のグラフです: {e.args[0]}', 'status': 404})
+        except Exception as e:
+            return emit({'id': request_id, 'error': repr(e), 'status': 500})
+        emit({'id': request_id, 'done': True})
+
+
+@asynccontextmanager
+async def _noop() -> AsyncIterator[None]:
+    yield
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: str, payload: Any) -> None:
+    data = _dumps(payload)
+    writer.write(
+        f'HTTP/1.1 {status}\r\ncontent-type: application/json\r\ncontent-length: {len(data)}\r\n\r\n'.encode() + data
+    )
+    await writer.drain()
+
+
+async def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+    writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+    await writer.drain()
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    async with GraphServer(max_workers=args.max_workers, max_pending=args.max_pending) as server:
+        if args.stdio:
+            await server.serve_stdio()
+            return
+        http = await server.serve_http(args.host, args.port)
+        print(f'serving {", ".join(server.names())} on http://{args.host}:{http.sockets[0].getsockname()[1]}')
+        await http.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--stdio', action='store_true', help='HTTPの代わりに標準入出力のJSON Linesで受け付ける')
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
 from typing_extensions import TypedDict
 
 
@@ -24,7 +25,7 @@ def node3(state: GraphState):
     return {'question': 'bye'}
 
 
-def invoke_graph():
+def build_graph() -> CompiledStateGraph:
     builder = StateGraph(GraphState)
     builder.add_node(node1)
     builder.add_node(node2)
@@ -33,6 +34,9 @@ def invoke_graph():
     builder.add_edge('node1', 'node2')
     builder.add_edge('node2', 'node3')
     builder.add_edge('node3', END)
-    graph = builder.compile()
+    return builder.compile()
+
 
+def invoke_graph():
+    graph = build_graph()
     graph.invoke({'question': 'hello'})
@@ -1,29 +1,40 @@
 import uuid
+from functools import partial
 
+from langchain_core.language_models import BaseChatModel
 from langchain_openai import ChatOpenAI
 from langgraph.graph import START, MessagesState, StateGraph
 from langgraph.graph.graph import RunnableConfig
+from langgraph.graph.state import CompiledStateGraph
 from langgraph.store.memory import BaseStore, InMemoryStore
+from langgraph.utils.config import merge_configs
+
+from src.graph.write_behind_store import WriteBehindStore
 
 """
 Postgresのチュートリアル
 """
 
 
-model = ChatOpenAI(model_name='gpt-4o-mini', temperature=0)
-
-
 # NOTE: we're passing the Store param to the node --
 # this is the Store we compile the graph with
-def call_model(state: MessagesState, config: RunnableConfig, *, store: BaseStore):
+def call_model(state: MessagesState, config: RunnableConfig, *, store: BaseStore, model: BaseChatModel):
     user_id = config['configurable']['user_id']
     namespace = ('memories', user_id)
-    memories = store.search(namespace)
+    last_message = state['messages'][-1]
+    # 索引付きのstore(search_top_kを持つもの)では、最後のメッセージに関係する上位k件の記憶だけをプロンプトに入れる。
+    # WriteBehindStoreなどのラッパーも、包んだstoreが索引付きならsearch_top_kを持つ
+    memory_top_k = config['configurable'].get('memory_top_k')
+    search_top_k = getattr(store, 'search_top_k', None)
+    if memory_top_k is not None and search_top_k is not None:
+        memories = search_top_k(namespace, last_message.content, k=memory_top_k)
+    else:
+        memories = store.search(namespace)
     info = '\n'.join([d.value['data'] for d in memories])
     system_msg = f'You are a helpful assistant talking to the user. User info: {info}'
 
     # Store new memories if the user asks the model to remember
-    last_message = state['messages'][-1]
+    # (WriteBehindStoreならバッファに入れてすぐに返り、storeへの書き込みは実行の後にまとめて行う)
     if 'remember' in last_message.content.lower():
         memory = 'User name is Bob'
         store.put(namespace, str(uuid.uuid4()), {'data': memory})
@@ -32,16 +43,30 @@ def call_model(state: MessagesState, config: RunnableConfig, *, store: BaseStore
     return {'messages': response}
 
 
-builder = StateGraph(MessagesState)
-builder.add_node('call_model', call_model)
-builder.add_edge(START, 'call_model')
-in_memory_store = InMemoryStore()
+def build_graph(model: BaseChatModel | None = None, store: BaseStore | None = None) -> CompiledStateGraph:
+    if model is None:
+        model = ChatOpenAI(model_name='gpt-4o-mini', temperature=0)
+    if store is None:
+        store = InMemoryStore()
+
+    builder = StateGraph(MessagesState)
+    builder.add_node('call_model', partial(call_model, model=model))
+    builder.add_edge(START, 'call_model')
 
-# NOTE: we're passing the store object here when compiling the graph
-graph = builder.compile(store=in_memory_store)
+    # NOTE: we're passing the store object here when compiling the graph
+    graph = builder.compile(store=store)
+    # 書き込みを後回しにするstoreは、実行が終わったらすぐにflushさせる。
+    # コールバックはconfigに入れたコピーで付ける(RunnableBindingで包まないので、get_stateなどもそのまま使える)
+    if isinstance(store, WriteBehindStore):
+        config = merge_configs(graph.config, {'callbacks': [store.flush_on_run_end()]})
+        graph = graph.copy(update={'config': config})
+    return graph
 
 
 if __name__ == '__main__':
+    in_memory_store = InMemoryStore()
+    graph = build_graph(store=in_memory_store)
+
     config = {'configurable': {'thread_id': '3', 'user_id': '1'}}
     input_message = {'type': 'user', 'content': 'Hi! Remember: my name is Bob'}
     for chunk in graph.stream({'messages': [input_message]}, config, stream_mode='values'):
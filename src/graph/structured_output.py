@@ -1,8 +1,12 @@
 from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from src.graph.partial_json import stream_structured_items
+
 load_dotenv()
 
 
@@ -29,8 +33,23 @@ prompt = ChatPromptTemplate.from_messages(
         ('placeholder', '{messages}'),
     ]
 )
-chain = prompt | ChatOpenAI(model='gpt-4o', temperature=0).with_structured_output(OutputModel)
+
+
+def build_chain(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI(model='gpt-4o', temperature=0)
+    return prompt | llm.with_structured_output(OutputModel)
+
+
+def build_stream_chain(llm: BaseChatModel | None = None) -> Runnable:
+    """
+    build_chainのストリーミング版。OutputModelのJSONが閉じた時点で返す
+    """
+    if llm is None:
+        llm = ChatOpenAI(model='gpt-4o', temperature=0)
+    return prompt | stream_structured_items(llm, OutputModel, ())
 
 
 if __name__ == '__main__':
+    chain = build_chain()
     print(chain.invoke({'messages': ['かぼちゃの構成要素を教えて？']}))
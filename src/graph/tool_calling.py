@@ -5,16 +5,22 @@ from langchain_core.callbacks import (
     AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
+from langchain_core.language_models import BaseChatModel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
 from langchain_core.tools import BaseTool, tool
 from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.prebuilt import ToolNode, create_react_agent
 from pydantic import BaseModel, Field
 
+from src.graph.tool_executor import LOCAL_METADATA_KEY, ParallelToolNode, local_tool
+
 load_dotenv()
 
 
+@local_tool
 @tool
 def add(
     a: Annotated[int, '一つ目の値'],
@@ -34,6 +40,7 @@ class CustomCalculatorTool(BaseTool):
     description: str = 'useful for when you need to answer questions about math'
     args_schema: type[BaseModel] = CalculatorInput
     return_direct: bool = True
+    metadata: dict | None = {LOCAL_METADATA_KEY: True}
 
     def _run(self, a: int, b: int, run_manager: CallbackManagerForToolRun | None = None) -> str:
         """Use the tool."""
@@ -51,24 +58,7 @@ class CustomCalculatorTool(BaseTool):
         # If the sync calculation is expensive, you should delete the entire _arun method.
         # LangChain will automatically provide a better implementation that will
         # kick off the task in a thread to make sure it doesn't block other async code.
-        return self._run(a, b, run_manager=run_manager.get_sync())
-
-
-load_dotenv()
-
-
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            'system',
-            """
-            指示された内容をサポートしてください
-
-            """,
-        ),
-        ('placeholder', '{messages}'),
-    ]
-)
+        return self._run(a, b, run_manager=run_manager.get_sync() if run_manager else None)
 
 
 class AddInput(BaseModel):
@@ -81,6 +71,7 @@ class AddTool(BaseTool):
     description: str = '2つの値を足し算して返す'
     args_schema: type[BaseModel] = AddInput
     return_direct: bool = True
+    metadata: dict | None = {LOCAL_METADATA_KEY: True}
 
     def _run(self, a: int, b: int, run_manager: CallbackManagerForToolRun | None = None) -> str:
         """2つの値を足し算して返す"""
@@ -93,17 +84,19 @@ class AddTool(BaseTool):
         run_manager: AsyncCallbackManagerForToolRun | None = None,
     ) -> str:
         """2つの値を足し算して返す。"""
-        return self._run(a, b, run_manager=run_manager.get_sync())
+        return self._run(a, b, run_manager=run_manager.get_sync() if run_manager else None)
 
 
-prompt = ChatPromptTemplate.from_messages(
+class Add(BaseModel):
+    """2つの値を足し算して返す"""
+
+    a: int = Field(..., description='一つ目の値')
+    b: int = Field(..., description='二つ目の値')
+
+
+tool_prompt = ChatPromptTemplate.from_messages(
     [('system', '渡された内容をもとに計算してください'), ('placeholder', '{messages}')]
 )
-tool_chain = prompt | ChatOpenAI() | StrOutputParser()
-agent = create_react_agent(
-    ChatOpenAI(model='gpt-4o'),
-    tools=[tool_chain.as_tool(name='math_tool', description='計算を行うツール')],
-)
 
 base_prompt = ChatPromptTemplate.from_messages(
     [
@@ -114,9 +107,8 @@ base_prompt = ChatPromptTemplate.from_messages(
         ('placeholder', '{messages}'),
     ]
 )
-chain = base_prompt | ChatOpenAI().bind_tools([tool_chain.as_tool(name='math_tool', description='計算を行うツール')])
-
 
+# # プロンプトの定義
 prompt = ChatPromptTemplate.from_messages(
     [
         (
@@ -128,56 +120,48 @@ prompt = ChatPromptTemplate.from_messages(
 )
 
 
-class Add(BaseModel):
-    """2つの値を足し算して返す"""
+def build_tool_chain(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI()
+    return tool_prompt | llm | StrOutputParser()
 
-    a: int = Field(..., description='一つ目の値')
-    b: int = Field(..., description='二つ目の値')
 
+def build_math_chain(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI()
+    return base_prompt | llm.bind_tools([build_tool_chain().as_tool(name='math_tool', description='計算を行うツール')])
 
-chain = prompt | ChatOpenAI().bind_tools([Add])
 
-# as_tool = chain.as_tool(name='スタイルレスポンダー', description='ツール使用時の説明')
+def build_add_chain(llm: BaseChatModel | None = None) -> Runnable:
+    if llm is None:
+        llm = ChatOpenAI()
+    # as_tool = chain.as_tool(name='スタイルレスポンダー', description='ツール使用時の説明')
+    return prompt | llm.bind_tools([Add])
 
-# from langchain_core.prompts import ChatPromptTemplate
-# from langchain_openai import ChatOpenAI
-# from langgraph.prebuilt import create_react_agent
 
-# # プロンプトの定義
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            'system',
-            '与えられたinputに従って計算処理を呼び出してください',
-        ),
-        ('placeholder', '{messages}'),
-    ]
-)
+def build_add_tool(llm: BaseChatModel | None = None) -> BaseTool:
+    # as_toolでchainをtoolに変換する(足し算のたびにLLMを呼ぶ)
+    return build_tool_chain(llm).as_tool(name='add_tool', description='2つの値を足し算して返す')
 
-# agentを作成
-# agent = create_react_agent(model=ChatOpenAI(model='gpt-3.5-turbo'), tools=[Add], state_modifier=prompt)
 
-result = agent.invoke({'messages': ['3 + 4の計算結果は？']})
-print(result['messages'][-1].content)
+def build_agent(
+    model: BaseChatModel | None = None,
+    tools: list[BaseTool] | None = None,
+    tool_node: type[ToolNode] = ParallelToolNode,
+) -> CompiledStateGraph:
+    if model is None:
+        model = ChatOpenAI(model='gpt-4o')
+    if tools is None:
+        # 足し算はLLMを呼ばずにローカルで計算する
+        tools = [add]
 
-prompt = ChatPromptTemplate.from_messages(
-    [('system', '渡された内容をもとに計算してください'), ('placeholder', '{messages}')]
-)
-tool_chain = prompt | ChatOpenAI() | StrOutputParser()
-
-# as_toolでchainをtoolに変換する
-tool = tool_chain.as_tool(name='add_tool', description='2つの値を足し算して返す')
-
-# エージェントにツールとして渡す
-agent = create_react_agent(
-    ChatOpenAI(model='gpt-4o'),
-    tools=[tool],
-)
+    # エージェントにツールとして渡す
+    # agent = create_react_agent(model=ChatOpenAI(model='gpt-3.5-turbo'), tools=[Add], state_modifier=prompt)
+    return create_react_agent(model, tools=tool_node(tools))
 
-# result = agent.invoke({'messages': ['3 + 4の計算結果は？']})
-# print(result['messages'][-1].content)
 
 if __name__ == '__main__':
+    agent = build_agent()
     result = agent.invoke({'messages': ['3 + 4の計算結果は？']})
     print(result['messages'][-1].content)
     # print(add.invoke(result.tool_calls[0]['args']))
@@ -0,0 +1,193 @@
+"""
+react agentのツール呼び出しを並列に、時間制限付きで実行するToolNode
+
+    tool_node = ParallelToolNode([add, search], timeouts={'search': 10.0})
+    agent = create_react_agent(model, tools=tool_node)
+    agent.invoke({'messages': [...]})
+    print(tool_node.summary())
+
+1つのAIメッセージに含まれる複数のツール呼び出しを同時に実行する。
+- ローカルツール(local_toolで印を付けたもの)は、スレッドやタスクを作らずその場で実行する
+- 非同期の実装を持つツールはイベントループ上で、同期だけのツールは上限付きのスレッドプールで実行する
+- ローカル以外のツールはtimeout秒で打ち切り、エラーのToolMessageを返す(エージェントはそのまま続けられる)
+ツールごとの実行時間・エラー数・タイムアウト数を集計する。
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+from langchain_core.messages import ToolCall, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import ContextThreadPoolExecutor, get_config_list, run_in_executor
+from langchain_core.tools import BaseTool, StructuredTool
+from langgraph.prebuilt import ToolNode
+from langgraph.store.base import BaseStore
+
+from src.graph.instrumentation import Histogram
+
+# ローカル以外のツールの既定の制限時間(秒)
+DEFAULT_TOOL_TIMEOUT = 30.0
+# 同期だけのツールを動かすスレッドの数の上限
+DEFAULT_MAX_WORKERS = 8
+
+LOCAL_METADATA_KEY = 'local'
+
+
+def local_tool(tool: BaseTool) -> BaseTool:
+    """
+    決定的ですぐに終わるツールに印を付ける。ParallelToolNodeはその場で実行する
+
+        @local_tool
+        @tool
+        def add(a: int, b: int) -> int: ...
+    """
+    tool.metadata = {**(tool.metadata or {}), LOCAL_METADATA_KEY: True}
+    return tool
+
+
+def is_local(tool: BaseTool) -> bool:
+    return bool(tool.metadata and tool.metadata.get(LOCAL_METADATA_KEY))
+
+
+def has_async_impl(tool: BaseTool) -> bool:
+    # @toolで同期関数から作ったツールや_arunを実装していないツールは、ainvokeでも既定のスレッドプールで動く
+    if isinstance(tool, StructuredTool):
+        return tool.coroutine is not None
+    return type(tool)._arun is not BaseTool._arun
+
+
+@dataclass
+class ToolStats:
+    latency: Histogram = field(default_factory=Histogram)
+    errors: int = 0
+    timeouts: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        return {'seconds': self.latency.summary(), 'errors': self.errors, 'timeouts': self.timeouts}
+
+
+class ParallelToolNode(ToolNode):
+    """
+    ToolNodeと同じ入出力で、ツール呼び出しを並列・時間制限付きで実行する
+
+    timeoutはローカル以外のツールの制限時間(秒、Noneなら無制限)で、timeoutsでツールごとに上書きできる。
+    同期の呼び出し(invoke)では、スレッドプールに投入してからの時間で打ち切る。
+    打ち切ったツールのスレッドは止められないため、終わるまでプールのスレッドを1つ使い続ける。
+    スレッドプールはclose()か、ノード(を持つグラフ)がガベージコレクトされたときに止める。
+    """
+
+    def __init__(
+        self,
+        tools: Iterable[Any],
+        *,
+        timeout: float | None = DEFAULT_TOOL_TIMEOUT,
+        timeouts: dict[str, float | None] | None = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        **kwargs: Any,
+    ):
+        super().__init__(list(tools), **kwargs)
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.executor = ContextThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tool')
+        # build_agentなどで何度も作られるため、捨てられたノードのスレッドが残らないようにする
+        self._finalizer = weakref.finalize(self, self.executor.shutdown, wait=False)
+        self.stats: dict[str, ToolStats] = {}
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        """スレッドプールを止める。実行中のツールは待たない"""
+        self._finalizer()
+
+    def timeout_for(self, name: str) -> float | None:
+        return self.timeouts.get(name, self.timeout)
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        with self.lock:
+            return {name: stats.summary() for name, stats in self.stats.items()}
+
+    def _is_inline(self, call: ToolCall) -> bool:
+        tool = self.tools_by_name.get(call['name'])
+        # 存在しないツールはToolNodeと同じエラーのToolMessageを返すだけなので、その場で処理する
+        return tool is None or is_local(tool)
+
+    def _stats(self, name: str) -> ToolStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = ToolStats()
+        return stats
+
+    def _record(self, name: str, seconds: float, message: ToolMessage) -> None:
+        with self.lock:
+            stats = self._stats(name)
+            stats.latency.observe(seconds)
+            if message.status == 'error' or str(message.content).startswith('Error: '):
+                stats.errors += 1
+
+    def _timeout_message(self, call: ToolCall, timeout: float) -> ToolMessage:
+        # 実行時間は終わったツールだけ記録する(打ち切ったスレッドが後で終われば、その時に記録される)
+        with self.lock:
+            self._stats(call['name']).timeouts += 1
+        return ToolMessage(
+            f'Error: {call["name"]} timed out after {timeout}s',
+            name=call['name'],
+            tool_call_id=call['id'],
+            status='error',
+        )
+
+    def _run_timed(self, call: ToolCall, config: RunnableConfig) -> ToolMessage:
+        start = time.perf_counter()
+        message = self._run_one(call, config)
+        self._record(call['name'], time.perf_counter() - start, message)
+        return message
+
+    async def _arun_timed(self, call: ToolCall, config: RunnableConfig) -> ToolMessage:
+        start = time.perf_counter()
+        message = await self._arun_one(call, config)
+        self._record(call['name'], time.perf_counter() - start, message)
+        return message
+
+    def _func(self, input: Any, config: RunnableConfig, *, store: BaseStore) -> Any:
+        tool_calls, output_type = self._parse_input(input, store)
+        config_list = get_config_list(config, len(tool_calls))
+        # 先にローカル以外のツールをスレッドプールに投入し、待っている間にローカルツールを実行する
+        submitted = {
+            i: (self.executor.submit(self._run_timed, call, call_config), time.perf_counter())
+            for i, (call, call_config) in enumerate(zip(tool_calls, config_list, strict=True))
+            if not self._is_inline(call)
+        }
+        outputs: list[ToolMessage | None] = [
+            None if i in submitted else self._run_timed(call, call_config)
+            for i, (call, call_config) in enumerate(zip(tool_calls, config_list, strict=True))
+        ]
+        for i, (future, start) in submitted.items():
+            call = tool_calls[i]
+            timeout = self.timeout_for(call['name'])
+            remaining = None if timeout is None else max(start + timeout - time.perf_counter(), 0)
+            try:
+                outputs[i] = future.result(remaining)
+            except TimeoutError:
+                outputs[i] = self._timeout_message(call, timeout)
+        return outputs if output_type == 'list' else {'messages': outputs}
+
+    async def _afunc(self, input: Any, config: RunnableConfig, *, store: BaseStore) -> Any:
+        tool_calls, output_type = self._parse_input(input, store)
+        outputs = await asyncio.gather(*(self._arun_call(call, config) for call in tool_calls))
+        return outputs if output_type == 'list' else {'messages': outputs}
+
+    async def _arun_call(self, call: ToolCall, config: RunnableConfig) -> ToolMessage:
+        if self._is_inline(call):
+            return self._run_timed(call, config)
+        if has_async_impl(self.tools_by_name[call['name']]):
+            run = self._arun_timed(call, config)
+        else:
+            run = run_in_executor(self.executor, self._run_timed, call, config)
+        timeout = self.timeout_for(call['name'])
+        try:
+            return await asyncio.wait_for(run, timeout)
+        except TimeoutError:
+            return self._timeout_message(call, timeout)
@@ -0,0 +1,270 @@
+"""
+store.putをすぐに返し、書き込みを後からまとめて実行するBaseStoreのラッパー
+
+putはバッファ(namespaceとkeyごとに最後の値だけ)に入れて返る。get/searchはバッファを重ねて返すため、
+同じ実行の中では書いた記憶がすぐに読める。バッファはflush_interval秒ごと・max_pending件貯まったとき・
+グラフの実行が終わったとき(flush_on_run_endのコールバック)に、1回のbatchで書き込む。
+close()(withブロックの終わり、プロセスの終了時のatexitでも呼ぶ)は残りを書き込んでから返る。
+
+    store = WriteBehindStore(PostgresStore(conn))
+    graph = build_graph(store=store)  # 実行の終わりにflushする
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.store.base import BaseStore, GetOp, Item, ListNamespacesOp, Op, PutOp, Result, SearchOp
+
+from src.graph.instrumentation import Histogram
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+_Key = tuple[tuple[str, ...], str]
+
+
+@dataclass
+class WriteBehindStats:
+    flush_seconds: Histogram = field(default_factory=lambda: Histogram(FLUSH_BUCKETS))
+    puts: int = 0
+    # flushする前に同じkeyに書き直されて、書き込まずに済んだput
+    coalesced: int = 0
+    flushes: int = 0
+    flushed_ops: int = 0
+    errors: int = 0
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            'puts': self.puts,
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'flushed_ops': self.flushed_ops,
+            'ops_per_flush': self.flushed_ops / self.flushes if self.flushes else 0.0,
+            'errors': self.errors,
+            'flush_seconds': self.flush_seconds.summary(),
+        }
+
+
+class _FlushOnRunEnd(BaseCallbackHandler):
+    """グラフ(一番外側のrun)が終わったらflushを頼む。待たないので実行の応答は遅くならない"""
+
+    run_inline = True
+    ignore_llm = True
+    ignore_retriever = True
+    ignore_agent = True
+
+    def __init__(self, store: 'WriteBehindStore'):
+        self.store = store
+
+    def on_chain_end(self, outputs, *, run_id: UUID, parent_run_id: UUID | None = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self.store.request_flush()
+
+    def on_chain_error(self, error, *, run_id: UUID, parent_run_id: UUID | None = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self.store.request_flush()
+
+
+def _matches(value: dict[str, Any], filter: dict[str, Any] | None) -> bool:
+    return not filter or value.items() >= filter.items()
+
+
+class WriteBehindStore(BaseStore):
+    """
+    Args:
+        flush_interval: バックグラウンドでflushする間隔(秒)
+        max_pending: この件数のputが貯まったら間隔を待たずにflushする
+    """
+
+    def __init__(self, store: BaseStore, *, flush_interval: float = 0.05, max_pending: int = 256):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = WriteBehindStats()
+        # (namespace, key) -> (PutOp, putした時刻)。削除はvalueがNoneのPutOp
+        self._pending: dict[_Key, tuple[PutOp, datetime]] = {}
+        # flush中でまだstoreに書き終わっていない分。書き終わるまでは読み出しに使う
+        self._inflight: dict[_Key, tuple[PutOp, datetime]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='write-behind-store', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        # 包んだstoreが索引付き(IndexedMemoryStore)なら、同じ名前で上位k件の検索を使えるようにする
+        if hasattr(store, 'search_top_k'):
+            self.search_top_k = self._search_top_k
+            self.asearch_top_k = self._asearch_top_k
+
+    def __enter__(self) -> 'WriteBehindStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._inflight)
+
+    def flush_on_run_end(self) -> BaseCallbackHandler:
+        """
+        グラフのconfigのcallbacksに入れると、実行が終わるたびにflushする(build_graphでの付け方)
+
+            config = merge_configs(graph.config, {'callbacks': [store.flush_on_run_end()]})
+            graph = graph.copy(update={'config': config})
+        """
+        return _FlushOnRunEnd(self)
+
+    def request_flush(self) -> None:
+        """バックグラウンドのスレッドにflushを頼み、待たずに返る"""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 書けなかった分はバッファに戻っているので、次の間隔で書き直す
+                logger.exception('write-behind flush failed')
+
+    def flush(self) -> int:
+        """バッファのputを1回のbatchで書き込み、書き込んだ件数を返す"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._inflight, self._pending = self._pending, {}
+                ops = [op for op, _ in self._inflight.values()]
+            start = time.perf_counter()
+            try:
+                self.store.batch(ops)
+            except Exception:
+                with self._lock:
+                    # flush中に新しく書かれたkeyはそちらを残す
+                    self._pending = {**self._inflight, **self._pending}
+                    self._inflight = {}
+                    self.stats.errors += 1
+                raise
+            with self._lock:
+                self._inflight = {}
+                self.stats.flushes += 1
+                self.stats.flushed_ops += len(ops)
+                self.stats.flush_seconds.observe(time.perf_counter() - start)
+            return len(ops)
+
+    async def aflush(self) -> int:
+        return await asyncio.to_thread(self.flush)
+
+    def close(self) -> None:
+        """バックグラウンドのスレッドを止め、残りを書き込む。何度呼んでもよい"""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+
+    def _unflushed(self, namespace: tuple[str, ...]) -> bool:
+        with self._lock:
+            return any(ns == namespace for ns, _ in (*self._pending, *self._inflight))
+
+    def _search_top_k(self, namespace: tuple[str, ...], query: str, k: int = 5) -> list[Item]:
+        # 索引は書き込んだ後に更新されるので、そのnamespaceにまだ書いていない記憶があれば先に書き込む
+        if self._unflushed(namespace):
+            self.flush()
+        return self.store.search_top_k(namespace, query, k)
+
+    async def _asearch_top_k(self, namespace: tuple[str, ...], query: str, k: int = 5) -> list[Item]:
+        if self._unflushed(namespace):
+            await self.aflush()
+        return await self.store.asearch_top_k(namespace, query, k)
+
+    def _buffered(self, namespace: tuple[str, ...], key: str) -> tuple[PutOp, datetime] | None:
+        return self._pending.get((namespace, key)) or self._inflight.get((namespace, key))
+
+    def _split(self, ops: list[Op]) -> tuple[list[Result], list[int], bool, dict[_Key, tuple[PutOp, datetime]]]:
+        """putをバッファに入れ、バッファだけで答えられないopの位置と、searchに重ねるバッファの写しを返す"""
+        results: list[Result] = [None] * len(ops)
+        forward: list[int] = []
+        list_namespaces = False
+        now = datetime.now(UTC)
+        with self._lock:
+            for i, op in enumerate(ops):
+                if isinstance(op, PutOp):
+                    key = (op.namespace, op.key)
+                    self.stats.puts += 1
+                    if key in self._pending:
+                        self.stats.coalesced += 1
+                    self._pending[key] = (op, now)
+                elif isinstance(op, GetOp) and (entry := self._buffered(op.namespace, op.key)) is not None:
+                    results[i] = self._item(*entry)
+                else:
+                    list_namespaces = list_namespaces or isinstance(op, ListNamespacesOp)
+                    forward.append(i)
+            full = len(self._pending) >= self.max_pending
+            # storeを読む前に写しておく。読んでいる間にflushが終わっても、書いた記憶が抜けない
+            buffered = {**self._inflight, **self._pending} if forward else {}
+        if full:
+            self.request_flush()
+        return results, forward, list_namespaces, buffered
+
+    @staticmethod
+    def _item(op: PutOp, at: datetime) -> Item | None:
+        if op.value is None:
+            return None
+        return Item(value=op.value, key=op.key, namespace=op.namespace, created_at=at, updated_at=at)
+
+    @staticmethod
+    def _widen(op: Op, buffered: dict) -> Op:
+        """searchはバッファで消える・置き換わる分を見込んで、offsetの前から多めに取る"""
+        if not isinstance(op, SearchOp):
+            return op
+        return SearchOp(op.namespace_prefix, op.filter, op.limit + op.offset + len(buffered), 0)
+
+    def _merge(self, op: Op, result: Result, buffered: dict[_Key, tuple[PutOp, datetime]]) -> Result:
+        if not isinstance(op, SearchOp):
+            return result
+        prefix = op.namespace_prefix
+        touched = {key: entry for key, entry in buffered.items() if key[0][: len(prefix)] == prefix}
+        items = [item for item in result if (item.namespace, item.key) not in touched]
+        for put, at in touched.values():
+            if put.value is not None and _matches(put.value, op.filter):
+                items.append(self._item(put, at))
+        return items[op.offset : op.offset + op.limit]
+
+    def batch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        results, forward, list_namespaces, buffered = self._split(ops)
+        if list_namespaces:
+            # namespaceの一覧はバッファと重ねられないので、先に書き込む
+            self.flush()
+        if forward:
+            widened = [self._widen(ops[i], buffered) for i in forward]
+            for i, result in zip(forward, self.store.batch(widened), strict=True):
+                results[i] = self._merge(ops[i], result, buffered)
+        return results
+
+    async def abatch(self, ops: Iterable[Op]) -> list[Result]:
+        ops = list(ops)
+        results, forward, list_namespaces, buffered = self._split(ops)
+        if list_namespaces:
+            await self.aflush()
+        if forward:
+            widened = [self._widen(ops[i], buffered) for i in forward]
+            for i, result in zip(forward, await self.store.abatch(widened), strict=True):
+                results[i] = self._merge(ops[i], result, buffered)
+        return results
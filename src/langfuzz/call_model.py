@@ -1,23 +1,52 @@
 import random
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-client = OpenAI()
+MODEL = 'gpt-4o-mini'
 
+_client: OpenAI | None = None
 
-def call_model(question: str) -> str:
+
+def get_client() -> OpenAI:
+    # import時にOPENAI_API_KEYを要求しないよう、最初の呼び出しで作る
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
+
+
+def choose_system_message(rng: random.Random | None = None) -> str:
     # This is to add some randomness in and get bad answers.
-    if random.uniform(0, 1) > 0.5:
-        system_message = 'さるは、とは爬虫類の大型動物です。さるは世界に10匹しか生息していません。体調は100Mあります。猿のことなら何でも答えます。'
-    else:
-        system_message = 'さるは、2足歩行です。体調は約1.5Mあります。猿のことなら何でも答えます。'
+    if (rng or random).uniform(0, 1) > 0.5:
+        return 'さるは、とは爬虫類の大型動物です。さるは世界に10匹しか生息していません。体調は100Mあります。猿のことなら何でも答えます。'
+    return 'さるは、2足歩行です。体調は約1.5Mあります。猿のことなら何でも答えます。'
+
+
+def build_messages(question: str, system_message: str) -> list[dict]:
+    return [
+        {'role': 'system', 'content': system_message},
+        {'role': 'user', 'content': question},
+    ]
+
+
+def build_request(question: str, system_message: str) -> dict:
+    """
+    chat.completions.createの引数。同期版と非同期版で同じリクエストを送るため、ここだけで組み立てる
+    """
+    return {'model': MODEL, 'messages': build_messages(question, system_message)}
+
+
+def call_model(question: str, *, client: OpenAI | None = None, rng: random.Random | None = None) -> str:
+    system_message = choose_system_message(rng)
     print(f'call_model ------------------------------- {system_message}')
 
-    completion = client.chat.completions.create(
-        model='gpt-4o-mini',
-        messages=[
-            {'role': 'system', 'content': system_message},
-            {'role': 'user', 'content': question},
-        ],
-    )
+    completion = (client or get_client()).chat.completions.create(**build_request(question, system_message))
+    return completion.choices[0].message.content
+
+
+async def acall_model(question: str, system_message: str, *, client: AsyncOpenAI) -> str:
+    """
+    call_modelの非同期版。大量に呼び出すfuzz_runnerから使うため、system_messageは呼び出し側で選ぶ
+    """
+    completion = await client.chat.completions.create(**build_request(question, system_message))
     return completion.choices[0].message.content
@@ -0,0 +1,238 @@
+"""
+call_modelに大量の質問を並列で投げるfuzzランナー
+
+- AsyncOpenAIのクライアントをClientPoolにまとめ、並列数ぶんのHTTPコネクションを使い回す
+- 同時に実行する呼び出しはconcurrency個まで
+- トークンバケットで1秒あたりのリクエスト数を制限する(rate)
+- レート制限・接続エラー・5xxは、指数バックオフ+ジッターで再試行する
+- system messageの選択とジッターは、seedと質問の番号から作った乱数で決めるので、
+  完了順によらず同じseedなら同じ結果になる
+
+入力は1行1質問のテキスト、出力は1行1件のJSONL。
+
+    python -m src.langfuzz.fuzz_runner questions.txt answers.jsonl --concurrency 32 --rate 50 --seed 0
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from src.langfuzz.call_model import acall_model, choose_system_message
+
+# 再試行すれば成功する見込みのあるエラー
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class TokenBucket:
+    """
+    1秒あたりrate個のトークンが溜まり、最大capacity個まで保持するバケット
+
+    acquireはトークンが溜まるまで待つ。待っている呼び出しは到着順に進む。
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class FuzzResult:
+    index: int
+    question: str
+    system_message: str
+    answer: str | None = None
+    error: str | None = None
+    attempts: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class FuzzStats:
+    completed: int = 0
+    errors: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def questions_per_second(self) -> float:
+        return self.completed / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> dict[str, Any]:
+        return {**asdict(self), 'questions_per_second': self.questions_per_second}
+
+
+class ClientPool:
+    """
+    ワーカーが分担して使うAsyncOpenAIクライアントの集まり
+
+    httpcoreのコネクションプールは、空きコネクションを探す処理がコネクション数×待ちリクエスト数に比例する。
+    1つのクライアントに64本のコネクションを持たせるとここがボトルネックになるため、
+    connections_per_client本ずつの小さなプールに分け、ワーカーごとに固定で割り当てる。
+    再試行はrun_fuzzで行うのでSDKの再試行は切る
+    """
+
+    def __init__(self, concurrency: int, connections_per_client: int = 8, **kwargs: Any):
+        size = max(1, -(-concurrency // connections_per_client))
+        per_client = -(-concurrency // size)
+        self.clients = [
+            AsyncOpenAI(
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=per_client, max_keepalive_connections=per_client)
+                ),
+                **kwargs,
+            )
+            for _ in range(size)
+        ]
+
+    def for_worker(self, worker: int) -> AsyncOpenAI:
+        return self.clients[worker % len(self.clients)]
+
+    async def close(self) -> None:
+        for client in self.clients:
+            await client.close()
+
+    async def __aenter__(self) -> 'ClientPool':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+def backoff(attempt: int, rng: random.Random, base_delay: float, max_delay: float) -> float:
+    # full jitter: 0から指数的に伸びる上限までの一様乱数
+    return rng.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+async def run_fuzz(
+    questions: Iterable[str],
+    *,
+    client: AsyncOpenAI | ClientPool | None = None,
+    concurrency: int = 16,
+    rate: float | None = None,
+    max_retries: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 8.0,
+    seed: int = 0,
+) -> tuple[list[FuzzResult], FuzzStats]:
+    """
+    questionsを全てcall_modelに投げ、入力順の結果と統計を返す
+
+    Args:
+        client: 1つのクライアントを渡すと全ワーカーで共有する。省略時はClientPool(concurrency)を作り、終了時に閉じる
+        rate: 1秒あたりの最大リクエスト数(再試行も含む)。省略時は制限しない
+        max_retries: 1つの質問を再試行する最大回数
+        seed: system messageの選択とジッターの乱数のseed
+    """
+    owns_client = client is None
+    pool = client if isinstance(client, ClientPool) else None
+    if client is None:
+        pool = ClientPool(concurrency)
+    bucket = TokenBucket(rate) if rate else None
+    items = list(enumerate(questions))
+    results: list[FuzzResult | None] = [None] * len(items)
+    stats = FuzzStats()
+    pending = iter(items)
+
+    async def ask(index: int, question: str, client: AsyncOpenAI) -> FuzzResult:
+        # 質問ごとに乱数を分けるので、他の質問の再試行回数や完了順に影響されない
+        rng = random.Random(f'{seed}:{index}')
+        result = FuzzResult(index, question, choose_system_message(rng))
+        start = time.perf_counter()
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+            result.attempts += 1
+            try:
+                result.answer = await acall_model(question, result.system_message, client=client)
+                break
+            except RETRYABLE_ERRORS as e:
+                if result.attempts > max_retries:
+                    result.error = repr(e)
+                    break
+                stats.retries += 1
+                await asyncio.sleep(backoff(result.attempts - 1, rng, base_delay, max_delay))
+            except Exception as e:
+                # 再試行しないエラーはその質問の結果として記録し、他の質問は続ける
+                result.error = repr(e)
+                break
+        result.seconds = time.perf_counter() - start
+        return result
+
+    async def work(worker: int):
+        worker_client = pool.for_worker(worker) if pool is not None else client
+        # イベントループは1スレッドなので、ワーカー間でイテレータを共有してよい
+        for index, question in pending:
+            result = await ask(index, question, worker_client)
+            results[index] = result
+            stats.completed += 1
+            if result.error is not None:
+                stats.errors += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(work(worker) for worker in range(min(concurrency, len(items)))))
+    finally:
+        if owns_client:
+            await pool.close()
+    stats.seconds = time.perf_counter() - start
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='1行1質問のテキストファイル')
+    parser.add_argument('output', help='結果を書き出すJSONL')
+    parser.add_argument('--base-url', help='OpenAI互換サーバーのURL(省略時はOpenAI)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float)
+    parser.add_argument('--max-retries', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.input, encoding='utf-8') as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    async def run():
+        async with ClientPool(args.concurrency, base_url=args.base_url) as pool:
+            return await run_fuzz(
+                questions,
+                client=pool,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                max_retries=args.max_retries,
+                seed=args.seed,
+            )
+
+    results, stats = asyncio.run(run())
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(asdict(result), ensure_ascii=False) + '\n')
+    print(json.dumps(stats.summary(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+from src.bench.graph_overhead import build_scenarios, compare, run, run_all
+
+
+def test_scenarios_run_offline_and_report_breakdown():
+    report = run_all(iterations=4)
+    results = {r['scenario']: r for r in report['results']}
+    assert set(results) == {s.name for s in build_scenarios()}
+
+    plan = results['plan_and_execute']
+    assert plan['nodes']['agent']['calls_per_invoke'] == 2
+    assert plan['nodes']['replan']['calls_per_invoke'] == 2
+    assert plan['external_p50_ms'] > 0
+    assert results['react_agent']['supersteps'] == 4
+    assert set(results['basic']['nodes']) == {'__start__', 'node', 'node2'}
+    for result in results.values():
+        assert result['p50_ms'] <= result['p99_ms']
+        assert result['peak_p50_kb'] > 0
+
+
+def test_compare_reports_regressions():
+    scenario = next(s for s in build_scenarios() if s.name == 'state_manage')
+    result = run(scenario, iterations=2, warmup=0)
+    baseline = {'results': [{**result, 'p50_ms': result['p50_ms'] / 2}]}
+    assert compare({'results': [result]}, baseline, max_regression=0.2)
+    assert not compare({'results': [result]}, {'results': [result]}, max_regression=0.2)
@@ -0,0 +1,11 @@
+from src.bench.startup import GRAPH_MODULES, measure_import
+
+# importだけでLLMの生成やネットワークアクセスを行っていれば、この予算に収まらないか失敗する
+IMPORT_SECONDS_BUDGET = 5.0
+IMPORT_PEAK_BYTES_BUDGET = 128 * 1024 * 1024
+
+
+def test_import_graph_modules_within_budget():
+    result = measure_import(GRAPH_MODULES)
+    assert result['seconds'] < IMPORT_SECONDS_BUDGET
+    assert result['peak_bytes'] < IMPORT_PEAK_BYTES_BUDGET
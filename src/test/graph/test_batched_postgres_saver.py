@@ -0,0 +1,40 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from src.bench.postgres_checkpoint import build_counter_graph
+from src.graph.batched_postgres_saver import BatchingAsyncPostgresSaver
+
+# 起動済みのPostgresがある場合だけ実行する (例: postgresql://postgres@127.0.0.1:5432/postgres)
+DSN = os.environ.get('POSTGRES_TEST_DSN')
+
+pytestmark = pytest.mark.skipif(DSN is None, reason='POSTGRES_TEST_DSN is not set')
+
+
+async def _run_concurrent_threads(threads: int):
+    async with AsyncConnectionPool(
+        conninfo=DSN, max_size=5, kwargs={'autocommit': True, 'prepare_threshold': 0, 'row_factory': dict_row}
+    ) as pool:
+        checkpointer = BatchingAsyncPostgresSaver(pool, flush_interval=0.01)
+        await checkpointer.setup()
+        graph = build_counter_graph(checkpointer)
+        prefix = uuid.uuid4().hex
+        configs = [{'configurable': {'thread_id': f'{prefix}-{i}'}} for i in range(threads)]
+
+        results = await asyncio.gather(*(graph.ainvoke({'count': 0}, c) for c in configs))
+        histories = [[s async for s in graph.aget_state_history(c)] for c in configs]
+        return results, histories, checkpointer.stats
+
+
+def test_concurrent_threads_share_flushes():
+    results, histories, stats = asyncio.run(_run_concurrent_threads(10))
+
+    assert [r['count'] for r in results] == [3] * 10
+    # input + 3ノード + 開始前 の5つのcheckpointがthreadごとに残る
+    assert [len(h) for h in histories] == [5] * 10
+    assert stats.checkpoints == 50
+    assert stats.flushes < stats.checkpoints
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import numpy as np
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.category_classifier import (
+    CategoryModel,
+    TieredClassifier,
+    evaluate,
+    load_categories,
+    load_labeled,
+    seed_examples,
+    train,
+)
+from src.graph.conversation_classification import Conversation, ConversationClassification, build_chain
+
+LLM_RESULT = ConversationClassification(
+    conversations=[
+        Conversation(
+            category='相談',
+            purpose='',
+            discourse_analysis='',
+            text='',
+            keywords=[],
+            emotion_fluctuation=30,
+        )
+    ]
+)
+
+
+def test_categories_are_read_from_prompt_table():
+    categories = load_categories()
+    assert len(categories) == 40
+    assert list(categories)[:2] == ['雑談', '噂話']
+    assert categories['応答'].startswith('他者の発言')
+
+
+def test_trivial_messages_skip_the_llm():
+    llm = ScriptedChatModel(responses=[LLM_RESULT])
+    classifier = TieredClassifier(train(), threshold=0.8)
+    chain = classifier.as_runnable(build_chain(llm))
+
+    result = chain.invoke({'messages': [('human', 'ありがとうございます！')]})
+    assert result.conversations[0].category == '感謝'
+    assert result.conversations[0].keywords == ['ありがとう', 'ありがとうございます']
+    assert llm.call_count == 0
+
+    long_text = '仕事のことでずっと悩んでいて、何度問い合わせても返事がなかった。どうしたらいいと思う？'
+    result = asyncio.run(chain.ainvoke({'messages': [('human', long_text)]}))
+    assert result.conversations[0].category == '相談'
+    assert llm.call_count == 1
+    summary = classifier.stats.summary()
+    assert (summary['local'], summary['llm']) == (1, 1)
+
+
+def test_evaluate_against_stored_labels_and_reload(tmp_path):
+    rows = [
+        {'index': i, 'id': f'c{i}', 'result': {'conversations': [{'text': text, 'category': category}]}}
+        for i, (text, category) in enumerate(
+            [('おはようございます', '挨拶'), ('ごめんなさい', '謝罪'), ('お腹すいたね', '雑談'), ('こんにちは', '挨拶')]
+        )
+    ]
+    path = tmp_path / 'classified.jsonl'
+    path.write_text('\n'.join(json.dumps(r, ensure_ascii=False) for r in rows) + '\n', encoding='utf-8')
+
+    examples = load_labeled(path)
+    assert examples[2] == ('お腹すいたね', '雑談')
+    model = train(examples)
+    report = evaluate(model, examples, threshold=0.5)
+    assert report['coverage'] > 0.5
+    assert report['agreement_rate'] == 1.0
+
+    model.save(tmp_path / 'model.npz')
+    loaded = CategoryModel.load(tmp_path / 'model.npz')
+    assert loaded.predict(['おはようございます']) == model.predict(['おはようございます'])
+
+
+def test_chunked_fit_and_predict_match_single_chunk():
+    examples = seed_examples()
+    texts, labels = [t for t, _ in examples], [c for _, c in examples]
+    whole = CategoryModel(chunk_size=len(texts)).fit(texts, labels)
+    chunked = CategoryModel(chunk_size=7).fit(texts, labels)
+
+    assert np.allclose(whole.idf, chunked.idf)
+    assert np.allclose(whole.centroids, chunked.centroids, atol=1e-6)
+    assert [c for c, _ in chunked.predict(texts)] == [c for c, _ in whole.predict(texts)]
+    assert chunked.predict([]) == []
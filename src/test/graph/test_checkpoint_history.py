@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.checkpoint_history import CheckpointHistory, IndexedMemorySaver
+from src.graph.memory import build_graph
+
+CONFIG = {'configurable': {'thread_id': '1'}}
+
+
+def _graph(checkpointer=None, turns: int = 3):
+    graph = build_graph(ScriptedChatModel(responses=[f'回答{i}' for i in range(turns)]), checkpointer=checkpointer)
+    for i in range(turns):
+        graph.invoke({'messages': [('user', f'質問{i}')]}, CONFIG)
+    return graph
+
+
+def test_lookups_match_full_history():
+    graph = _graph()
+    history = CheckpointHistory(graph)
+    states = list(graph.get_state_history(CONFIG))
+
+    assert history.latest(CONFIG).checkpoint_id == states[0].config['configurable']['checkpoint_id']
+    ref = history.at_step(CONFIG, 1)
+    assert ref.writers == ('call_model',)
+    assert history.state(ref).values == next(s for s in states if s.metadata['step'] == 1).values
+    assert history.last_written_by(CONFIG, 'call_model').checkpoint_id == history.latest(CONFIG).checkpoint_id
+    assert history.at_time(CONFIG, ref.created_at) == ref
+    assert history.at_time(CONFIG, datetime(2000, 1, 1).astimezone()) is None
+
+
+def test_cursor_pagination_walks_history_newest_first():
+    graph = _graph()
+    history = CheckpointHistory(graph)
+    ids = []
+    cursor = None
+    while True:
+        page = history.page(CONFIG, limit=4, cursor=cursor)
+        ids.extend(ref.checkpoint_id for ref in page.items)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert ids == [s.config['configurable']['checkpoint_id'] for s in graph.get_state_history(CONFIG)]
+
+    answers = history.page(CONFIG, limit=10, node='call_model').items
+    assert [ref.step for ref in answers] == [7, 4, 1]
+
+
+def test_rewind_forks_and_newest_branch_wins():
+    graph = _graph()
+    history = CheckpointHistory(graph)
+    first_answer = history.at_step(CONFIG, 1)
+    graph.invoke({'messages': [('user', '別の質問')]}, first_answer.config)
+
+    # step 2〜4は元の履歴と分岐した履歴の両方にあり、新しい分岐の方を返す
+    assert history.at_step(CONFIG, 2).parent_id == first_answer.checkpoint_id
+    assert history.at_step(CONFIG, 4) == history.latest(CONFIG)
+    assert history.state(history.at_step(CONFIG, 4)).values['messages'][-2].content == '別の質問'
+    assert history.last_written_by(CONFIG, 'call_model').step == 4
+
+
+def test_catches_up_with_a_plain_checkpointer():
+    graph = _graph(MemorySaver(), turns=2)
+    history = CheckpointHistory(graph)
+    assert history.latest(CONFIG).step == 4
+
+    graph.invoke({'messages': [('user', '質問')]}, CONFIG)
+    assert history.latest(CONFIG).step == 7
+    assert len(history.page(CONFIG, limit=100).items) == len(list(graph.get_state_history(CONFIG)))
+
+
+def test_index_keeps_only_recently_used_threads():
+    checkpointer = IndexedMemorySaver(max_history_threads=2)
+    graph = _graph(checkpointer)
+    history = CheckpointHistory(graph)
+    index = checkpointer.history_index
+    # 参照されていないthreadは、putされても索引に入らない
+    assert index.threads == {}
+
+    configs = [{'configurable': {'thread_id': str(i)}} for i in range(1, 4)]
+    for config in configs[1:]:
+        graph.invoke({'messages': [('user', '質問')]}, config)
+    assert [history.latest(config).step for config in configs] == [7, 1, 1]
+    assert list(index.threads) == [('2', ''), ('3', '')]
+
+    # 追い出されたthreadは参照したときにcheckpointerから読み込み直す
+    assert [ref.step for ref in history.page(CONFIG, limit=10, node='call_model').items] == [7, 4, 1]
+    assert list(index.threads) == [('3', ''), ('1', '')]
+    graph.invoke({'messages': [('user', '質問')]}, CONFIG)
+    assert history.latest(CONFIG).step == 10
+
+
+class CountingSaver(IndexedMemorySaver):
+    """読み込んだcheckpoint(値を含むCheckpointTuple)の数を数える"""
+
+    loads = 0
+
+    def get_tuple(self, config):
+        checkpoint = super().get_tuple(config)
+        self.loads += checkpoint is not None
+        return checkpoint
+
+    def list(self, config, **kwargs):
+        for checkpoint in super().list(config, **kwargs):
+            self.loads += 1
+            yield checkpoint
+
+
+def test_rebuilding_an_evicted_thread_loads_only_the_target():
+    checkpointer = CountingSaver(max_history_threads=1)
+    graph = _graph(checkpointer)
+    history = CheckpointHistory(graph)
+    pages = history.page(CONFIG, limit=100)
+    other = {'configurable': {'thread_id': '2'}}
+    graph.invoke({'messages': [('user', '質問')]}, other)
+    history.latest(other)
+    assert list(checkpointer.history_index.threads) == [('2', '')]
+
+    checkpointer.loads = 0
+    ref = history.at_step(CONFIG, 4)
+    assert history.state(ref).values['messages'][-1].content == '回答1'
+    # 索引はid・メタデータだけから作り直し、読み込むのは目的のcheckpointの1つだけ
+    assert checkpointer.loads == 1
+    assert history.page(CONFIG, limit=100) == pages
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.checkpoint_retention import RetainingMemorySaver, RetentionPolicy
+from src.graph.memory import build_graph
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _run(graph, thread_id: str, turns: int):
+    config = {'configurable': {'thread_id': thread_id}}
+    for i in range(turns):
+        graph.invoke({'messages': [{'role': 'user', 'content': f'質問{i}'}]}, config)
+    return config
+
+
+def _graph(saver: RetainingMemorySaver):
+    model = ScriptedChatModel(responses=[lambda messages: f'回答{len(messages)}'])
+    return build_graph(model=model, checkpointer=saver)
+
+
+def test_keep_last_keeps_latest_state():
+    saver = RetainingMemorySaver(RetentionPolicy(keep_last=2))
+    graph = _graph(saver)
+    config = _run(graph, '1', 5)
+    before = saver.stats()
+
+    assert saver.compact() == before['checkpoints'] - 2
+    after = saver.stats()
+    assert after['checkpoints'] == 2
+    assert after['bytes'] < before['bytes']
+    assert after['deleted'] == before['checkpoints'] - 2
+
+    # 削除後も最新の状態から会話を続けられる
+    history = list(graph.get_state_history(config))
+    assert len(history) == 2
+    assert history[-1].parent_config is None
+    result = graph.invoke({'messages': [{'role': 'user', 'content': '続き'}]}, config)
+    assert len(result['messages']) == 12
+
+
+def test_compact_only_visits_dirty_threads():
+    saver = RetainingMemorySaver(RetentionPolicy(keep_last=1))
+    graph = _graph(saver)
+    _run(graph, '1', 2)
+    _run(graph, '2', 2)
+    assert saver.compact(max_threads=1) > 0
+    assert len(saver.dirty) == 1
+    assert saver.compact() > 0
+    assert saver.compact() == 0
+
+
+def test_branch_points_only_keeps_forks():
+    saver = RetainingMemorySaver(RetentionPolicy(branch_points_only=True))
+    graph = _graph(saver)
+    config = _run(graph, '1', 3)
+
+    # 過去のcheckpointから分岐させる
+    fork_from = list(graph.get_state_history(config))[3]
+    graph.invoke({'messages': [{'role': 'user', 'content': '分岐'}]}, fork_from.config)
+    saver.compact()
+
+    ids = {state.config['configurable']['checkpoint_id'] for state in graph.get_state_history(config)}
+    assert fork_from.config['configurable']['checkpoint_id'] in ids
+    checkpoints = saver.storage['1']['']
+    leaves = set(checkpoints) - {parent for _, _, parent in checkpoints.values()}
+    # 元の枝の先端と、分岐した枝の先端
+    assert len(leaves) == 2
+
+
+def test_ttl_removes_expired_checkpoints():
+    clock = FakeClock()
+    saver = RetainingMemorySaver(RetentionPolicy(ttl=10), clock=clock)
+    graph = _graph(saver)
+    _run(graph, '1', 2)
+    clock.now = 5
+    _run(graph, '2', 1)
+    saver.compact()
+    assert saver.stats()['deleted'] == 0
+
+    clock.now = 12
+    saver.compact()
+    # thread 1は最新とその親だけ、thread 2はまだ期限内
+    assert len(saver.storage['1']['']) == 2
+    assert len(saver.storage['2']['']) == 3
+
+
+def test_background_compaction_runs_while_graph_is_used():
+    saver = RetainingMemorySaver(RetentionPolicy(keep_last=3))
+    graph = _graph(saver)
+    saver.start(interval=0.001)
+    try:
+        threads = [threading.Thread(target=_run, args=(graph, str(i), 10)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        saver.stop()
+    saver.compact()
+    assert saver.stats()['checkpoints'] == 4 * 3
+    for i in range(4):
+        state = graph.get_state({'configurable': {'thread_id': str(i)}})
+        assert len(state.values['messages']) == 20
+
+
+def test_build_graph_with_retention_compacts_in_the_background():
+    model = ScriptedChatModel(responses=[lambda messages: f'回答{len(messages)}'])
+    graph = build_graph(model=model, retention=RetentionPolicy(keep_last=2), compaction_interval=0.001)
+    saver = graph.checkpointer
+    try:
+        config = _run(graph, '1', 5)
+        # compact()を呼ばなくても、バックグラウンドのcompactionで古いcheckpointが削除される
+        deadline = time.monotonic() + 5
+        while saver.stats()['checkpoints'] > 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+        assert len(graph.get_state(config).values['messages']) == 10
+    finally:
+        saver.stop()
+    assert saver._worker is None
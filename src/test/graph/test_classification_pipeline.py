@@ -0,0 +1,126 @@
+import asyncio
+import json
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.classification_pipeline import classify_jsonl
+from src.graph.conversation_classification import Conversation, ConversationClassification, build_chain
+
+RESULT = ConversationClassification(
+    conversations=[
+        Conversation(
+            category='雑談',
+            purpose='天気の話',
+            discourse_analysis='',
+            text='今日はいい天気だね',
+            keywords=['天気'],
+            emotion_fluctuation=80,
+        )
+    ]
+)
+
+
+def _write_input(path, count):
+    with path.open('w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({'id': f'c{i}', 'messages': [['human', f'会話 {i}']]}, ensure_ascii=False) + '\n')
+
+
+def _read_output(path):
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines()]
+
+
+def test_classify_jsonl_runs_concurrently(tmp_path):
+    _write_input(tmp_path / 'in.jsonl', 40)
+    llm = ScriptedChatModel(responses=[RESULT], latency=0.02)
+
+    start = time.perf_counter()
+    stats = asyncio.run(classify_jsonl(build_chain(llm), tmp_path / 'in.jsonl', tmp_path / 'out.jsonl', concurrency=10))
+    elapsed = time.perf_counter() - start
+
+    rows = _read_output(tmp_path / 'out.jsonl')
+    assert sorted(r['index'] for r in rows) == list(range(40))
+    assert rows[0]['result']['conversations'][0]['category'] == '雑談'
+    assert stats.processed == 40
+    assert stats.conversations_per_second > 0
+    assert elapsed < 40 * 0.02
+
+
+def test_classify_jsonl_resumes_from_checkpoint(tmp_path):
+    _write_input(tmp_path / 'in.jsonl', 30)
+    llm = ScriptedChatModel(responses=[RESULT])
+    chain = build_chain(llm)
+
+    first = asyncio.run(
+        classify_jsonl(
+            chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl', concurrency=4, checkpoint_interval=5, limit=12
+        )
+    )
+    # チェックポイント保存後に書き込まれた(クラッシュで中途半端になった)行は再開時に切り捨てられる
+    with (tmp_path / 'out.jsonl').open('a') as f:
+        f.write('{"index": 99, "broken"')
+    second = asyncio.run(classify_jsonl(chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl', concurrency=4))
+
+    rows = _read_output(tmp_path / 'out.jsonl')
+    assert sorted(r['index'] for r in rows) == list(range(30))
+    assert first.processed == 12
+    assert second.skipped == 12
+    assert llm.call_count == 30
+
+
+def test_classify_jsonl_records_errors(tmp_path):
+    (tmp_path / 'in.jsonl').write_text(json.dumps({'id': 'x', 'messages': [['human', 'a']]}) + '\n')
+    llm = ScriptedChatModel(responses=['not a tool call'])
+
+    stats = asyncio.run(classify_jsonl(build_chain(llm), tmp_path / 'in.jsonl', tmp_path / 'out.jsonl'))
+
+    assert stats.errors == 1
+    assert 'error' in _read_output(tmp_path / 'out.jsonl')[0]
+
+
+def test_failed_rows_are_retried_on_resume(tmp_path):
+    _write_input(tmp_path / 'in.jsonl', 10)
+    calls = []
+
+    async def classify(inputs):
+        text = inputs['messages'][0][1]
+        calls.append(text)
+        # 1回目の会話3は一時的なエラー(レート制限など)で失敗する
+        if text == '会話 3' and calls.count(text) == 1:
+            raise TimeoutError('rate limited')
+        return RESULT
+
+    chain = RunnableLambda(classify)
+    first = asyncio.run(
+        classify_jsonl(chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl', concurrency=4, checkpoint_interval=2)
+    )
+    second = asyncio.run(classify_jsonl(chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl', concurrency=4))
+
+    assert first.errors == 1
+    assert (second.processed, second.skipped, second.errors) == (1, 9, 0)
+    assert calls.count('会話 3') == 2
+    rows = [r for r in _read_output(tmp_path / 'out.jsonl') if r['index'] == 3]
+    assert 'error' in rows[0]
+    assert rows[-1]['result'] == RESULT.model_dump(mode='json')
+
+
+def test_malformed_line_is_recorded_as_an_error(tmp_path):
+    _write_input(tmp_path / 'in.jsonl', 3)
+    with (tmp_path / 'in.jsonl').open('a', encoding='utf-8') as f:
+        f.write('{"id": "broken"\n[1, 2]\n' + json.dumps({'id': 'c5', 'messages': [['human', '会話 5']]}) + '\n')
+    llm = ScriptedChatModel(responses=[RESULT])
+    chain = build_chain(llm)
+
+    stats = asyncio.run(classify_jsonl(chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl'))
+    rows = {r['index']: r for r in _read_output(tmp_path / 'out.jsonl')}
+    assert sorted(rows) == [0, 1, 2, 3, 4, 5]
+    assert 'error' in rows[3] and 'error' in rows[4]
+    assert 'result' in rows[5]
+    assert (stats.processed, stats.errors) == (6, 2)
+
+    # 読めない行は再開しても同じなので、再試行しない
+    again = asyncio.run(classify_jsonl(chain, tmp_path / 'in.jsonl', tmp_path / 'out.jsonl'))
+    assert (again.processed, again.skipped) == (0, 6)
+    assert llm.call_count == 4
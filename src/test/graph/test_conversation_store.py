@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from src.graph.conversation_classification import Conversation
+from src.graph.conversation_store import ConversationStore
+
+JST = timezone(timedelta(hours=9))
+
+
+def _conversation(category: str, keywords: list[str], emotion: int, day: int, hour: int = 12) -> Conversation:
+    return Conversation(
+        category=category,
+        purpose=f'{category}の目的',
+        discourse_analysis='分析',
+        text=f'{day}日の会話',
+        keywords=keywords,
+        created_at=datetime(2024, 10, day, hour, tzinfo=JST),
+        emotion_fluctuation=emotion,
+    )
+
+
+CONVERSATIONS = [
+    _conversation('雑談', ['天気', '朝'], 80, 1),
+    _conversation('相談', ['仕事'], 30, 1),
+    _conversation('雑談', ['天気'], 60, 8),
+    _conversation('不満', [], 10, 15, hour=1),
+]
+
+
+def test_round_trip_and_reopen(tmp_path):
+    store = ConversationStore(tmp_path)
+    store.append(CONVERSATIONS, user='u1')
+    store.append(CONVERSATIONS[:2], user='u2')
+
+    reopened = ConversationStore(tmp_path)
+    assert len(reopened) == 6
+    assert reopened.conversations([0, 3, 5]) == [CONVERSATIONS[0], CONVERSATIONS[3], CONVERSATIONS[1]]
+    # 辞書には種類ごとに1つだけ入る
+    assert reopened.dictionaries['category'].values == ['雑談', '相談', '不満']
+    assert reopened.dictionaries['user'].values == ['u1', 'u2']
+    assert reopened.column('category').dtype == np.int32
+
+
+def test_first_append_without_keywords(tmp_path):
+    store = ConversationStore(tmp_path)
+    # キーワードが1つも無い追記でも、まだ無い辞書のファイルを作ってから書き込む
+    store.append(CONVERSATIONS[3:])
+    assert ConversationStore(tmp_path).conversations([0]) == CONVERSATIONS[3:]
+    assert store.meta['dictionary_bytes']['keyword'] == 0
+
+
+def test_vectorized_queries(tmp_path):
+    store = ConversationStore(tmp_path)
+    store.append(CONVERSATIONS, user='u1')
+    store.append(CONVERSATIONS[:2], user='u2')
+
+    assert store.category_histogram() == {'雑談': 3, '相談': 2, '不満': 1}
+    assert store.category_histogram(start=datetime(2024, 10, 5, tzinfo=JST)) == {'雑談': 1, '不満': 1}
+    assert store.keyword_frequency(top=2) == [('天気', 3), ('朝', 2)]
+    assert store.keyword_frequency(category='相談', user='u2') == [('仕事', 1)]
+
+    weekly = store.period_aggregates('week', utc_offset=timedelta(hours=9))
+    assert [(w['period'], w['count']) for w in weekly] == [('2024-09-30', 4), ('2024-10-07', 1), ('2024-10-14', 1)]
+    assert weekly[0]['emotion_mean'] == 55.0
+    assert (weekly[0]['emotion_min'], weekly[0]['emotion_max']) == (30, 80)
+    # 15日の午前1時(日本時間)はUTCでは14日
+    daily = store.period_aggregates('day', utc_offset=timedelta(0), category='不満')
+    assert [d['period'] for d in daily] == ['2024-10-14']
+    assert store.period_aggregates('month', user='nobody') == []
+
+
+def test_uncommitted_append_is_discarded_on_open(tmp_path):
+    store = ConversationStore(tmp_path)
+    store.append(CONVERSATIONS[:2])
+    # meta.jsonを書く前に落ちた追記を再現する
+    with (tmp_path / 'created_at.bin').open('ab') as f:
+        f.write(b'\x00' * 8)
+    with (tmp_path / 'category.dict').open('a', encoding='utf-8') as f:
+        f.write('"書きかけ"\n')
+
+    reopened = ConversationStore(tmp_path)
+    assert (tmp_path / 'created_at.bin').stat().st_size == 16
+    reopened.append(CONVERSATIONS[2:])
+    assert ConversationStore(tmp_path).conversations(range(4)) == CONVERSATIONS
+    assert reopened.dictionaries['category'].values == ['雑談', '相談', '不満']
+
+
+def test_failed_append_is_rolled_back(tmp_path, monkeypatch):
+    store = ConversationStore(tmp_path)
+    store.append(CONVERSATIONS[:1])
+
+    def fail(meta):
+        raise OSError('disk full')
+
+    # 列と辞書を書いた後、meta.jsonを書く前に失敗させる
+    with monkeypatch.context() as m, pytest.raises(OSError):
+        m.setattr(store, '_commit', fail)
+        store.append(CONVERSATIONS[3:])
+    store.append(CONVERSATIONS[1:3])
+
+    assert store.conversations(range(3)) == CONVERSATIONS[:3]
+    assert ConversationStore(tmp_path).conversations(range(3)) == CONVERSATIONS[:3]
+    # 失敗した追記の'不満'は辞書に残らない
+    assert store.dictionaries['category'].values == ['雑談', '相談']
@@ -0,0 +1,76 @@
+from langchain_core.messages import RemoveMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.delta_checkpoint import DELTA_KEY, DeltaMemorySaver
+from src.graph.memory import build_graph
+
+
+def _graph(checkpointer):
+    model = ScriptedChatModel(responses=[lambda messages: f'回答{len(messages)}'])
+    return build_graph(model=model, checkpointer=checkpointer)
+
+
+def _run(graph, turns: int, thread_id: str = '1'):
+    config = {'configurable': {'thread_id': thread_id}}
+    for i in range(turns):
+        graph.invoke({'messages': [{'role': 'user', 'content': f'質問{i}'}]}, config)
+    return config
+
+
+def _contents(state) -> list[str]:
+    return [m.content for m in state.values.get('messages', [])]
+
+
+def _stored_bytes(saver: MemorySaver) -> int:
+    return sum(len(c[1]) for ns in saver.storage.values() for saved in ns.values() for c, _, _ in saved.values())
+
+
+def test_history_matches_memory_saver():
+    expected = _graph(MemorySaver())
+    actual = _graph(DeltaMemorySaver(snapshot_interval=4))
+    config = _run(expected, 10)
+    _run(actual, 10)
+
+    expected_history = list(expected.get_state_history(config))
+    actual_history = list(actual.get_state_history(config))
+    assert [_contents(s) for s in actual_history] == [_contents(s) for s in expected_history]
+    assert [s.next for s in actual_history] == [s.next for s in expected_history]
+    assert _contents(actual.get_state(config)) == _contents(expected.get_state(config))
+
+
+def test_snapshot_interval_bounds_chain_and_reduces_bytes():
+    memory = MemorySaver()
+    delta = DeltaMemorySaver(snapshot_interval=4)
+    _run(_graph(memory), 20)
+    _run(_graph(delta), 20)
+
+    checkpoints = delta.storage['1']['']
+    depths = []
+    for saved, _, _ in checkpoints.values():
+        value = delta.serde.loads_typed(saved)['channel_values'].get('messages')
+        depths.append(value['depth'] if isinstance(value, dict) and DELTA_KEY in value else 0)
+    assert max(depths) == 3
+    assert _stored_bytes(delta) < _stored_bytes(memory) / 2
+
+
+def test_fork_from_past_checkpoint():
+    saver = DeltaMemorySaver()
+    graph = _graph(saver)
+    config = _run(graph, 3)
+    fork_from = list(graph.get_state_history(config))[3]
+    graph.invoke({'messages': [{'role': 'user', 'content': '分岐'}]}, fork_from.config)
+
+    assert _contents(graph.get_state(config))[-2:] == ['分岐', f'回答{len(_contents(fork_from)) + 1}']
+    assert _contents(graph.get_state(fork_from.config)) == _contents(fork_from)
+
+
+def test_removed_message_is_stored_as_snapshot():
+    saver = DeltaMemorySaver()
+    graph = _graph(saver)
+    config = _run(graph, 2)
+    first = graph.get_state(config).values['messages'][0]
+    graph.update_state(config, {'messages': [RemoveMessage(id=first.id)]})
+    assert _contents(graph.get_state(config)) == ['回答1', '質問1', '回答3']
+    _run(graph, 1)
+    assert _contents(graph.get_state(config))[-2:] == ['質問0', '回答4']
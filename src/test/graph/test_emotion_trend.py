@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from src.graph.conversation_classification import Conversation
+from src.graph.conversation_store import ConversationStore, to_micros
+from src.graph.emotion_trend import TrendConfig, TrendEngine
+
+JST = timezone(timedelta(hours=9))
+START = datetime(2024, 10, 1, tzinfo=JST)
+
+
+def test_drop_is_alerted_once_and_recovers():
+    engine = TrendEngine()
+    alerts = []
+    # 2週間は安定していて、その後の3日間で落ち込み、また戻る
+    emotions = [80] * 14 + [20, 15, 10] + [80] * 6
+    for day, emotion in enumerate(emotions):
+        snapshot = engine.update('u1', emotion, START + timedelta(days=day))
+        alerts.append(snapshot.alert)
+
+    assert alerts.index(True) == 14
+    assert sum(alerts) == 1
+    assert not snapshot.dropping
+    assert engine.dropping_users() == []
+    assert snapshot.count == len(emotions)
+    # 直近7日間の会話だけがwindowに入る
+    assert snapshot.window_count == 7
+    assert snapshot.window_mean == (10 + 80 * 6) / 7
+
+
+def test_window_expires_by_time():
+    engine = TrendEngine(TrendConfig(window=timedelta(days=7), buckets=7))
+    engine.update('u1', 40, START)
+    engine.update('u1', 60, START + timedelta(days=3))
+
+    assert engine.snapshot('u1').window_mean == 50
+    assert engine.snapshot('u1', now=START + timedelta(days=8)).window_mean == 60
+    assert engine.snapshot('u1', now=START + timedelta(days=11)).window_count == 0
+    engine.update('u1', 90, START + timedelta(days=20))
+    assert engine.snapshot('u1').window_count == 1
+    assert engine.snapshot('unknown') is None
+
+
+def test_backfill_matches_incremental_updates():
+    rng = np.random.default_rng(0)
+    n = 1000
+    names = [f'u{i}' for i in range(10)]
+    codes = rng.integers(0, len(names), n)
+    created_at = to_micros(START) + np.sort(rng.integers(0, 30 * 86_400_000_000, n))
+    emotion = rng.integers(0, 101, n)
+
+    incremental = TrendEngine(capacity=2)
+    for code, x, at in zip(codes, emotion, created_at, strict=True):
+        incremental.update(names[code], float(x), int(at))
+    # 2回に分けて取り込んでも同じになる
+    backfilled = TrendEngine(capacity=2)
+    backfilled.backfill(codes[:400], names, emotion[:400], created_at[:400])
+    backfilled.backfill(codes[400:], names, emotion[400:], created_at[400:])
+
+    for name in names:
+        expected, actual = incremental.snapshot(name), backfilled.snapshot(name)
+        assert (actual.count, actual.window_count) == (expected.count, expected.window_count)
+        assert np.isclose(actual.window_mean, expected.window_mean)
+        assert np.isclose(actual.window_std, expected.window_std)
+        assert np.isclose(actual.ewma_short, expected.ewma_short)
+        assert np.isclose(actual.ewma_long, expected.ewma_long)
+
+
+def test_state_survives_restart_and_backfills_from_store(tmp_path):
+    store = ConversationStore(tmp_path / 'store')
+    for day, emotion in enumerate([70, 60, 20]):
+        conversation = Conversation(
+            category='相談',
+            purpose='',
+            discourse_analysis='',
+            text='',
+            keywords=[],
+            created_at=START + timedelta(days=day),
+            emotion_fluctuation=emotion,
+        )
+        store.append([conversation], user='u1')
+        store.append([conversation.model_copy(update={'emotion_fluctuation': 90})], user='u2')
+
+    engine = TrendEngine()
+    engine.backfill_store(store, user='u1')
+    assert engine.users == ['u1']
+    engine.save(tmp_path / 'trend.npz')
+
+    restored = TrendEngine.load(tmp_path / 'trend.npz')
+    assert restored.snapshot('u1') == engine.snapshot('u1')
+    later = START + timedelta(days=3)
+    assert restored.update('u1', 10, later) == engine.update('u1', 10, later)
+    assert restored.snapshot('u1').window_mean == 40
+
+    # ストアの列の値(np.int64)をそのまま渡せる
+    created_at = store.column('created_at')
+    assert isinstance(created_at[-1], np.integer)
+    assert restored.update('u2', 90, created_at[-1]).count == 1
@@ -0,0 +1,108 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.pregel import RetryPolicy
+from typing_extensions import TypedDict
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph import plan_and_execute
+from src.graph.instrumentation import GraphMetrics, Histogram, instrument
+from src.graph.tool_calling import add, build_agent
+
+
+def _react_model(handler=None) -> ScriptedChatModel:
+    def respond(messages):
+        if isinstance(messages[-1], ToolMessage):
+            return '7です'
+        return AIMessage(content='', tool_calls=[{'name': 'add', 'args': {'a': 3, 'b': 4}, 'id': 'call_1'}])
+
+    return ScriptedChatModel(responses=[respond], callbacks=[handler] if handler is not None else None)
+
+
+def test_react_agent_records_nodes_llm_and_tools():
+    metrics = GraphMetrics()
+    agent = instrument(build_agent(_react_model(), tools=[add]), metrics, 'react', callbacks=True)
+    # コールバックを付けても、コンパイルしたグラフのクラスのまま返る
+    assert isinstance(agent, CompiledStateGraph)
+    for _ in range(3):
+        agent.invoke({'messages': ['3 + 4の計算結果は？']})
+
+    summary = metrics.summary()['react']
+    assert summary['agent']['wall_seconds']['count'] == 6
+    assert summary['agent']['llm_seconds']['count'] == 6
+    assert summary['agent']['prompt_tokens'] > 0
+    assert summary['tools']['wall_seconds']['count'] == 3
+    assert summary['tools']['tool_seconds']['count'] == 3
+    assert summary['tools']['llm_seconds']['count'] == 0
+
+
+def test_model_level_handler_attributes_to_top_level_node():
+    metrics = GraphMetrics()
+    handler = metrics.handler('plan')
+    app = plan_and_execute.build_app(
+        planner=plan_and_execute.build_planner(
+            ScriptedChatModel(responses=[plan_and_execute.Plan(steps=['足し算する'])], callbacks=[handler])
+        ),
+        replanner=plan_and_execute.build_replanner(
+            ScriptedChatModel(
+                responses=[plan_and_execute.Act(action=plan_and_execute.Response(response='7'))],
+                callbacks=[handler],
+            )
+        ),
+        agent_executor=plan_and_execute.build_agent_executor(_react_model(handler), tools=[add]),
+    )
+    result = asyncio.run(instrument(app, metrics, 'plan').ainvoke({'input': '3 + 4は？'}))
+    assert result['response'] == '7'
+
+    summary = metrics.summary()
+    # react agentの中のLLM呼び出しは、サブグラフのノード名ではなくトップレベルのagentに集計される
+    assert set(summary['plan']) == {'planner', 'agent', 'replan'}
+    assert summary['plan']['agent']['llm_seconds']['count'] == 2
+    assert summary['plan']['agent']['completion_tokens'] > 0
+    assert summary['plan']['planner']['llm_seconds']['count'] == 1
+
+
+class CounterState(TypedDict):
+    count: int
+
+
+def test_retries_errors_and_state_access():
+    attempts = {'n': 0}
+
+    def flaky(state: CounterState):
+        attempts['n'] += 1
+        if attempts['n'] < 3:
+            raise ValueError('temporary')
+        return {'count': state['count'] + 1}
+
+    builder = StateGraph(CounterState)
+    builder.add_node('flaky', flaky, retry=RetryPolicy(initial_interval=0.001, jitter=False, retry_on=ValueError))
+    builder.add_edge(START, 'flaky')
+    builder.add_edge('flaky', END)
+    metrics = GraphMetrics()
+    graph = instrument(builder.compile(checkpointer=MemorySaver()), metrics, 'counter')
+
+    config = {'configurable': {'thread_id': '1'}}
+    assert graph.invoke({'count': 0}, config) == {'count': 1}
+    assert graph.get_state(config).values == {'count': 1}
+    flaky_metrics = metrics.summary()['counter']['flaky']
+    assert flaky_metrics['retries'] == 2
+    assert flaky_metrics['errors'] == 2
+    assert flaky_metrics['wall_seconds']['count'] == 3
+
+    text = metrics.to_prometheus()
+    assert '# TYPE graph_node_duration_seconds histogram' in text
+    assert 'graph_node_duration_seconds_bucket{graph="counter",node="flaky",le="+Inf"} 3' in text
+    assert 'graph_node_retries_total{graph="counter",node="flaky"} 2' in text
+
+
+def test_histogram_quantile():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in [0.5] * 50 + [3.0] * 50:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.0
+    assert 2.0 < histogram.quantile(0.99) <= 4.0
+    assert histogram.counts == [50, 0, 50, 0]
@@ -0,0 +1,108 @@
+import pytest
+from langchain_core.messages import AIMessage
+from langgraph.store.base import PutOp
+from langgraph.store.memory import InMemoryStore
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.memory_index import HashingEmbedder, IndexedMemoryStore, VectorIndex
+from src.graph.store import build_graph
+from src.graph.write_behind_store import WriteBehindStore
+
+NAMESPACE = ('memories', '1')
+
+
+def _store(**kwargs) -> IndexedMemoryStore:
+    store = IndexedMemoryStore(InMemoryStore(), **kwargs)
+    store.put(NAMESPACE, 'name', {'data': 'User name is Bob'})
+    store.put(NAMESPACE, 'food', {'data': '好きな食べ物はカレーライス'})
+    store.put(NAMESPACE, 'city', {'data': 'Lives in Tokyo near the station'})
+    return store
+
+
+def test_search_top_k_ranks_relevant_memory_first():
+    store = _store()
+    assert store.search_top_k(NAMESPACE, 'What is my name?', k=1)[0].key == 'name'
+    assert store.search_top_k(NAMESPACE, 'カレーは好き？', k=1)[0].key == 'food'
+    assert len(store.search_top_k(NAMESPACE, 'tokyo', k=10)) == 3
+
+
+def test_max_items_evicts_oldest_from_store_and_index():
+    store = _store(max_items=2)
+    assert store.get(NAMESPACE, 'name') is None
+    assert {item.key for item in store.search_top_k(NAMESPACE, 'name', k=5)} == {'food', 'city'}
+    assert len(store.indexes[NAMESPACE]) == 2
+
+
+def test_delete_removes_from_index():
+    store = _store()
+    store.delete(NAMESPACE, 'food')
+    assert 'food' not in [item.key for item in store.search_top_k(NAMESPACE, 'カレー', k=5)]
+
+
+def test_index_is_rebuilt_from_store_after_restart():
+    backing = _store(max_items=3).store
+    restarted = IndexedMemoryStore(backing, max_items=3)
+    assert restarted.search_top_k(NAMESPACE, 'What is my name?', k=1)[0].key == 'name'
+    # 作り直した索引でも古い順に削除する
+    restarted.put(NAMESPACE, 'job', {'data': 'Works as a nurse'})
+    assert backing.get(NAMESPACE, 'name') is None
+    assert len(restarted.indexes[NAMESPACE]) == 3
+
+
+def test_index_is_not_updated_when_store_write_fails():
+    class FailingStore(InMemoryStore):
+        def batch(self, ops):
+            ops = list(ops)
+            if any(isinstance(op, PutOp) for op in ops):
+                raise OSError('disk full')
+            return super().batch(ops)
+
+    store = IndexedMemoryStore(FailingStore())
+    with pytest.raises(OSError):
+        store.put(NAMESPACE, 'name', {'data': 'User name is Bob'})
+    assert store.search_top_k(NAMESPACE, 'name', k=5) == []
+    assert len(store.indexes[NAMESPACE]) == 0
+
+
+def test_vector_index_grows_and_swaps_on_remove():
+    embedder = HashingEmbedder(dim=16)
+    index = VectorIndex(16, capacity=1)
+    vectors = embedder.embed(['a', 'b', 'c'])
+    for key, vector in zip('abc', vectors, strict=True):
+        index.add(key, vector)
+    index.remove('a')
+    assert index.top_k(vectors[2], 1) == ['c']
+    assert sorted(index.keys) == ['b', 'c']
+
+
+def test_call_model_uses_top_k_memories():
+    prompts = []
+
+    def respond(messages):
+        prompts.append(messages[0].content)
+        return AIMessage(content='ok')
+
+    graph = build_graph(model=ScriptedChatModel(responses=[respond]), store=_store())
+    config = {'configurable': {'thread_id': '1', 'user_id': '1', 'memory_top_k': 1}}
+    graph.invoke({'messages': [('user', 'What is my name?')]}, config)
+
+    assert 'Bob' in prompts[0]
+    assert 'カレー' not in prompts[0]
+
+
+def test_call_model_uses_top_k_through_write_behind_store():
+    prompts = []
+
+    def respond(messages):
+        prompts.append(messages[0].content)
+        return AIMessage(content='ok')
+
+    with WriteBehindStore(_store(), flush_interval=60) as store:
+        store.put(NAMESPACE, 'pet', {'data': 'Has a cat named Tama'})
+        graph = build_graph(model=ScriptedChatModel(responses=[respond]), store=store)
+        config = {'configurable': {'thread_id': '1', 'user_id': '1', 'memory_top_k': 1}}
+        graph.invoke({'messages': [('user', 'What is my pet cat Tama doing?')]}, config)
+
+    # まだ書き込んでいなかった記憶も、索引を使った上位k件の検索で見つかる
+    assert 'Tama' in prompts[0]
+    assert 'Bob' not in prompts[0]
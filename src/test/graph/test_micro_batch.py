@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import Memory, build_memory_chain
+from src.graph.memory import build_graph
+from src.graph.micro_batch import MicroBatcher
+
+
+def _remember(messages):
+    # プロンプトの最後に入っている会話をそのままキーワードとして返す
+    return Memory(memory_needs=True, keywords=[messages[-1].content.split()[-1]], reason='理由')
+
+
+def test_concurrent_chain_calls_are_batched_and_routed_back():
+    llm = ScriptedChatModel(responses=[_remember])
+    batcher = MicroBatcher(max_batch_size=4, window=0.05)
+    chain = build_memory_chain(llm, batcher=batcher)
+
+    async def main():
+        return await asyncio.gather(*(chain.ainvoke({'messages': f'会話{i}'}) for i in range(10)))
+
+    results = asyncio.run(main())
+    assert [r.keywords for r in results] == [[f'会話{i}'] for i in range(10)]
+    summary = batcher.summary()
+    assert summary['batches'] == 3
+    assert summary['full_batches'] == 2
+    assert summary['calls'] == llm.call_count == 10
+
+
+def test_threads_share_a_batch_for_call_model():
+    llm = ScriptedChatModel(responses=[lambda messages: AIMessage(content=f'{messages[-1].content}への回答')])
+    batcher = MicroBatcher(max_batch_size=8, window=0.1)
+    graph = build_graph(llm, batcher=batcher)
+
+    def ask(i: int) -> str:
+        state = graph.invoke({'messages': [('user', f'質問{i}')]}, {'configurable': {'thread_id': str(i)}})
+        return state['messages'][-1].content
+
+    with ThreadPoolExecutor(4) as pool:
+        answers = list(pool.map(ask, range(4)))
+
+    assert answers == [f'質問{i}への回答' for i in range(4)]
+    assert batcher.summary()['batches'] == 1
+    assert batcher.summary()['added_latency']['count'] == 4
+
+
+def test_error_is_returned_only_to_its_caller():
+    def respond(messages):
+        if messages[-1].content.split()[-1] == '失敗':
+            raise ValueError('失敗しました')
+        return _remember(messages)
+
+    chain = build_memory_chain(ScriptedChatModel(responses=[respond]), batcher=MicroBatcher(window=0.05))
+
+    async def main():
+        return await asyncio.gather(
+            chain.ainvoke({'messages': '会話'}), chain.ainvoke({'messages': '失敗'}), return_exceptions=True
+        )
+
+    ok, error = asyncio.run(main())
+    assert ok.keywords == ['会話']
+    assert isinstance(error, ValueError)
+    with pytest.raises(ValueError):
+        chain.invoke({'messages': '失敗'})
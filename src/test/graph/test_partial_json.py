@@ -0,0 +1,74 @@
+import asyncio
+import json
+import random
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import Conversation, ConversationClassification, build_stream_chain
+from src.graph.partial_json import JsonStreamScanner
+
+
+def test_scanner_returns_string_values_by_path_across_chunks():
+    doc = {'action': {'response': 'パリ"です"\n😀', 'steps': ['a', 'b,c]'], 'n': 1}, 'z': None}
+    text = json.dumps(doc)
+    rng = random.Random(0)
+    for _ in range(50):
+        scanner = JsonStreamScanner()
+        values: dict = {}
+        i = 0
+        while i < len(text):
+            size = rng.randint(1, 4)
+            for path, fragment in scanner.feed(text[i : i + size]):
+                values[path] = values.get(path, '') + fragment
+            i += size
+        assert values == {
+            ('action', 'response'): doc['action']['response'],
+            ('action', 'steps', 0): 'a',
+            ('action', 'steps', 1): 'b,c]',
+        }
+        assert scanner.depth == 0
+
+
+def test_scanner_yields_partial_string_before_it_closes():
+    scanner = JsonStreamScanner()
+    assert scanner.feed('{"action": {"respon') == []
+    assert scanner.feed('se": "東京で') == [(('action', 'response'), '東京で')]
+    assert scanner.feed('す"}}') == [(('action', 'response'), 'す')]
+
+
+def test_scanner_takes_array_items_as_they_close():
+    scanner = JsonStreamScanner(items=('conversations',))
+    scanner.feed('{"meta": {"conversations": [{"x": 1}]}, "conversations": [{"text": "a}", "k": [{}]}, {"te')
+    assert scanner.take_items() == [{'text': 'a}', 'k': [{}]}]
+    scanner.feed('xt": "b"}]}')
+    assert scanner.take_items() == [{'text': 'b'}]
+    assert scanner.take_items() == []
+
+
+def test_stream_chain_yields_each_conversation_before_generation_ends():
+    result = ConversationClassification(
+        conversations=[
+            Conversation(
+                category='雑談',
+                purpose=f'目的 {i}',
+                discourse_analysis='',
+                text='今日はいい天気だね',
+                keywords=['天気'],
+                emotion_fluctuation=i,
+            )
+            for i in range(4)
+        ]
+    )
+    llm = ScriptedChatModel(responses=[result], chunk_size=16, token_latency=0.005)
+
+    async def collect():
+        start = time.perf_counter()
+        arrivals = []
+        async for conversation in build_stream_chain(llm).astream({'messages': [('human', '今日はいい天気だね')]}):
+            arrivals.append((time.perf_counter() - start, conversation))
+        return arrivals, time.perf_counter() - start
+
+    arrivals, total = asyncio.run(collect())
+    assert [c for _, c in arrivals] == result.conversations
+    # 最初の会話は、生成全体の前半で届く
+    assert arrivals[0][0] < total / 2
@@ -0,0 +1,277 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.plan_and_execute import (
+    ACT_SCHEMA,
+    Act,
+    Plan,
+    Response,
+    StreamMetrics,
+    build_app,
+    build_planner,
+    build_replanner,
+    estimate_tokens,
+    ready_steps,
+    render_digest,
+    speculation_summary,
+    stream_response,
+    update_digest,
+)
+
+
+def _fake_app(plan: Plan, delay: float = 0.0):
+    calls = {'agent': 0, 'replan': 0}
+
+    async def agent(inputs):
+        calls['agent'] += 1
+        await asyncio.sleep(delay)
+        return {'messages': [AIMessage(content=f'done {calls["agent"]}')]}
+
+    async def replanner(state):
+        calls['replan'] += 1
+        return Act(action=Response(response=f'{len(state["past_steps"])} steps'))
+
+    app = build_app(
+        planner=RunnableLambda(lambda _: plan),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+    return app, calls
+
+
+def test_ready_steps_sequential_without_dependencies():
+    assert ready_steps(['a', 'b', 'c'], []) == [0]
+
+
+def test_ready_steps_with_dependencies():
+    assert ready_steps(['a', 'b', 'c'], [[], [], [1, 2]]) == [0, 1]
+    # 循環している場合は先頭から進める
+    assert ready_steps(['a', 'b'], [[2], [1]]) == [0]
+
+
+def test_independent_steps_run_in_one_wave():
+    plan = Plan(steps=['a', 'b', 'c', 'd'], dependencies=[[], [], [], []])
+    app, calls = _fake_app(plan, delay=0.2)
+
+    start = time.perf_counter()
+    result = asyncio.run(app.ainvoke({'input': 'q'}))
+    elapsed = time.perf_counter() - start
+
+    assert result['response'] == '4 steps'
+    assert calls == {'agent': 4, 'replan': 1}
+    assert elapsed < 0.2 * 4
+
+
+def test_max_parallel_steps_caps_concurrency_within_a_wave():
+    running = [0, 0]
+
+    async def agent(inputs):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+        return {'messages': [AIMessage(content='done')]}
+
+    async def replanner(state):
+        return Act(action=Response(response=f'{len(state["past_steps"])} steps'))
+
+    app = build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=['a', 'b', 'c'], dependencies=[[], [], []])),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+
+    config = {'configurable': {'max_parallel_steps': 2}}
+    result = asyncio.run(app.ainvoke({'input': 'q'}, config))
+
+    # 上限を超えたステップも同じwaveで空きを待って実行し、replanを待たない
+    assert result['response'] == '3 steps'
+    assert running[1] == 2
+
+    async def run_two():
+        return await asyncio.gather(app.ainvoke({'input': 'q'}, config), app.ainvoke({'input': 'q'}, config))
+
+    # 同時に動く別の実行のステップは、互いの上限に数えない
+    running[1] = 0
+    assert [result['response'] for result in asyncio.run(run_two())] == ['3 steps', '3 steps']
+    assert running[1] == 4
+
+
+def test_empty_plan_from_planner_goes_to_replanner():
+    app, calls = _fake_app(Plan(steps=[]))
+
+    result = asyncio.run(app.ainvoke({'input': 'q'}))
+
+    assert result['response'] == '0 steps'
+    assert calls == {'agent': 0, 'replan': 1}
+
+
+def test_empty_plan_from_replanner_ends_with_a_response():
+    app = build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=['a'])),
+        replanner=RunnableLambda(lambda _: Act(action=Plan(steps=[]))),
+        agent_executor=RunnableLambda(lambda _: {'messages': [AIMessage(content='aの結果')]}),
+    )
+
+    result = asyncio.run(app.ainvoke({'input': 'q'}))
+
+    assert result['plan'] == []
+    assert result['response'].endswith('1. a: aの結果')
+
+
+def _run_sequential(steps: int, config: dict) -> dict:
+    plan = Plan(steps=[f'step {i}' for i in range(steps)])
+    done = []
+
+    async def agent(inputs):
+        done.append(1)
+        return {'messages': [AIMessage(content='結果' * 200)]}
+
+    async def replanner(inputs):
+        remaining = plan.steps[len(done) :]
+        if not remaining:
+            return Act(action=Response(response='ok'))
+        return Act(action=Plan(steps=remaining))
+
+    app = build_app(
+        planner=RunnableLambda(lambda _: plan),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+    return asyncio.run(app.ainvoke({'input': 'q'}, config={'recursion_limit': 100, **config}))
+
+
+def test_update_digest_is_incremental_and_bounded():
+    steps = [(f'step {i}', 'a' * 400) for i in range(10)]
+    digest = update_digest(None, steps[:3], token_budget=200)
+    assert digest['digested'] == 3
+    digest = update_digest(digest, steps, token_budget=200)
+    assert digest['digested'] == 10
+    assert sum(digest['line_tokens']) <= 200
+    assert digest['evicted'] > 0
+    assert estimate_tokens(render_digest(digest)) <= 200 + 20
+
+
+def test_past_steps_token_budget_keeps_replan_prompt_flat():
+    full = _run_sequential(12, {})
+    compact = _run_sequential(12, {'configurable': {'past_steps_token_budget': 600}})
+
+    assert full['response'] == compact['response'] == 'ok'
+    assert len(full['replan_prompt_tokens']) == len(compact['replan_prompt_tokens']) == 12
+    # 全展開ではステップごとに結果の分(400トークン)ずつ増えるが、要約モードでは予算内で頭打ちになる
+    assert full['replan_prompt_tokens'][-1] - full['replan_prompt_tokens'][0] >= 11 * 400
+    assert max(compact['replan_prompt_tokens']) - compact['replan_prompt_tokens'][0] <= 600
+
+
+def test_stream_response_forwards_final_answer_tokens():
+    answer = '2024年のオリンピックは「パリ」で開催されました。\n詳細は"公式サイト"を参照してください。'
+    replanner_llm = ScriptedChatModel(
+        responses=[Act(action=Plan(steps=['確認する'])), Act(action=Response(response=answer))],
+        chunk_size=3,
+        token_latency=0.002,
+    )
+    app = build_app(
+        planner=build_planner(ScriptedChatModel(responses=[Plan(steps=['調べる'])], chunk_size=3)),
+        replanner=build_replanner(replanner_llm),
+        agent_executor=RunnableLambda(lambda _: {'messages': [AIMessage(content='パリ')]}),
+    )
+
+    async def collect():
+        metrics = StreamMetrics()
+        chunks = [text async for text in stream_response(app, {'input': 'q'}, metrics=metrics)]
+        return chunks, metrics
+
+    chunks, metrics = asyncio.run(collect())
+    # 計画を更新したreplanの出力は流れず、最終回答だけが分割されて届く
+    assert ''.join(chunks) == answer
+    assert len(chunks) > 10
+    assert metrics.chars == len(answer)
+    assert 0 < metrics.ttft_seconds < metrics.ttlt_seconds <= metrics.total_seconds
+
+
+def _objects(schema):
+    if isinstance(schema, dict):
+        if 'properties' in schema:
+            yield schema
+        for value in schema.values():
+            yield from _objects(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            yield from _objects(value)
+
+
+def test_act_schema_is_valid_for_strict_mode():
+    # strictでは全てのobjectで、全てのpropertyがrequiredに入っていて、追加のpropertyを許さない必要がある
+    objects = list(_objects(ACT_SCHEMA['parameters']))
+    assert len(objects) == 3
+    for schema in objects:
+        assert sorted(schema['required']) == sorted(schema['properties'])
+        assert schema['additionalProperties'] is False
+    assert ACT_SCHEMA['strict'] is True
+
+
+def _speculative_app(steps: list[str], revise: dict[str, str], delay: float):
+    """
+    replannerは完了したステップを除くだけだが、reviseにあるステップは次のステップを別のものに差し替える
+    """
+    executed = []
+
+    async def agent(inputs):
+        task = inputs['messages'][0][1].rsplit(': ', 1)[1].rstrip('.')
+        await asyncio.sleep(delay)
+        executed.append(task)
+        return {'messages': [AIMessage(content=f'{task}の結果')]}
+
+    async def replanner(inputs):
+        await asyncio.sleep(delay)
+        done = [task for task, _ in inputs['past_steps']]
+        remaining = [step for step in inputs['plan'] if step not in done]
+        if done[-1] in revise:
+            remaining = [revise[done[-1]]] + remaining[1:]
+        if not remaining:
+            return Act(action=Response(response=' → '.join(done)))
+        return Act(action=Plan(steps=remaining))
+
+    app = build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=steps)),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+    return app, executed
+
+
+def _timed_run(app, speculative: bool) -> tuple[dict, float]:
+    start = time.perf_counter()
+    result = asyncio.run(app.ainvoke({'input': 'q'}, config={'configurable': {'speculative': speculative}}))
+    return result, time.perf_counter() - start
+
+
+def test_speculative_steps_overlap_with_replan():
+    steps = ['a', 'b', 'c', 'd']
+    serial, serial_seconds = _timed_run(_speculative_app(steps, {}, 0.05)[0], speculative=False)
+    app, executed = _speculative_app(steps, {}, 0.05)
+    result, seconds = _timed_run(app, speculative=True)
+
+    assert result['response'] == serial['response'] == 'a → b → c → d'
+    assert result['past_steps'] == serial['past_steps']
+    assert executed == steps
+    summary = speculation_summary(result['speculation'])
+    assert summary['speculated'] == summary['hits'] == 3
+    assert summary['saved_seconds'] > 0.1
+    assert seconds < serial_seconds - 0.1
+
+
+def test_mispredicted_speculation_is_discarded():
+    app, executed = _speculative_app(['a', 'b', 'c'], {'a': 'b2'}, 0.02)
+    result, _ = _timed_run(app, speculative=True)
+
+    # aの後にbを先に実行し始めるが、計画がb2に変わったのでbの結果は捨てる
+    assert result['response'] == 'a → b2 → c'
+    assert [task for task, _ in result['past_steps']] == ['a', 'b2', 'c']
+    assert executed[:2] == ['a', 'b']
+    assert [(r['step'], r['hit']) for r in result['speculation']] == [('b', False), ('c', True)]
+    assert result['speculation'][0]['wasted_seconds'] > 0
@@ -0,0 +1,30 @@
+import pytest
+
+from src.graph import registry
+
+
+def test_get_graph_builds_once_and_caches():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    registry.register('test_graph', factory)
+    try:
+        graph = registry.get_graph('test_graph')
+        assert registry.get_graph('test_graph') is graph
+        assert len(calls) == 1
+    finally:
+        registry.GRAPH_FACTORIES.pop('test_graph')
+        registry.clear_cache('test_graph')
+
+
+def test_get_graph_resolves_import_path():
+    graph = registry.get_graph('state_manage')
+    assert set(graph.nodes) >= {'node1', 'node2', 'node3'}
+
+
+def test_get_graph_unknown_name():
+    with pytest.raises(KeyError):
+        registry.get_graph('unknown')
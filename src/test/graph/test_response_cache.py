@@ -0,0 +1,69 @@
+import asyncio
+
+from langchain_core.messages import HumanMessage
+from langchain_core.prompt_values import ChatPromptValue
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.conversation_classification import Memory, build_memory_chain
+from src.graph.response_cache import LRUCacheTier, ResponseCache, SQLiteCacheTier, build_response_cache, cache_key
+
+MEMORY = Memory(memory_needs=True, keywords=['天気'], reason='前回の話題')
+
+
+def test_lru_tier_evicts_by_size_and_ttl():
+    now = [0.0]
+    tier = LRUCacheTier(max_size=2, ttl=10, clock=lambda: now[0])
+    tier.set('a', '1')
+    tier.set('b', '2')
+    tier.get('a')
+    tier.set('c', '3')
+    assert tier.get('b') is None
+    assert tier.get('a') == '1'
+
+    now[0] = 11
+    assert tier.get('a') is None
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    SQLiteCacheTier(path).set('a', '1')
+    assert SQLiteCacheTier(path).get('a') == '1'
+
+
+def test_cached_chain_returns_model_and_counts_hits():
+    llm = ScriptedChatModel(responses=[MEMORY])
+    cache = build_response_cache()
+    chain = build_memory_chain(llm, cache=cache)
+
+    first = chain.invoke({'messages': 'こんにちは'})
+    second = asyncio.run(chain.ainvoke({'messages': 'こんにちは'}))
+    chain.invoke({'messages': 'こんばんは'})
+
+    assert first == second == MEMORY
+    assert isinstance(second, Memory)
+    assert llm.call_count == 2
+    summary = cache.stats.summary()
+    assert summary['hits'] == {'memory': 1}
+    assert summary['misses'] == 2
+
+
+def test_sqlite_hit_is_promoted_to_memory(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    build_memory_chain(ScriptedChatModel(responses=[MEMORY]), cache=build_response_cache(path)).invoke(
+        {'messages': 'a'}
+    )
+
+    llm = ScriptedChatModel(responses=[MEMORY])
+    cache = ResponseCache([LRUCacheTier(), SQLiteCacheTier(path)])
+    chain = build_memory_chain(llm, cache=cache)
+    chain.invoke({'messages': 'a'})
+    chain.invoke({'messages': 'a'})
+
+    assert llm.call_count == 0
+    assert cache.stats.hits == {'sqlite': 1, 'memory': 1}
+
+
+def test_schema_is_part_of_key():
+    prompt_value = ChatPromptValue(messages=[HumanMessage(content='a')])
+    assert cache_key('gpt-4o', prompt_value, 'Memory') != cache_key('gpt-4o', prompt_value, 'ReplyConversation')
+    assert cache_key('gpt-4o', prompt_value, 'Memory') != cache_key('gpt-4o-mini', prompt_value, 'Memory')
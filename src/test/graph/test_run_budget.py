@@ -0,0 +1,127 @@
+import asyncio
+import time
+import warnings
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.plan_and_execute import Act, Plan, Response, build_app, build_planner, build_replanner, partial_response
+from src.graph.run_budget import RunBudget, run_with_budget
+from src.graph.tool_calling import add, build_agent
+
+
+def _slow_plan_app(steps: int, delay: float):
+    async def agent(inputs):
+        await asyncio.sleep(delay)
+        return {'messages': [AIMessage(content='結果')]}
+
+    async def replanner(inputs):
+        done = {task for task, _ in inputs['past_steps']}
+        remaining = [step for step in inputs['plan'] if step not in done]
+        if not remaining:
+            return Act(action=Response(response='完了'))
+        return Act(action=Plan(steps=remaining))
+
+    return build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=[f'step {i}' for i in range(steps)])),
+        replanner=RunnableLambda(replanner),
+        agent_executor=RunnableLambda(agent),
+    )
+
+
+def _run(app, budget, **kwargs):
+    config = {'recursion_limit': 100, 'configurable': {'budget': budget}}
+    return asyncio.run(run_with_budget(app, {'input': 'q'}, config, **kwargs))
+
+
+def test_deadline_cancels_and_returns_partial_response():
+    start = time.perf_counter()
+    result = _run(_slow_plan_app(10, 0.1), RunBudget(deadline_seconds=0.25), partial_response=partial_response)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.35
+    assert result['budget']['exceeded'] == 'deadline'
+    assert [task for task, _ in result['past_steps']] == ['step 0', 'step 1']
+    assert result['response'].endswith('1. step 0: 結果\n2. step 1: 結果')
+
+
+def test_finishes_normally_within_budget():
+    result = _run(
+        _slow_plan_app(2, 0), {'deadline_seconds': 5, 'max_tokens': 10_000}, partial_response=partial_response
+    )
+    assert result['response'] == '完了'
+    assert result['budget']['exceeded'] is None
+
+
+def test_token_budget_stops_before_the_next_step():
+    # replannerは何度でも同じ計画を返すので、予算が無ければrecursion_limitまで続く
+    replanner_llm = ScriptedChatModel(responses=[Act(action=Plan(steps=['もう一度調べる']))])
+    app = build_app(
+        planner=build_planner(ScriptedChatModel(responses=[Plan(steps=['調べる'])])),
+        replanner=build_replanner(replanner_llm),
+        agent_executor=RunnableLambda(lambda _: {'messages': [AIMessage(content='パリ')]}),
+    )
+    result = _run(app, RunBudget(max_tokens=3000), partial_response=partial_response)
+
+    assert result['budget']['exceeded'] == 'tokens'
+    assert 3000 < result['budget']['tokens'] < 4000
+    assert 1 <= replanner_llm.call_count < 10
+    assert result['response'].splitlines()[1] == '1. 調べる: パリ'
+
+
+def test_tool_call_budget_stops_a_looping_agent():
+    def respond(messages):
+        return AIMessage(content='', tool_calls=[{'name': 'add', 'args': {'a': 1, 'b': 2}, 'id': 'call_1'}])
+
+    agent = build_agent(ScriptedChatModel(responses=[respond]), tools=[add])
+    result = asyncio.run(
+        run_with_budget(
+            agent,
+            {'messages': ['1 + 2を繰り返して']},
+            {'recursion_limit': 1000, 'configurable': {'budget': RunBudget(max_tool_calls=3)}},
+            partial_response=lambda state: f'{len(state["messages"])}件のメッセージで中断',
+        )
+    )
+    assert result['budget']['exceeded'] == 'tool_calls'
+    assert result['budget']['tool_calls'] == 4
+    assert result['response'].endswith('件のメッセージで中断')
+
+
+def test_budget_outside_run_with_budget_warns():
+    config = {'configurable': {'budget': RunBudget(max_tokens=10)}}
+    with pytest.warns(RuntimeWarning, match='only enforced by run_with_budget'):
+        result = asyncio.run(_slow_plan_app(1, 0).ainvoke({'input': 'q'}, config))
+    assert result['response'] == '完了'
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        _run(_slow_plan_app(1, 0), RunBudget(max_tokens=10_000), partial_response=partial_response)
+
+
+def test_outer_cancellation_is_not_reported_as_deadline():
+    async def slow_cleanup(inputs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # キャンセルされてから止まるまでに時間がかかるノード
+            await asyncio.sleep(0.2)
+            raise
+
+    app = build_app(
+        planner=RunnableLambda(lambda _: Plan(steps=['a'])),
+        replanner=RunnableLambda(lambda _: Act(action=Response(response='完了'))),
+        agent_executor=RunnableLambda(slow_cleanup),
+    )
+
+    async def main():
+        config = {'configurable': {'budget': RunBudget(deadline_seconds=0.05)}}
+        task = asyncio.create_task(run_with_budget(app, {'input': 'q'}, config, partial_response=partial_response))
+        # 予算で止めたグラフの後始末を待っている間に、呼び出し側がキャンセルする
+        await asyncio.sleep(0.15)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel
+
+from src.graph.search_cache import SearchCache, normalize_query
+
+
+class SearchInput(BaseModel):
+    query: str
+
+
+class FakeSearch(BaseTool):
+    name: str = 'fake_search'
+    description: str = '検索する'
+    args_schema: type[BaseModel] = SearchInput
+    latency: float = 0.05
+    calls: int = 0
+
+    def _run(self, query: str, **kwargs) -> list[dict]:
+        self.calls += 1
+        time.sleep(self.latency)
+        if query == 'fail':
+            return "HTTPError('429 Too Many Requests')"
+        return [{'url': 'https://example.com', 'content': f'{query}の結果'}]
+
+    async def _arun(self, query: str, **kwargs) -> list[dict]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [{'url': 'https://example.com', 'content': f'{query}の結果'}]
+
+
+def test_normalize_query():
+    assert normalize_query('  Paris  Olympics？') == normalize_query('paris olympics') == 'paris olympics'
+    assert normalize_query('ＡＢＣ　２０２４') == 'abc 2024'
+
+
+def test_concurrent_identical_queries_search_once():
+    fake = FakeSearch()
+    cache = SearchCache()
+    search = cache.wrap(fake)
+    assert search.name == 'fake_search'
+    assert search.args == fake.args
+
+    async def run():
+        queries = ['Paris Olympics', 'paris olympics?', ' PARIS  OLYMPICS ', 'Tokyo']
+        return await asyncio.gather(*(search.ainvoke({'query': q}) for q in queries * 3))
+
+    results = asyncio.run(run())
+    assert results[0] == [{'url': 'https://example.com', 'content': 'Paris Olympicsの結果'}]
+    assert fake.calls == 2
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(lambda q: search.invoke({'query': q}), ['Tokyo', 'Kyoto', 'kyoto', 'KYOTO']))
+    assert fake.calls == 3
+
+    summary = cache.summary()
+    assert summary['misses'] == 3
+    assert summary['hits'] == {'inflight': 12, 'memory': 1}
+    assert summary['saved_seconds'] > 0
+
+
+def test_expires_after_ttl_and_does_not_cache_errors():
+    now = [0.0]
+    fake = FakeSearch(latency=0)
+    search = SearchCache(ttl=60, clock=lambda: now[0]).wrap(fake)
+
+    search.invoke({'query': 'Paris'})
+    search.invoke({'query': 'paris'})
+    assert fake.calls == 1
+    now[0] = 61
+    search.invoke({'query': 'paris'})
+    assert fake.calls == 2
+
+    assert search.invoke({'query': 'fail'}).startswith('HTTPError')
+    search.invoke({'query': 'fail'})
+    assert fake.calls == 4
+
+
+def test_waiting_calls_receive_the_leaders_exception():
+    class Broken(FakeSearch):
+        def _run(self, query: str, **kwargs):
+            self.calls += 1
+            time.sleep(self.latency)
+            raise RuntimeError('down')
+
+    broken = Broken()
+    search = SearchCache().wrap(broken)
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(search.invoke, {'query': 'Paris'}) for _ in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert broken.calls == 1
+
+
+def test_unserializable_result_releases_waiting_calls():
+    class Unserializable(FakeSearch):
+        def _run(self, query: str, **kwargs):
+            self.calls += 1
+            time.sleep(self.latency)
+            return {query}
+
+    fake = Unserializable(latency=0.1)
+    cache = SearchCache()
+    search = cache.wrap(fake)
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(search.invoke, {'query': 'Paris'}) for _ in range(2)]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(timeout=5))
+            except TypeError:
+                outcomes.append('TypeError')
+    # 検索した呼び出しは結果を受け取り、待っていた呼び出しは止まらずに例外を受け取る
+    assert sorted(map(str, outcomes)) == ['TypeError', "{'Paris'}"]
+    assert fake.calls == 1
+    assert cache._inflight == {}
+    assert search.invoke({'query': 'Paris'}, {'callbacks': None}) == {'Paris'}
+    assert fake.calls == 2
+
+
+def test_keeps_content_and_artifact():
+    class ArtifactSearch(FakeSearch):
+        response_format: str = 'content_and_artifact'
+
+        def _run(self, query: str, **kwargs):
+            self.calls += 1
+            if query == 'fail':
+                return "HTTPError('429 Too Many Requests')", {}
+            return [{'content': f'{query}の結果'}], {'query': query, 'results': []}
+
+    fake = ArtifactSearch(latency=0)
+    search = SearchCache().wrap(fake)
+    assert search.response_format == 'content_and_artifact'
+    call = {'type': 'tool_call', 'name': 'fake_search', 'args': {'query': 'Paris'}, 'id': '1'}
+    message = search.invoke(call)
+    # ToolNodeから呼んだ場合と同じく、contentはToolMessageにしたときの文字列になる
+    assert json.loads(message.content) == [{'content': 'Parisの結果'}]
+    assert message.artifact == {'query': 'Paris', 'results': []}
+    assert search.invoke({**call, 'id': '2', 'args': {'query': 'paris'}}).artifact == {'query': 'Paris', 'results': []}
+    assert search.invoke({'query': 'PARIS'}) == message.content
+    assert fake.calls == 1
+
+    search.invoke({'query': 'fail'})
+    search.invoke({'query': 'fail'})
+    assert fake.calls == 3
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.bench.serving import http_request
+from src.graph.memory import build_graph
+from src.graph.server import GraphServer, Overloaded
+
+
+def _server(latency: float = 0.0, **kwargs) -> GraphServer:
+    return GraphServer({'memory': build_graph(ScriptedChatModel(responses=['回答'], latency=latency))}, **kwargs)
+
+
+def _ask(content: str) -> dict:
+    return {'messages': [{'role': 'user', 'content': content}]}
+
+
+def test_same_thread_is_serialized_and_other_threads_run_in_parallel():
+    async def main():
+        async with _server(latency=0.1) as server:
+            start = time.perf_counter()
+            await asyncio.gather(*(server.invoke('memory', _ask(f'質問{i}'), thread_id=f't{i}') for i in range(4)))
+            parallel = time.perf_counter() - start
+
+            start = time.perf_counter()
+            await asyncio.gather(*(server.invoke('memory', _ask(f'質問{i}'), thread_id='same') for i in range(3)))
+            serialized = time.perf_counter() - start
+            state = await server.graphs['memory'].aget_state({'configurable': {'thread_id': 'same'}})
+            return parallel, serialized, state, len(server.locks)
+
+    parallel, serialized, state, locks = asyncio.run(main())
+    assert parallel < 0.2
+    assert serialized >= 0.3
+    # 3回の実行がそれぞれ前の実行の結果の上に積まれている
+    assert [m.content for m in state.values['messages']] == ['質問0', '回答', '質問1', '回答', '質問2', '回答']
+    assert locks == 0
+
+
+def test_rejects_requests_over_max_pending():
+    async def main():
+        async with _server(latency=0.1, max_workers=1, max_pending=2) as server:
+            results = await asyncio.gather(
+                *(server.invoke('memory', _ask('質問'), thread_id=f't{i}') for i in range(3)), return_exceptions=True
+            )
+            return results, server.summary()
+
+    results, summary = asyncio.run(main())
+    assert sum(isinstance(r, Overloaded) for r in results) == 1
+    assert summary['rejected'] == 1
+    assert summary['max_pending'] == 2
+    assert summary['latency']['count'] == 2
+
+
+def test_http_streams_ndjson_and_returns_final_state():
+    async def main():
+        async with _server() as server:
+            http = await server.serve_http()
+            reader, writer = await asyncio.open_connection('127.0.0.1', http.sockets[0].getsockname()[1])
+            try:
+                streamed = await http_request(
+                    reader, writer, 'POST', '/graphs/memory/threads/1/runs', {'input': _ask('質問'), 'stream': True}
+                )
+                final = await http_request(
+                    reader, writer, 'POST', '/graphs/memory/threads/1/runs', {'input': _ask('次')}
+                )
+                missing = await http_request(reader, writer, 'POST', '/graphs/unknown/runs', {'input': {}})
+                graphs = await http_request(reader, writer, 'GET', '/graphs')
+            finally:
+                writer.close()
+            return streamed, final, missing, graphs
+
+    streamed, final, missing, graphs = asyncio.run(main())
+    status, body = streamed
+    assert status == 200
+    chunks = [json.loads(line) for line in body.decode().splitlines()]
+    assert chunks[-1]['call_model']['messages']['content'] == '回答'
+
+    status, body = final
+    assert status == 200
+    assert [m['content'] for m in json.loads(body)['output']['messages']] == ['質問', '回答', '次', '回答']
+
+    assert missing[0] == 404
+    assert json.loads(graphs[1]) == {'graphs': ['memory']}
+
+
+def test_queue_timeout_rejects_requests_that_cannot_start():
+    async def main():
+        async with _server(latency=0.2, max_workers=1, queue_timeout=0.05) as server:
+            return await asyncio.gather(
+                server.invoke('memory', _ask('質問'), thread_id='a'),
+                server.invoke('memory', _ask('質問'), thread_id='b'),
+                return_exceptions=True,
+            )
+
+    first, second = asyncio.run(main())
+    assert first['messages'][-1].content == '回答'
+    assert isinstance(second, Overloaded)
+
+
+def test_close_restores_the_default_executor():
+    async def main():
+        async with _server() as server:
+            await server.invoke('memory', _ask('質問'), thread_id='1')
+        # 止めたワーカーのexecutorが既定のまま残っていると、to_threadが失敗する
+        return await asyncio.to_thread(lambda: 'ok')
+
+    assert asyncio.run(main()) == 'ok'
+
+
+def test_rejects_requests_that_are_not_objects(capsys):
+    async def main():
+        async with _server() as server:
+            http = await server.serve_http()
+            reader, writer = await asyncio.open_connection('127.0.0.1', http.sockets[0].getsockname()[1])
+            try:
+                responses = [
+                    await http_request(reader, writer, 'POST', '/graphs/memory/runs', payload)
+                    for payload in ([1], 'x', 1)
+                ]
+            finally:
+                writer.close()
+            await server._handle_stdio('[1]\n')
+            return responses
+
+    responses = asyncio.run(main())
+    # 不正な要求にも応答を返し、同じ接続で続けて要求できる
+    assert [status for status, _ in responses] == [400, 400, 400]
+    assert json.loads(capsys.readouterr().out) == {
+        'id': None,
+        'error': '要求はJSONのオブジェクトである必要があります',
+        'status': 400,
+    }
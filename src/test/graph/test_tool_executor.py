@@ -0,0 +1,98 @@
+import asyncio
+import gc
+import threading
+import time
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import tool
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.tool_calling import build_agent
+from src.graph.tool_executor import ParallelToolNode, local_tool
+
+
+@tool
+def lookup(key: str) -> str:
+    """時間のかかる検索"""
+    time.sleep(0.1)
+    return f'{key}の結果'
+
+
+@tool
+def hang(key: str) -> str:
+    """応答しない検索"""
+    time.sleep(0.5)
+    return key
+
+
+@local_tool
+@tool
+def whoami() -> str:
+    """実行したスレッドの名前を返す"""
+    return threading.current_thread().name
+
+
+def _calls(*names: str) -> dict:
+    tool_calls = [
+        {'name': name, 'args': {} if name == 'whoami' else {'key': str(i)}, 'id': f'call_{i}'}
+        for i, name in enumerate(names)
+    ]
+    return {'messages': [AIMessage(content='', tool_calls=tool_calls)]}
+
+
+def test_runs_tool_calls_concurrently_and_local_tools_inline():
+    node = ParallelToolNode([lookup, whoami])
+    for invoke in (node.invoke, lambda inputs: asyncio.run(node.ainvoke(inputs))):
+        start = time.perf_counter()
+        messages = invoke(_calls('lookup', 'lookup', 'lookup', 'whoami'))['messages']
+        assert time.perf_counter() - start < 0.25
+        assert [m.content for m in messages[:3]] == ['0の結果', '1の結果', '2の結果']
+        assert messages[3].content == threading.current_thread().name
+
+    summary = node.summary()
+    assert summary['lookup']['seconds']['count'] == 6
+    assert summary['whoami']['seconds']['count'] == 2
+
+
+def test_times_out_slow_tools_with_an_error_message():
+    node = ParallelToolNode([lookup, hang], timeouts={'hang': 0.05})
+    for invoke in (node.invoke, lambda inputs: asyncio.run(node.ainvoke(inputs))):
+        start = time.perf_counter()
+        messages = invoke(_calls('hang', 'lookup'))['messages']
+        assert time.perf_counter() - start < 0.3
+        assert isinstance(messages[0], ToolMessage)
+        assert messages[0].status == 'error'
+        assert 'timed out' in messages[0].content
+        assert messages[1].content == '1の結果'
+
+    assert node.summary()['hang']['timeouts'] == 2
+
+
+def test_agent_adds_locally_without_extra_llm_calls():
+    def respond(messages):
+        if isinstance(messages[-1], ToolMessage):
+            return '7です'
+        return AIMessage(content='', tool_calls=[{'name': 'add', 'args': {'a': 3, 'b': 4}, 'id': 'call_1'}])
+
+    model = ScriptedChatModel(responses=[respond])
+    result = build_agent(model).invoke({'messages': ['3 + 4の計算結果は？']})
+    assert result['messages'][-2].content == '7'
+    assert result['messages'][-1].content == '7です'
+    assert model.call_count == 2
+
+
+def test_thread_pool_is_shut_down_with_the_node():
+    node = ParallelToolNode([lookup])
+    node.invoke(_calls('lookup'))
+    executor = node.executor
+    assert executor._threads
+    del node
+    gc.collect()
+    # 捨てられたノードのスレッドはプールと一緒に終わる
+    for thread in list(executor._threads):
+        thread.join(1)
+        assert not thread.is_alive()
+
+    node = ParallelToolNode([lookup])
+    node.close()
+    assert node.executor._shutdown
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.store.base import PutOp
+from langgraph.store.memory import InMemoryStore
+
+from src.bench.fake_llm import ScriptedChatModel
+from src.graph.store import build_graph
+from src.graph.write_behind_store import WriteBehindStore
+
+NAMESPACE = ('memories', '1')
+
+
+def _wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+class RecordingStore(InMemoryStore):
+    """batchの呼び出しを記録し、gateが開くまで書き込みを止められるInMemoryStore"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes: list[int] = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def batch(self, ops):
+        ops = list(ops)
+        puts = sum(isinstance(op, PutOp) for op in ops)
+        if puts:
+            self.gate.wait()
+            self.writes.append(puts)
+        return super().batch(ops)
+
+
+def test_reads_see_buffered_writes_before_flush():
+    backing = RecordingStore()
+    backing.put(NAMESPACE, 'old', {'data': 'Lives in Tokyo'})
+    backing.put(NAMESPACE, 'gone', {'data': 'Likes tea'})
+    backing.writes.clear()
+    with WriteBehindStore(backing, flush_interval=60) as store:
+        store.put(NAMESPACE, 'name', {'data': 'User name is Bob'})
+        store.put(NAMESPACE, 'old', {'data': 'Lives in Osaka'})
+        store.delete(NAMESPACE, 'gone')
+
+        assert backing.writes == []
+        assert store.get(NAMESPACE, 'name').value == {'data': 'User name is Bob'}
+        assert store.get(NAMESPACE, 'gone') is None
+        assert {item.key: item.value['data'] for item in store.search(NAMESPACE)} == {
+            'old': 'Lives in Osaka',
+            'name': 'User name is Bob',
+        }
+        assert [item.key for item in store.search(NAMESPACE, filter={'data': 'Lives in Osaka'})] == ['old']
+        assert len(store.search(NAMESPACE, limit=1)) == 1
+        assert store.search(('memories', '2')) == []
+    # withブロックを抜けるときに1回のbatchでまとめて書き込む
+    assert backing.writes == [3]
+    assert backing.get(NAMESPACE, 'old').value == {'data': 'Lives in Osaka'}
+    assert backing.get(NAMESPACE, 'gone') is None
+
+
+def test_writes_stay_readable_while_flushing():
+    backing = RecordingStore()
+    store = WriteBehindStore(backing, flush_interval=60)
+    store.put(NAMESPACE, 'a', {'data': 'first'})
+    store.put(NAMESPACE, 'a', {'data': 'second'})
+    backing.gate.clear()
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    _wait_until(lambda: store._inflight)
+    store.put(NAMESPACE, 'b', {'data': 'third'})
+    assert [item.value['data'] for item in store.search(NAMESPACE)] == ['second', 'third']
+    backing.gate.set()
+    flusher.join()
+    store.close()
+
+    assert backing.writes == [1, 1]
+    assert store.stats.summary()['coalesced'] == 1
+    assert store.pending == 0
+
+
+def test_graph_run_end_triggers_flush():
+    backing = RecordingStore()
+    store = WriteBehindStore(backing, flush_interval=60)
+    prompts = []
+
+    def respond(messages):
+        prompts.append(messages[0].content)
+        return AIMessage(content='ok')
+
+    graph = build_graph(model=ScriptedChatModel(responses=[respond]), store=store)
+    # RunnableBindingで包まずに、コンパイルしたグラフのままコールバックを付ける
+    assert isinstance(graph, CompiledStateGraph)
+    assert graph.store is store
+    config = {'configurable': {'thread_id': '1', 'user_id': '1'}}
+    backing.gate.clear()
+    graph.invoke({'messages': [('user', 'Remember: my name is Bob')]}, config)
+    # 書き込みが止まっていても実行は終わり、次の実行では記憶が読める
+    graph.invoke({'messages': [('user', 'What is my name?')]}, config)
+    assert 'Bob' in prompts[1]
+    # 間隔(60秒)を待たずに、実行の終わりでflushが始まっている
+    _wait_until(lambda: store._inflight)
+    backing.gate.set()
+    _wait_until(lambda: backing.writes == [1])
+    assert len(backing.search(NAMESPACE)) == 1
+    store.close()
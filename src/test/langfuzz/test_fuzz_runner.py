@@ -0,0 +1,80 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from src.bench.openai_stub import OpenAIStubServer
+from src.langfuzz.fuzz_runner import ClientPool, TokenBucket, run_fuzz
+
+
+async def _fuzz(questions, *, seed=0, fail_every=None, concurrency=4, rate=None):
+    async with OpenAIStubServer(latency=0.005, fail_every=fail_every) as server:
+        async with ClientPool(concurrency, base_url=server.base_url, api_key='stub') as pool:
+            results, stats = await run_fuzz(
+                questions, client=pool, concurrency=concurrency, rate=rate, base_delay=0.001, seed=seed
+            )
+    return results, stats, server
+
+
+def test_runs_concurrently_on_pooled_connections_and_retries():
+    questions = [f'質問 {i}' for i in range(40)]
+    results, stats, server = asyncio.run(_fuzz(questions, fail_every=7))
+
+    assert [r.answer for r in results] == [f'stub: {q}' for q in questions]
+    assert stats.completed == 40
+    assert stats.errors == 0
+    assert stats.retries == server.rate_limited > 0
+    assert 1 < server.max_in_flight <= 4
+    assert server.connections <= 4
+
+
+def test_seed_makes_system_messages_reproducible():
+    questions = [f'質問 {i}' for i in range(20)]
+    first, _, _ = asyncio.run(_fuzz(questions, seed=1, fail_every=3))
+    second, _, _ = asyncio.run(_fuzz(questions, seed=1, concurrency=8))
+    other, _, _ = asyncio.run(_fuzz(questions, seed=2))
+
+    messages = [r.system_message for r in first]
+    assert messages == [r.system_message for r in second]
+    assert messages != [r.system_message for r in other]
+    assert len(set(messages)) == 2
+
+
+def test_gives_up_after_max_retries():
+    async def fuzz():
+        async with OpenAIStubServer(fail_every=1) as server:
+            async with ClientPool(2, base_url=server.base_url, api_key='stub') as pool:
+                return await run_fuzz(['質問'], client=pool, max_retries=2, base_delay=0.001)
+
+    results, stats = asyncio.run(fuzz())
+    assert results[0].attempts == 3
+    assert 'RateLimitError' in results[0].error
+    assert stats.errors == 1
+
+
+def test_token_bucket_limits_rate():
+    async def acquire_all():
+        bucket = TokenBucket(rate=100, capacity=1)
+        start = time.perf_counter()
+        for _ in range(11):
+            await bucket.acquire()
+        return time.perf_counter() - start
+
+    assert asyncio.run(acquire_all()) >= 0.09
+
+
+def test_unexpected_error_fails_only_that_question():
+    class Completions:
+        async def create(self, *, model, messages):
+            question = messages[-1]['content']
+            if question == '壊れた質問':
+                raise ValueError('応答を読めない')
+            message = SimpleNamespace(content=f'answer: {question}')
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+    questions = ['質問 0', '壊れた質問', '質問 2']
+    results, stats = asyncio.run(run_fuzz(questions, client=client, concurrency=2))
+
+    assert [r.answer for r in results] == ['answer: 質問 0', None, 'answer: 質問 2']
+    assert 'ValueError' in results[1].error
+    assert (stats.completed, stats.errors) == (3, 1)